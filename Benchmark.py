@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from EnvDataDLCli import log_to_stderr
+from MockPortal import MockPortal
+from PhaseTracer import PhaseTracer, percentile
+from SelectorCache import SelectorCache
+from SessionCache import SessionCache
+
+BACKENDS = ('playwright', 'playwright-http', 'selenium')
+
+# Exit codes
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+
+
+class PortalBenchmark:
+    """Run the download backends end to end against a local MockPortal and measure them.
+
+    Every backend gets a fresh portal, download folder, session cache and
+    selector cache, so runs do not warm each other up. Per-SN latency is
+    measured by the portal, from the first query of an SN to its export.
+    """
+
+    def __init__(self, sn_count=20, days=1, workers=4, latency=0.2, jitter=0.1, error_rate=0.0, no_data_count=0,
+                 rows_per_day=1440, headless=True, seed=1, log_message=None):
+        self.sn_count = max(1, sn_count)
+        self.days = max(1, days)
+        self.workers = max(1, workers)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.no_data_count = min(max(0, no_data_count), self.sn_count)
+        self.rows_per_day = rows_per_day
+        self.headless = headless
+        self.seed = seed
+        self.log_message = log_message or (lambda message: None)
+
+    def get_sns(self):
+        return [f"BM{n + 1:04d}" for n in range(self.sn_count)]
+
+    def get_no_data_sns(self):
+        """SNs without data, spread evenly over the job"""
+        sns = self.get_sns()
+        return {sns[n * self.sn_count // self.no_data_count] for n in range(self.no_data_count)}
+
+    def make_job(self, portal):
+        start_date = date(2024, 5, 1)
+        return {
+            'website': portal.get_url(),
+            'username': portal.username,
+            'password': portal.password,
+            'start_date': start_date,
+            'end_date': start_date + timedelta(days=self.days - 1),
+            'equipment_sns': self.get_sns()
+        }
+
+    def make_downloader(self, backend, folder, tracer):
+        """Create a backend's downloader with caches private to this run"""
+        if backend == 'selenium':
+            from SeleniumDownloader import SeleniumDownloader
+
+            downloader = SeleniumDownloader(
+                folder, worker_count=self.workers, headless=self.headless, log_message=self.log_message,
+                tracer=tracer
+            )
+        else:
+            from PlaywrightDownloader import PlaywrightDownloader
+
+            downloader = PlaywrightDownloader(
+                folder,
+                worker_count=self.workers,
+                http_export=backend == 'playwright-http',
+                headless=self.headless,
+                log_message=self.log_message,
+                tracer=tracer
+            )
+
+        downloader.session_cache = SessionCache(os.path.join(folder, '.sessions'))
+        downloader.selector_cache = SelectorCache(os.path.join(folder, '.selectors.json'))
+        return downloader
+
+    def run_backend(self, backend):
+        """Run one backend against a fresh portal and return its measurements"""
+        portal = MockPortal(
+            latency=self.latency,
+            jitter=self.jitter,
+            error_rate=self.error_rate,
+            no_data_sns=self.get_no_data_sns(),
+            rows_per_day=self.rows_per_day,
+            seed=self.seed
+        )
+        portal.start()
+        folder = tempfile.mkdtemp(prefix='envdatadl_bench_')
+        try:
+            tracer = PhaseTracer()
+            downloader = self.make_downloader(backend, folder, tracer)
+            data = self.make_job(portal)
+
+            started = time.perf_counter()
+            if backend == 'selenium':
+                summary = downloader.run_automation(data)
+            else:
+                summary = asyncio.run(downloader.run_automation(data))
+            elapsed = time.perf_counter() - started
+
+            result = self.build_result(backend, summary, elapsed, portal.get_stats())
+            result['timings'] = tracer.summarize()
+            return result
+        finally:
+            portal.stop()
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def build_result(self, backend, summary, elapsed, stats):
+        """Combine a run summary and the portal's stats into the benchmark result"""
+        latencies = list(stats['task_latencies'].values())
+        # One task per SN, SNs without data cannot succeed
+        expected = summary['total'] - self.no_data_count
+        return {
+            'backend': backend,
+            'total': summary['total'],
+            'successful': summary['successful'],
+            'expected_successful': expected,
+            'success_rate': summary['successful'] / expected if expected else None,
+            'elapsed': elapsed,
+            'throughput_per_minute': summary['successful'] / elapsed * 60 if elapsed else None,
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p95': percentile(latencies, 0.95),
+            'latency_max': max(latencies, default=None),
+            'queries': stats['queries'],
+            'server_errors_injected': stats['server_errors'],
+            'error': summary['error']
+        }
+
+    def run(self, backends):
+        """Run every backend in turn and return their results"""
+        results = []
+        for backend in backends:
+            self.log_message(f"⏱️  Benchmarking {backend}...")
+            try:
+                results.append(self.run_backend(backend))
+            except Exception as e:
+                results.append({'backend': backend, 'error': str(e)})
+        return results
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compare results with a baseline run; returns a message per metric that got worse than tolerance allows"""
+    baseline_results = {result['backend']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(result['backend'])
+        if not previous or result.get('error') or previous.get('error'):
+            continue
+
+        # Higher is better for throughput and success rate, lower for latency
+        for metric, higher_is_better in (('throughput_per_minute', True), ('success_rate', True),
+                                         ('latency_p95', False)):
+            old, new = previous.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            worse = new < old * (1 - tolerance) if higher_is_better else new > old * (1 + tolerance)
+            if worse:
+                regressions.append(f"{result['backend']} {metric}: {old:.2f} -> {new:.2f}")
+    return regressions
+
+
+def format_value(value, pattern):
+    return '-' if value is None else pattern.format(value)
+
+
+def print_results(results):
+    """Print a results table on stdout"""
+    print(f"{'backend':<16} {'ok/expected':>11} {'success':>8} {'elapsed':>8} {'per min':>8} "
+          f"{'p50':>7} {'p95':>7} {'max':>7}")
+    for result in results:
+        if 'total' not in result:
+            print(f"{result['backend']:<16} error: {result['error']}")
+            continue
+        print(
+            f"{result['backend']:<16} "
+            f"{str(result['successful']) + '/' + str(result['expected_successful']):>11} "
+            f"{format_value(result['success_rate'], '{:.0%}'):>8} "
+            f"{format_value(result['elapsed'], '{:.1f}s'):>8} "
+            f"{format_value(result['throughput_per_minute'], '{:.1f}'):>8} "
+            f"{format_value(result['latency_p50'], '{:.2f}s'):>7} "
+            f"{format_value(result['latency_p95'], '{:.2f}s'):>7} "
+            f"{format_value(result['latency_max'], '{:.2f}s'):>7}"
+        )
+        if result['error']:
+            print(f"{'':<16} error: {result['error']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the download backends end to end against a local mock portal."
+    )
+    parser.add_argument("--backend", action="append", choices=BACKENDS,
+                        help="backend to benchmark, repeatable (default: all)")
+    parser.add_argument("--sns", type=int, default=20, help="equipment SNs in the job (default: 20)")
+    parser.add_argument("--days", type=int, default=1, help="days in the job's date range (default: 1)")
+    parser.add_argument("--workers", type=int, default=4, help="parallel download workers (default: 4)")
+    parser.add_argument("--latency", type=float, default=0.2, help="portal seconds per API call (default: 0.2)")
+    parser.add_argument("--jitter", type=float, default=0.1,
+                        help="extra random portal seconds per API call (default: 0.1)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of query/export calls answered with HTTP 500 (default: 0)")
+    parser.add_argument("--no-data", type=int, default=0, help="SNs with nothing to export (default: 0)")
+    parser.add_argument("--rows-per-day", type=int, default=1440, help="readings per day in exports (default: 1440)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for portal latency and errors (default: 1)")
+    parser.add_argument("--show-browser", action="store_true", help="run the browsers with a visible window")
+    parser.add_argument("--verbose", action="store_true", help="log the downloaders' progress on stderr")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative slowdown against the baseline (default: 0.2)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    benchmark = PortalBenchmark(
+        sn_count=args.sns,
+        days=args.days,
+        workers=args.workers,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        no_data_count=args.no_data,
+        rows_per_day=args.rows_per_day,
+        headless=not args.show_browser,
+        seed=args.seed,
+        log_message=log_to_stderr if args.verbose else None
+    )
+    results = benchmark.run(args.backend or BACKENDS)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            return EXIT_REGRESSION
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
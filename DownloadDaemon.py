@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import sys
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+from EnvDataDLCli import EXIT_ERROR, get_exit_code
+from JobFile import JobFileReader
+from JobLedger import JobLedger
+from JobScheduler import ConcurrencyBudget
+from PhaseTracer import PhaseTracer
+
+DEFAULT_PORT = 8765
+
+
+def is_loopback(host):
+    """Check whether a listen address only accepts connections from this machine"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class WarmSession:
+    """A logged-in browser kept open for one account, with the downloader that drives it"""
+
+    def __init__(self, downloader, browser, context, page):
+        self.downloader = downloader
+        self.browser = browser
+        self.context = context
+        self.page = page
+        self.created_at = time.time()
+        self.last_used = time.time()
+        self.jobs = 0
+
+    async def close(self):
+        """Close the browser, ignoring a browser that already went away"""
+        try:
+            await self.browser.close()
+        except Exception:
+            pass
+
+
+class DownloadDaemon:
+    """Keep logged-in browsers warm and run download jobs sent over a local socket.
+
+    A client sends one JSON job spec (see JobFileReader.parse_spec) on a single
+    line. The daemon answers with JSON lines: a "result" event for every task
+    as soon as it finishes, then a "done" event with the job summary, or an
+    "error" event. Jobs of one account run one after another on its browser;
+    jobs of different accounts run at the same time under a shared budget.
+    Browsers are recycled after recycle_minutes, or closed after idle_minutes
+    without jobs.
+
+    Job specs carry passwords, so the daemon only listens on a loopback
+    address unless a shared token is set; with a token, every job spec must
+    carry it in its "token" field.
+    """
+
+    def __init__(self, download_folder, host='127.0.0.1', port=DEFAULT_PORT, max_workers=8, per_site_workers=4,
+                 headless=True, block_resources=True, window_days=0, recycle_minutes=30, idle_minutes=15,
+                 token=None, log_message=None):
+        self.download_folder = download_folder
+        self.host = host
+        self.token = token
+        self.port = port
+        self.max_workers = max(1, max_workers)
+        self.per_site_workers = max(1, per_site_workers)
+        self.headless = headless
+        self.block_resources = block_resources
+        self.window_days = window_days
+        self.recycle_seconds = recycle_minutes * 60
+        self.idle_seconds = idle_minutes * 60
+        self.log_message = log_message or self.print_message
+        self.job_reader = JobFileReader()
+        self.sessions = {}
+        self.account_locks = {}
+
+    def print_message(self, message):
+        """Default log output: timestamped lines on stdout"""
+        print(f"{datetime.now().strftime('%H:%M:%S')} - {message}", flush=True)
+
+    def get_account_lock(self, account):
+        """Lock held while a job, or the recycler, uses an account's browser"""
+        if account not in self.account_locks:
+            self.account_locks[account] = asyncio.Lock()
+        return self.account_locks[account]
+
+    def is_expired(self, session):
+        """Check whether a warm browser is due to be recycled"""
+        return time.time() - session.created_at > self.recycle_seconds
+
+    def make_downloader(self, data):
+        """Create the downloader that serves an account"""
+        from PlaywrightDownloader import PlaywrightDownloader
+
+        site = urlparse(data['website']).netloc or data['website']
+        username = data['username']
+        return PlaywrightDownloader(
+            self.download_folder,
+            worker_count=min(self.per_site_workers, self.max_workers),
+            headless=self.headless,
+            block_resources=self.block_resources,
+            window_days=self.window_days,
+            log_message=lambda message: self.log_message(f"[{username}@{site}] {message.lstrip()}"),
+            ledger=self.ledger,
+            slots=self.budget.for_site(site)
+        )
+
+    async def get_session(self, account, data):
+        """Get the account's warm browser, recycling it if it expired or was logged out.
+
+        Returns None if the login failed.
+        """
+        session = self.sessions.get(account)
+        if session:
+            export_url = session.downloader.get_export_url(data['website'])
+            if not self.is_expired(session) and await session.downloader.check_session(session.page, export_url):
+                return session
+
+            self.log_message(f"♻️  Recycling browser for {data['username']} after {session.jobs} job(s)")
+            del self.sessions[account]
+            await session.close()
+
+        downloader = self.make_downloader(data)
+        browser, context, page = await downloader.open_session(self.playwright, data)
+        session = WarmSession(downloader, browser, context, page)
+        if page is None:
+            await session.close()
+            return None
+
+        self.sessions[account] = session
+        return session
+
+    async def run_job(self, data, on_result):
+        """Run one job on its account's warm browser and return the job summary"""
+        account = (data['website'], data['username'])
+        async with self.get_account_lock(account):
+            # Skip SN/date pairs already downloaded, without starting a browser if nothing is left
+            session = self.sessions.get(account)
+            downloader = session.downloader if session else self.make_downloader(data)
+            tasks, pending_tasks, results = downloader.plan_job(data)
+            if not pending_tasks:
+                return downloader.build_summary(data, len(tasks), results)
+
+            session = await self.get_session(account, data)
+            if session is None:
+                return downloader.build_summary(data, len(tasks), results, error="Login failed")
+
+            # Time each job on its own, so a long-lived browser does not collect spans forever
+            downloader = session.downloader
+            downloader.on_result = on_result
+            downloader.tracer = PhaseTracer()
+            try:
+                summary = await downloader.run_job(
+                    session.browser, session.context, session.page, data, tasks, pending_tasks, results
+                )
+                summary['timings'] = downloader.tracer.log_summary(downloader.log_message)
+                return summary
+            finally:
+                downloader.on_result = None
+                downloader.selector_cache.save()
+                session.jobs += 1
+                session.last_used = time.time()
+
+    async def recycle_sessions(self, interval=60):
+        """Close browsers that are due to be recycled or have been idle too long"""
+        while True:
+            await asyncio.sleep(interval)
+            for account, session in list(self.sessions.items()):
+                lock = self.get_account_lock(account)
+                idle = time.time() - session.last_used
+                if lock.locked() or (not self.is_expired(session) and idle < self.idle_seconds):
+                    continue
+
+                async with lock:
+                    if self.sessions.get(account) is session:
+                        del self.sessions[account]
+                        await session.close()
+                        self.log_message(f"💤 Closed browser for {account[1]} after {session.jobs} job(s)")
+
+    async def handle_client(self, reader, writer):
+        """Read one job from a client and stream its results back"""
+        def send(event):
+            writer.write((json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8'))
+
+        def on_result(sn, start_date, end_date, status):
+            send({
+                'event': 'result',
+                'sn': sn,
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+                'status': status
+            })
+
+        try:
+            spec = json.loads(await reader.readline())
+            if self.token and not hmac.compare_digest(str(spec.pop('token', '')), self.token):
+                self.log_message("⛔ Rejected a job with a missing or wrong token")
+                send({'event': 'error', 'error': "Missing or wrong token"})
+                await writer.drain()
+                return
+
+            data = self.job_reader.parse_spec(spec)
+            error = self.job_reader.validate(data)
+            if error:
+                send({'event': 'error', 'error': error})
+            else:
+                self.log_message(f"📨 Job for {data['username']}: {len(data['equipment_sns'])} SN(s), "
+                                 f"{data['start_date']} to {data['end_date']}")
+                summary = await self.run_job(data, on_result)
+                send({'event': 'done', 'summary': summary})
+            await writer.drain()
+        except Exception as e:
+            send({'event': 'error', 'error': str(e)})
+            try:
+                await writer.drain()
+            except Exception:
+                pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Serve jobs until cancelled"""
+        if not self.token and not is_loopback(self.host):
+            raise ValueError(f"Refusing to listen on {self.host} without a token, job specs carry passwords")
+
+        from playwright.async_api import async_playwright
+
+        self.ledger = JobLedger(self.download_folder)
+        self.budget = ConcurrencyBudget(self.max_workers, self.per_site_workers)
+        try:
+            async with async_playwright() as p:
+                self.playwright = p
+                server = await asyncio.start_server(self.handle_client, self.host, self.port)
+                recycler = asyncio.ensure_future(self.recycle_sessions())
+                self.log_message(f"🔥 Download daemon listening on {self.host}:{self.port}")
+                try:
+                    async with server:
+                        await server.serve_forever()
+                finally:
+                    recycler.cancel()
+                    for session in list(self.sessions.values()):
+                        await session.close()
+                    self.sessions.clear()
+        finally:
+            self.ledger.close()
+
+
+def submit(spec, host='127.0.0.1', port=DEFAULT_PORT, token=None):
+    """Send a job spec to a running daemon and yield its events as they arrive"""
+    if token:
+        spec = dict(spec, token=token)
+    with socket.create_connection((host, port)) as sock:
+        sock.sendall((json.dumps(spec, ensure_ascii=False) + '\n').encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def build_spec(args):
+    """Build the job spec to submit from a job file and the command-line overrides"""
+    data = JobFileReader().load(args.job)
+    if args.sn:
+        data['equipment_sns'] = args.sn
+    return {
+        'website': data['website'],
+        'username': data['username'],
+        'password': data['password'],
+        'start_date': args.start or data['start_date'].isoformat(),
+        'end_date': args.end or args.start or data['end_date'].isoformat(),
+        'equipment_sns': data['equipment_sns']
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Keep logged-in browsers warm and serve download jobs locally.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the daemon")
+    serve.add_argument("--host", default="127.0.0.1",
+                       help="address to listen on (default: 127.0.0.1); other than loopback needs a token")
+    serve.add_argument("--token", default=os.environ.get('ENVDATADL_DAEMON_TOKEN'),
+                       help="shared token every job must carry (default: $ENVDATADL_DAEMON_TOKEN)")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    serve.add_argument("--output", default=os.path.join(os.path.expanduser("~"), "Downloads"),
+                       help="download folder (default: ~/Downloads)")
+    serve.add_argument("--workers", type=int, default=8, help="downloads at once over all jobs (default: 8)")
+    serve.add_argument("--site-workers", type=int, default=4, help="downloads at once per portal host (default: 4)")
+    serve.add_argument("--window-days", type=int, default=0,
+                       help="split date ranges into windows of this many days (default: 0)")
+    serve.add_argument("--show-browser", action="store_true", help="run the browsers with a visible window")
+    serve.add_argument("--no-block-resources", action="store_true",
+                       help="load images, fonts and third-party requests")
+    serve.add_argument("--recycle-minutes", type=float, default=30,
+                       help="restart each account's browser after this long (default: 30)")
+    serve.add_argument("--idle-minutes", type=float, default=15,
+                       help="close an account's browser after this long without jobs (default: 15)")
+
+    send = commands.add_parser("submit", help="send a job to a running daemon and print its results")
+    send.add_argument("job", help="job workbook (.xlsx) or JSON job spec (.json) with the account")
+    send.add_argument("--host", default="127.0.0.1", help="daemon address (default: 127.0.0.1)")
+    send.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"daemon port (default: {DEFAULT_PORT})")
+    send.add_argument("--token", default=os.environ.get('ENVDATADL_DAEMON_TOKEN'),
+                      help="the daemon's shared token (default: $ENVDATADL_DAEMON_TOKEN)")
+    send.add_argument("--sn", action="append", help="equipment SN to download instead of the job's (repeatable)")
+    send.add_argument("--start", help='start date, e.g. 2024-05-01 or "=today()-1" (default: the job\'s)')
+    send.add_argument("--end", help="end date (default: the start date)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "serve":
+        daemon = DownloadDaemon(
+            args.output,
+            host=args.host,
+            port=args.port,
+            max_workers=args.workers,
+            per_site_workers=args.site_workers,
+            headless=not args.show_browser,
+            block_resources=not args.no_block_resources,
+            window_days=args.window_days,
+            recycle_minutes=args.recycle_minutes,
+            idle_minutes=args.idle_minutes,
+            token=args.token
+        )
+        try:
+            asyncio.run(daemon.serve())
+        except KeyboardInterrupt:
+            pass
+        except ValueError as e:
+            print(f"❌ {str(e)}", file=sys.stderr)
+            return EXIT_ERROR
+        return 0
+
+    exit_code = EXIT_ERROR
+    try:
+        for event in submit(build_spec(args), args.host, args.port, args.token):
+            print(json.dumps(event, ensure_ascii=False), flush=True)
+            if event['event'] == 'done':
+                exit_code = get_exit_code(event['summary'])
+    except Exception as e:
+        print(json.dumps({'event': 'error', 'error': str(e)}, ensure_ascii=False))
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import os
+import shutil
+import threading
+import time
+
+
+class DownloadTracker:
+    """Give every export its own download folder and match the file Chrome writes there to the export's task.
+
+    Before each export, prepare creates a fresh subfolder of the worker's
+    private folder and the caller points Chrome at it, so a file can only be
+    credited to the export that started it. Files that turn up after their
+    export gave up, extra files and leftovers of earlier runs are never
+    handed to another task; quarantine moves them aside. File system events
+    from the optional watchdog package wake the waits as soon as something
+    changes; without it the folders are polled.
+    """
+
+    PARTIAL_SUFFIX = '.crdownload'
+
+    # Chrome's placeholder names before the real filename is known
+    PLACEHOLDER_PREFIXES = ('Unconfirmed ', '.com.google.Chrome.')
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.condition = threading.Condition()
+        self.folders = {}
+        self.started = {}
+        self.export_count = 0
+        self.observer = None
+        self.poll_interval = 0.1
+
+    def start(self):
+        """Start watching the folder for file system events; returns False if watchdog is missing and it is polled"""
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+
+        handler = FileSystemEventHandler()
+        handler.on_any_event = lambda event: self.notify()
+        self.observer = Observer()
+        self.observer.schedule(handler, self.folder, recursive=True)
+        self.observer.start()
+        # Events wake the waits, polling is only a safety net
+        self.poll_interval = 1.0
+        return True
+
+    def stop(self):
+        """Stop watching the folder"""
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+
+    def notify(self):
+        """Wake every wait to re-check the folder"""
+        with self.condition:
+            self.condition.notify_all()
+
+    def prepare(self, key):
+        """Create the empty folder the next export for key downloads into, and return its path.
+
+        A retry of the same key gets a new folder, so a late file of the
+        attempt before cannot be taken for the retry's.
+        """
+        with self.condition:
+            self.export_count += 1
+            export_folder = os.path.join(self.folder, f"export_{self.export_count}")
+            os.makedirs(export_folder, exist_ok=True)
+            self.folders[key] = export_folder
+            self.started.pop(key, None)
+            return export_folder
+
+    def get_final_name(self, name):
+        """Name of the finished file for a partial or finished download"""
+        if name.endswith(self.PARTIAL_SUFFIX):
+            return name[:-len(self.PARTIAL_SUFFIX)]
+        return name
+
+    def is_complete(self, path):
+        """Check that a download has been fully written"""
+        return os.path.exists(path) and not os.path.exists(path + self.PARTIAL_SUFFIX)
+
+    def wait_for_start(self, key, timeout=15):
+        """Wait for the download of key's export to appear in its folder; returns its final path, or None"""
+        export_folder = self.folders[key]
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                names = sorted(
+                    name for name in os.listdir(export_folder) if not name.startswith(self.PLACEHOLDER_PREFIXES)
+                )
+                if names:
+                    path = os.path.join(export_folder, self.get_final_name(names[0]))
+                    self.started[key] = path
+                    return path
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(min(remaining, self.poll_interval))
+
+    def wait_for_completion(self, timeout=60):
+        """Wait until every started download is complete, or the timeout passes.
+
+        Returns {key: path}, where path is None for downloads that did not finish.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                pending = [key for key, path in self.started.items() if not self.is_complete(path)]
+                remaining = deadline - time.time()
+                if not pending or remaining <= 0:
+                    break
+                self.condition.wait(min(remaining, self.poll_interval))
+
+        return {key: path if self.is_complete(path) else None for key, path in self.started.items()}
+
+    def quarantine(self, quarantine_folder):
+        """Move every finished file still under the folder into quarantine_folder and remove the folder.
+
+        Call it once the downloads credited to tasks have been moved out and
+        Chrome has stopped. Returns the names of the quarantined files.
+        """
+        moved = []
+        for parent, _, names in os.walk(self.folder):
+            for name in names:
+                if name.endswith(self.PARTIAL_SUFFIX):
+                    continue
+                os.makedirs(quarantine_folder, exist_ok=True)
+                base, ext = os.path.splitext(name)
+                target = os.path.join(quarantine_folder, name)
+                copy = 1
+                while os.path.exists(target):
+                    target = os.path.join(quarantine_folder, f"{base} ({copy}){ext}")
+                    copy += 1
+                os.replace(os.path.join(parent, name), target)
+                moved.append(os.path.basename(target))
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+        return moved
@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+
+from JobFile import JobFileReader
+from PhaseTracer import PhaseTracer
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILED_DOWNLOADS = 1
+EXIT_ERROR = 2
+
+
+def log_to_stderr(message):
+    """Log output for batch runs: stdout is kept for the JSON summary"""
+    print(f"{datetime.now().strftime('%H:%M:%S')} - {message}", file=sys.stderr, flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Download equipment data without the GUI. Prints a JSON summary of the run on stdout."
+    )
+    parser.add_argument("job", help="job workbook (.xlsx), JSON job spec (.json) or a folder of job files")
+    parser.add_argument("--backend", choices=["playwright", "selenium"], default="playwright",
+                        help="browser automation backend (default: playwright)")
+    parser.add_argument("--output", default=os.path.join(os.path.expanduser("~"), "Downloads"),
+                        help="download folder (default: ~/Downloads)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="parallel download workers: pages for Playwright, Chrome instances for Selenium "
+                             "(default: 4); for a job folder, the total over all jobs")
+    parser.add_argument("--site-workers", type=int, default=None,
+                        help="for a job folder, parallel downloads per portal host (default: --workers)")
+    parser.add_argument("--window-days", type=int, default=0,
+                        help="split the date range into windows of this many days, Playwright only (default: 0)")
+    parser.add_argument("--http-export", action="store_true",
+                        help="replay the export request over HTTP, Playwright only")
+    parser.add_argument("--show-browser", action="store_true", help="run the browser with a visible window")
+    parser.add_argument("--no-block-resources", action="store_true",
+                        help="load images, fonts and third-party requests")
+    parser.add_argument("--trace", help="append per-phase timing spans to this JSON-lines file")
+    parser.add_argument("--quiet", action="store_true", help="do not log progress on stderr")
+    args = parser.parse_args(argv)
+
+    if args.backend == "selenium" and (args.window_days or args.http_export):
+        parser.error("--window-days and --http-export are only supported by the Playwright backend")
+    return args
+
+
+def run_job(args, data, tracer):
+    """Run the job with the selected backend and return its summary"""
+    log_message = (lambda message: None) if args.quiet else log_to_stderr
+
+    if args.backend == "selenium":
+        from SeleniumDownloader import SeleniumDownloader
+
+        downloader = SeleniumDownloader(
+            args.output,
+            worker_count=args.workers,
+            headless=not args.show_browser,
+            block_resources=not args.no_block_resources,
+            log_message=log_message,
+            tracer=tracer
+        )
+        return downloader.run_automation(data)
+
+    from PlaywrightDownloader import PlaywrightDownloader
+
+    downloader = PlaywrightDownloader(
+        args.output,
+        worker_count=args.workers,
+        http_export=args.http_export,
+        headless=not args.show_browser,
+        block_resources=not args.no_block_resources,
+        window_days=args.window_days,
+        log_message=log_message,
+        tracer=tracer
+    )
+    return asyncio.run(downloader.run_automation(data))
+
+
+def run_job_folder(args, tracer):
+    """Run every job file in a folder with the scheduler and return (summaries, exit code)"""
+    from JobScheduler import JobScheduler
+
+    scheduler = JobScheduler(
+        args.output,
+        max_workers=args.workers,
+        per_site_workers=args.site_workers or args.workers,
+        headless=not args.show_browser,
+        block_resources=not args.no_block_resources,
+        window_days=args.window_days,
+        log_message=(lambda message: None) if args.quiet else log_to_stderr,
+        tracer=tracer
+    )
+    jobs, errors = scheduler.load_jobs(args.job)
+    summaries = asyncio.run(scheduler.run(jobs)) if jobs else {}
+
+    results = [{'job': path, 'error': error} for path, error in errors.items()]
+    for path, summary in summaries.items():
+        summary['job'] = path
+        summary['backend'] = args.backend
+        results.append(summary)
+
+    exit_code = max([get_exit_code(result) for result in results], default=EXIT_OK)
+    if not results:
+        results.append({'job': args.job, 'error': "No job files found"})
+        exit_code = EXIT_ERROR
+    return results, exit_code
+
+
+def get_exit_code(summary):
+    """Map a run summary to the process exit code"""
+    if summary.get('error'):
+        return EXIT_ERROR
+    if summary['failed'] or summary['failed_saves']:
+        return EXIT_FAILED_DOWNLOADS
+    return EXIT_OK
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tracer = PhaseTracer(args.trace)
+    try:
+        return run(args, tracer)
+    finally:
+        tracer.close()
+
+
+def run(args, tracer):
+    """Run the job file or job folder, print the JSON summary and return the exit code"""
+    if os.path.isdir(args.job):
+        if args.backend != "playwright" or args.http_export:
+            error = "Job folders run on the Playwright backend without --http-export"
+            print(json.dumps({'job': args.job, 'error': error}, ensure_ascii=False))
+            return EXIT_ERROR
+        try:
+            results, exit_code = run_job_folder(args, tracer)
+        except Exception as e:
+            print(json.dumps({'job': args.job, 'error': str(e)}, ensure_ascii=False))
+            return EXIT_ERROR
+        print(json.dumps({'jobs': results, 'timings': tracer.summarize()}, ensure_ascii=False))
+        return exit_code
+
+    try:
+        job_reader = JobFileReader()
+        data = job_reader.load(args.job)
+        error = job_reader.validate(data)
+    except Exception as e:
+        data, error = None, str(e)
+
+    if error:
+        print(json.dumps({'job': args.job, 'error': error}, ensure_ascii=False))
+        return EXIT_ERROR
+
+    # A crash is an error, never mistaken for failed downloads (exit code 1)
+    try:
+        summary = run_job(args, data, tracer)
+    except Exception as e:
+        print(json.dumps({'job': args.job, 'backend': args.backend, 'error': str(e)}, ensure_ascii=False))
+        return EXIT_ERROR
+    summary['job'] = args.job
+    summary['backend'] = args.backend
+    summary['timings'] = tracer.summarize()
+    print(json.dumps(summary, ensure_ascii=False))
+    return get_exit_code(summary)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 # -*- mode: python ; coding: utf-8 -*-
+from PyInstaller.utils.hooks import collect_submodules
 
 
 a = Analysis(
@@ -6,7 +7,8 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    # watchdog picks its file system observer per platform at runtime
+    hiddenimports=collect_submodules('watchdog'),
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
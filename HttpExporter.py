@@ -0,0 +1,374 @@
+import asyncio
+import json
+import os
+import re
+from datetime import datetime
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit, urlunsplit
+
+from RetryPolicy import DOWNLOAD_OK, ERROR, NO_DATA, SERVER_ERROR, TIMEOUT
+
+# Messages the portal answers with when there is nothing to export
+NO_DATA_MESSAGES = ('暫無數據', '暂无数据')
+
+
+def is_file_response(content_type, content_disposition):
+    """Check whether an export response carries a file, rather than a JSON, text or HTML message"""
+    if 'attachment' in (content_disposition or '').lower():
+        return True
+    content_type = (content_type or '').lower()
+    return not any(kind in content_type for kind in ('json', 'text/', 'html'))
+
+
+def is_no_data(content):
+    """Check whether an export answer is the portal's empty-result message"""
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return False
+    if not isinstance(data, dict):
+        return False
+    message = str(data.get('msg') or data.get('message') or '')
+    return any(marker in message for marker in NO_DATA_MESSAGES)
+
+
+def classify_export_response(status, content_type, content_disposition, content):
+    """RetryPolicy status of an export answer, the same for every backend.
+
+    A file is DOWNLOAD_OK and only the portal's empty-result message is
+    NO_DATA; HTTP 5xx is SERVER_ERROR and anything else (4xx, an expired
+    session, a JSON error or an HTML page) is an ERROR, so it is retried.
+    """
+    if status >= 500:
+        return SERVER_ERROR
+    if status >= 400:
+        return ERROR
+    if is_file_response(content_type, content_disposition):
+        return DOWNLOAD_OK
+    return NO_DATA if is_no_data(content) else ERROR
+
+
+class HttpExporter:
+    """Replay the portal's export request over HTTP, without driving the export page.
+
+    The export request (method, URL, headers and body) is captured once from the
+    browser for a known SN and date range, and replayed for every other task by
+    substituting the SN and dates.
+    """
+
+    # Headers that are tied to the captured request and must not be replayed
+    SKIPPED_HEADERS = {'host', 'content-length', 'cookie', 'connection', 'accept-encoding'}
+
+    # Words in field names that hold the SN, used when several fields carry the captured SN's value
+    SN_KEY_HINTS = ('sn', 'serial', 'device', 'equipment')
+
+    def __init__(self, export_request, cookies, get_path, log_message, concurrency=8, retry_policy=None,
+                 circuit_breaker=None):
+        self.export_request = export_request
+        self.cookies = cookies
+        self.get_path = get_path
+        self.log_message = log_message
+        self.concurrency = max(1, concurrency)
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+
+    def build_headers(self):
+        """Build request headers from the captured request plus the browser session cookies"""
+        headers = {
+            name: value for name, value in self.export_request['headers'].items()
+            if not name.startswith(':') and name.lower() not in self.SKIPPED_HEADERS
+        }
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{cookie['name']}={cookie['value']}" for cookie in self.cookies)
+        return headers
+
+    def get_template_dates(self):
+        """The captured request's start and end dates"""
+        return tuple(
+            datetime.strptime(self.export_request[name], '%Y-%m-%d').date() for name in ('start_date', 'end_date')
+        )
+
+    def get_epoch_time(self, value):
+        """Local time of a value holding a Unix timestamp in seconds or milliseconds, or None"""
+        if not re.fullmatch(r'\d{10}(\d{3})?', value):
+            return None
+        try:
+            return datetime.fromtimestamp(int(value) / (1000 if len(value) == 13 else 1))
+        except (OverflowError, OSError, ValueError):
+            return None
+
+    def is_date_field(self, value):
+        """Check whether a value carries one of the captured dates, as text or as a timestamp"""
+        if self.export_request['start_date'] in value or self.export_request['end_date'] in value:
+            return True
+        epoch_time = self.get_epoch_time(value)
+        return epoch_time is not None and epoch_time.date() in self.get_template_dates()
+
+    def find_date_fields(self, fields, sn_fields):
+        """Indexes of the (key, value) fields carrying the captured dates"""
+        return [
+            index for index, (_, value) in enumerate(fields)
+            if index not in sn_fields and self.is_date_field(value)
+        ]
+
+    def has_sn(self):
+        """Check whether the captured request carries the SN in a field, so other SNs can be requested"""
+        fields, _ = self.split_request()
+        return bool(self.find_sn_fields(fields))
+
+    def has_dates(self):
+        """Check whether the captured request carries both dates in fields, so other date ranges can be requested"""
+        fields, _ = self.split_request()
+        values = [fields[index][1] for index in self.find_date_fields(fields, self.find_sn_fields(fields))]
+        template_start, template_end = self.get_template_dates()
+        if template_start == template_end:
+            return bool(values)
+
+        def carries(template_date):
+            text = template_date.strftime('%Y-%m-%d')
+            return any(
+                text in value or (self.get_epoch_time(value) or datetime.min).date() == template_date
+                for value in values
+            )
+
+        return carries(template_start) and carries(template_end)
+
+    def substitute_dates(self, text, start, end):
+        """Replace the captured dates in one value"""
+        template_start = self.export_request['start_date']
+        template_end = self.export_request['end_date']
+        if template_start != template_end:
+            return text.replace(template_start, start).replace(template_end, end)
+
+        # Single-day capture: the last occurrence is the end date, the others the start date
+        head, separator, tail = text.rpartition(template_end)
+        if separator and template_start in head:
+            return head.replace(template_start, start) + end + tail
+        return text.replace(template_start, start)
+
+    def find_sn_fields(self, fields):
+        """Indexes of the (key, value) fields holding the captured SN.
+
+        Only whole values count, so an SN like 10 never matches pageSize=100; if
+        several fields hold it, the ones whose key names an SN win.
+        """
+        matches = [index for index, (_, value) in enumerate(fields) if value == self.export_request['sn']]
+        named = [index for index in matches if any(hint in fields[index][0].lower() for hint in self.SN_KEY_HINTS)]
+        return named or matches
+
+    def substitute_epoch(self, value, epoch_time, date):
+        """Move a timestamp value to another date, keeping its time of day and unit"""
+        timestamp = datetime.combine(date, epoch_time.time()).timestamp()
+        return str(round(timestamp * (1000 if len(value) == 13 else 1)))
+
+    def substitute(self, fields, sn, start_date, end_date):
+        """Replace the captured SN and dates in a list of (key, value) fields, returning the new values"""
+        template_start, template_end = self.get_template_dates()
+        start = start_date.strftime('%Y-%m-%d')
+        end = end_date.strftime('%Y-%m-%d')
+
+        sn_fields = self.find_sn_fields(fields)
+        date_fields = self.find_date_fields(fields, sn_fields)
+
+        values = []
+        for index, (_, value) in enumerate(fields):
+            if index in sn_fields:
+                value = sn
+            elif index in date_fields:
+                # Single-day capture over several fields: the last one is the end date, the others the start date
+                is_end = len(date_fields) > 1 and index == date_fields[-1]
+                epoch_time = self.get_epoch_time(value)
+                if epoch_time is not None:
+                    if template_start != template_end:
+                        is_end = epoch_time.date() == template_end
+                    value = self.substitute_epoch(value, epoch_time, (end_date if is_end else start_date).date())
+                elif template_start != template_end or len(date_fields) == 1:
+                    value = self.substitute_dates(value, start, end)
+                else:
+                    value = value.replace(self.export_request['start_date'], end if is_end else start)
+            values.append(value)
+        return values
+
+    def get_json_fields(self, data, key='', fields=None):
+        """Collect the string and integer fields of a JSON body as (key, value, container, index) in document order.
+
+        Integers are collected as text, so numeric SNs and timestamps are substituted like any other field.
+        """
+        if fields is None:
+            fields = []
+        items = data.items() if isinstance(data, dict) else enumerate(data)
+        for index, value in items:
+            field_key = index if isinstance(data, dict) else key
+            if isinstance(value, str):
+                fields.append((field_key, value, data, index))
+            elif isinstance(value, int) and not isinstance(value, bool):
+                fields.append((field_key, str(value), data, index))
+            elif isinstance(value, (dict, list)):
+                self.get_json_fields(value, field_key, fields)
+        return fields
+
+    def parse_body(self, body):
+        """Split a request body into (fields, rebuild), where rebuild(values) returns the body with new values.
+
+        JSON and form bodies are split into their fields; any other body is one field.
+        """
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if isinstance(data, (dict, list)):
+            json_fields = self.get_json_fields(data)
+
+            def rebuild_json(values):
+                for (_, _, container, index), value in zip(json_fields, values):
+                    # Integer fields stay integers as long as the new value is one
+                    if isinstance(container[index], int) and re.fullmatch(r'-?\d+', value):
+                        value = int(value)
+                    container[index] = value
+                return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+            return [(key, value) for key, value, _, _ in json_fields], rebuild_json
+
+        try:
+            form = parse_qsl(body, keep_blank_values=True, strict_parsing=True)
+        except ValueError:
+            form = None
+        if form:
+            return form, lambda values: urlencode([(key, value) for (key, _), value in zip(form, values)])
+
+        return [('', body)], lambda values: values[0]
+
+    def split_request(self):
+        """Split the captured request's path segments, query and body into (fields, rebuild).
+
+        fields is a list of (key, value); rebuild(values) returns the (url, body) carrying the new values.
+        """
+        url = urlsplit(self.export_request['url'])
+        segments = url.path.split('/')
+        query = parse_qsl(url.query, keep_blank_values=True)
+        body = self.export_request['post_data']
+        body_fields, rebuild_body = self.parse_body(body) if body else ([], None)
+        fields = [('', unquote(segment)) for segment in segments] + query + body_fields
+
+        def rebuild(values):
+            segment_values = values[:len(segments)]
+            query_values = values[len(segments):len(segments) + len(query)]
+            body_values = values[len(segments) + len(query):]
+
+            path = '/'.join(
+                segment if unquote(segment) == value else quote(value, safe='')
+                for segment, value in zip(segments, segment_values)
+            )
+            new_url = url
+            if query_values != [value for _, value in query]:
+                new_url = url._replace(
+                    query=urlencode([(key, value) for (key, _), value in zip(query, query_values)])
+                )
+            new_url = urlunsplit(new_url._replace(path=path))
+
+            new_body = body
+            if body and body_values != [value for _, value in body_fields]:
+                new_body = rebuild_body(body_values)
+            return new_url, new_body
+
+        return fields, rebuild
+
+    def build_request(self, sn, start_date, end_date):
+        """Substitute the SN and dates into the captured export request's path segments, query and body fields"""
+        fields, rebuild = self.split_request()
+        url, body = rebuild(self.substitute(fields, sn, start_date, end_date))
+        return self.export_request['method'], url, body
+
+    def get_filename(self, response):
+        """Get the download filename from Content-Disposition"""
+        disposition = response.headers.get('Content-Disposition', '')
+        match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", disposition, re.IGNORECASE)
+        if not match:
+            match = re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE)
+        if match:
+            return os.path.basename(unquote(match.group(1).strip()))
+        return "export.xlsx"
+
+    def write_file(self, path, content):
+        """Write downloaded content to disk"""
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    async def export_sn(self, session, sn, start_date, end_date):
+        """Export one SN and date range over HTTP and save the returned file.
+
+        Returns (status, path), where status is a RetryPolicy status and path is None unless it succeeded.
+        """
+        method, url, body = self.build_request(sn, start_date, end_date)
+        try:
+            async with session.request(method, url, data=body.encode('utf-8') if body else None) as response:
+                content = await response.read()
+
+                # Anything but a file (a JSON message, a login or error page) is never saved as a download
+                status = classify_export_response(
+                    response.status,
+                    response.headers.get('Content-Type'),
+                    response.headers.get('Content-Disposition'),
+                    content
+                )
+                if status != DOWNLOAD_OK:
+                    message = content[:200].decode('utf-8', 'replace')
+                    if status == NO_DATA:
+                        self.log_message(f"  ⚠️  No data available for SN {sn}: {message}")
+                    else:
+                        self.log_message(f"  ❌ Export failed for SN {sn}: HTTP {response.status} {message}")
+                    return status, None
+
+                path = self.get_path(sn, start_date, end_date, self.get_filename(response))
+                await asyncio.to_thread(self.write_file, path, content)
+                self.log_message(f"💾 Downloaded: {os.path.basename(path)}")
+                return DOWNLOAD_OK, path
+
+        except asyncio.TimeoutError:
+            self.log_message(f"  ❌ Export timed out for SN {sn}")
+            return TIMEOUT, None
+        except Exception as e:
+            self.log_message(f"  ❌ Error exporting SN {sn}: {str(e)}")
+            return ERROR, None
+
+    async def export_with_retry(self, session, sn, start_date, end_date):
+        """Export one task, retrying transient failures with backoff while the circuit breaker allows it"""
+        attempt = 0
+        while True:
+            if self.circuit_breaker:
+                wait_time = self.circuit_breaker.get_wait_time()
+                while wait_time > 0:
+                    await asyncio.sleep(wait_time)
+                    wait_time = self.circuit_breaker.get_wait_time()
+
+            status, path = await self.export_sn(session, sn, start_date, end_date)
+
+            if self.circuit_breaker and self.circuit_breaker.record(status):
+                self.log_message(
+                    f"⛔ Portal looks degraded, pausing exports for {self.circuit_breaker.cooldown:.0f}s"
+                )
+
+            if not self.retry_policy or not self.retry_policy.should_retry(status, attempt):
+                return status, path
+
+            delay = self.retry_policy.get_delay(attempt)
+            attempt += 1
+            self.log_message(f"  🔁 Retrying SN {sn} ({status}) in {delay:.1f}s, attempt {attempt + 1}")
+            await asyncio.sleep(delay)
+
+    async def export_all(self, tasks, on_result=None):
+        """Export all (SN, start_date, end_date) tasks with bounded concurrency over one keep-alive connection pool"""
+        import aiohttp
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=120)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.build_headers()) as session:
+            async def export_one(sn, start_date, end_date):
+                async with semaphore:
+                    status, path = await self.export_with_retry(session, sn, start_date, end_date)
+                if on_result:
+                    on_result(sn, start_date, end_date, status, path)
+                return path
+
+            return await asyncio.gather(*(export_one(*task) for task in tasks))
@@ -0,0 +1,156 @@
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+import openpyxl
+
+
+class JobFileReader:
+    """Read a download job from an Excel workbook.
+
+    The workbook holds the website, username and password in B1:B3, the start
+    and end dates in F1:F2 and the equipment SNs from A6 down.
+    """
+
+    def cell_to_string(self, cell_value):
+        """Convert Excel cell value to string safely"""
+        if cell_value is None:
+            return ""
+        return str(cell_value).strip()
+
+    def parse_excel_date(self, cell_value):
+        """Parse Excel date which might be a formula or direct date"""
+        if cell_value is None:
+            return datetime.now().date()
+
+        # Convert to string first
+        cell_str = str(cell_value).strip()
+
+        if isinstance(cell_value, str) and cell_str.startswith('='):
+            # Handle Excel functions like =today()-1
+            formula = cell_str.lower()
+            if 'today()' in formula:
+                today = datetime.now().date()
+                # Extract number after today()
+                match = re.search(r'today\(\)\s*([+-])\s*(\d+)', formula)
+                if match:
+                    operator, days = match.groups()
+                    days = int(days)
+                    if operator == '+':
+                        return today + timedelta(days=days)
+                    else:
+                        return today - timedelta(days=days)
+                return today
+        elif isinstance(cell_value, datetime):
+            return cell_value.date()
+        else:
+            # Try to parse as date string
+            try:
+                # Handle different date formats
+                if len(cell_str) == 10 and '-' in cell_str:  # YYYY-MM-DD
+                    return datetime.strptime(cell_str, '%Y-%m-%d').date()
+                elif len(cell_str) == 8 and cell_str.isdigit():  # YYYYMMDD
+                    return datetime.strptime(cell_str, '%Y%m%d').date()
+                else:
+                    # If it's a number, treat as Excel date serial
+                    if cell_str.replace('.', '').isdigit():
+                        # Excel date serial number
+                        excel_date = float(cell_str)
+                        # Excel epoch starts from 1900-01-01, but has a leap year bug
+                        base_date = datetime(1899, 12, 30)  # Adjusted for Excel's leap year bug
+                        return (base_date + timedelta(days=excel_date)).date()
+                    else:
+                        return datetime.now().date()
+            except:
+                return datetime.now().date()
+
+    def read(self, path):
+        """Read and parse a job workbook"""
+        try:
+            workbook = openpyxl.load_workbook(path)
+            sheet = workbook.active
+
+            # Read configuration - convert all to strings safely
+            website = self.cell_to_string(sheet['B1'].value)
+            username = self.cell_to_string(sheet['B2'].value)
+            password = self.cell_to_string(sheet['B3'].value)
+
+            # Read dates
+            start_date_cell = sheet['F1'].value
+            end_date_cell = sheet['F2'].value
+
+            start_date = self.parse_excel_date(start_date_cell)
+
+            if end_date_cell:
+                end_date = self.parse_excel_date(end_date_cell)
+            else:
+                end_date = start_date
+
+            # Read equipment SNs
+            equipment_sns = []
+            row = 6
+            while True:
+                sn_cell = sheet[f'A{row}'].value
+                if sn_cell is None:
+                    break
+
+                sn = self.cell_to_string(sn_cell)
+                if sn == '':
+                    break
+
+                equipment_sns.append(sn)
+                row += 1
+
+            return {
+                'website': website,
+                'username': username,
+                'password': password,
+                'start_date': start_date,
+                'end_date': end_date,
+                'equipment_sns': equipment_sns
+            }
+
+        except Exception as e:
+            raise Exception(f"Error reading Excel file: {str(e)}")
+
+    def parse_spec(self, spec):
+        """Build a job from a JSON job spec: a dictionary with the same fields as a job workbook.
+
+        Dates accept the same formats as the workbook cells (including
+        "=today()-1"). The password may be left out and given in the
+        ENVDATADL_PASSWORD environment variable instead.
+        """
+        start_date = self.parse_excel_date(spec.get('start_date'))
+        end_date = self.parse_excel_date(spec['end_date']) if spec.get('end_date') else start_date
+
+        return {
+            'website': self.cell_to_string(spec.get('website')),
+            'username': self.cell_to_string(spec.get('username')),
+            'password': self.cell_to_string(spec.get('password') or os.environ.get('ENVDATADL_PASSWORD')),
+            'start_date': start_date,
+            'end_date': end_date,
+            'equipment_sns': [self.cell_to_string(sn) for sn in spec.get('equipment_sns', []) if sn]
+        }
+
+    def read_json(self, path):
+        """Read a job from a JSON job spec file (see parse_spec)"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return self.parse_spec(json.load(f))
+        except Exception as e:
+            raise Exception(f"Error reading job file: {str(e)}")
+
+    def load(self, path):
+        """Read a job from a workbook or, for .json files, a JSON job spec"""
+        if path.lower().endswith('.json'):
+            return self.read_json(path)
+        return self.read(path)
+
+    def validate(self, data):
+        """Return an error message if a job cannot be run, else None"""
+        if not data['website'] or not data['username'] or not data['password']:
+            return "Website, username, and password are required"
+        if not data['equipment_sns']:
+            return "No equipment SNs found in the job file"
+        return None
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class JobLedger:
+    """Persistent record of every (website, SN, start date, end date) download.
+
+    Interrupted runs use it to skip SN/date pairs that were already downloaded,
+    so only pending or failed entries are processed again.
+    """
+
+    FILENAME = "envdatadl_jobs.sqlite3"
+
+    def __init__(self, download_folder):
+        os.makedirs(download_folder, exist_ok=True)
+        self.path = os.path.join(download_folder, self.FILENAME)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                website TEXT NOT NULL,
+                sn TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                status TEXT NOT NULL,
+                file_path TEXT,
+                checksum TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (website, sn, start_date, end_date)
+            )
+        """)
+        self.connection.commit()
+
+    def key(self, website, sn, start_date, end_date):
+        """Build the primary key for a job"""
+        return website, sn, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+
+    def get_status(self, website, sn, start_date, end_date):
+        """Get (status, file_path) for a job, or None if it was never run"""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT status, file_path FROM jobs "
+                "WHERE website = ? AND sn = ? AND start_date = ? AND end_date = ?",
+                self.key(website, sn, start_date, end_date)
+            ).fetchone()
+
+    def is_done(self, website, sn, start_date, end_date):
+        """Check whether a job finished and its file is still on disk"""
+        row = self.get_status(website, sn, start_date, end_date)
+        if not row or row[0] != 'done':
+            return False
+        # Every download is recorded with its file; rows without one were written by older versions
+        return not row[1] or os.path.exists(row[1])
+
+    def save(self, website, sn, start_date, end_date, status, file_path=None, checksum=None, error=None):
+        """Insert or update a job, counting every attempt"""
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO jobs (website, sn, start_date, end_date, status, file_path, checksum, attempts, "
+                "error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (website, sn, start_date, end_date) DO UPDATE SET "
+                "status = excluded.status, file_path = excluded.file_path, checksum = excluded.checksum, "
+                "attempts = jobs.attempts + 1, error = excluded.error, updated_at = excluded.updated_at",
+                (*self.key(website, sn, start_date, end_date), status, file_path, checksum, error,
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+            self.connection.commit()
+
+    def mark_done(self, website, sn, start_date, end_date, file_path=None):
+        """Record a completed download along with its file checksum"""
+        checksum = self.get_checksum(file_path) if file_path else None
+        self.save(website, sn, start_date, end_date, 'done', file_path, checksum)
+
+    def mark_failed(self, website, sn, start_date, end_date, error=None):
+        """Record a failed download so the next run retries it"""
+        self.save(website, sn, start_date, end_date, 'failed', error=error)
+
+    def get_checksum(self, file_path):
+        """SHA-256 of a downloaded file"""
+        digest = hashlib.sha256()
+        try:
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        except OSError:
+            return None
+        return digest.hexdigest()
+
+    def close(self):
+        """Close the ledger database"""
+        with self.lock:
+            self.connection.close()
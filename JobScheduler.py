@@ -0,0 +1,156 @@
+import asyncio
+import os
+from datetime import datetime
+from urllib.parse import urlparse
+
+from playwright.async_api import async_playwright
+
+from JobFile import JobFileReader
+from JobLedger import JobLedger
+from PlaywrightDownloader import PlaywrightDownloader
+
+
+class SiteSlot:
+    """One site's share of a ConcurrencyBudget, used as `async with slot:` around a download"""
+
+    def __init__(self, global_slots, site_slots):
+        self.global_slots = global_slots
+        self.site_slots = site_slots
+
+    async def __aenter__(self):
+        # Wait for the site first, so a busy site does not hold up a global slot
+        await self.site_slots.acquire()
+        try:
+            await self.global_slots.acquire()
+        except BaseException:
+            self.site_slots.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.global_slots.release()
+        self.site_slots.release()
+
+
+class ConcurrencyBudget:
+    """Limits on the number of downloads running at once, overall and per portal host"""
+
+    def __init__(self, max_workers, per_site_workers):
+        self.global_slots = asyncio.Semaphore(max(1, max_workers))
+        self.per_site_workers = max(1, per_site_workers)
+        self.site_slots = {}
+
+    def for_site(self, site):
+        """Get the slot shared by every account of a site"""
+        if site not in self.site_slots:
+            self.site_slots[site] = asyncio.Semaphore(self.per_site_workers)
+        return SiteSlot(self.global_slots, self.site_slots[site])
+
+
+class JobScheduler:
+    """Run every job file in a folder under a global and a per-site concurrency budget.
+
+    Jobs are grouped by account (website + username). Each account gets one
+    browser that logs in once and runs its jobs one after another; all
+    accounts run at the same time and take download slots from the shared
+    budget.
+    """
+
+    JOB_EXTENSIONS = ('.xlsx', '.json')
+
+    def __init__(self, download_folder, max_workers=8, per_site_workers=4, headless=True, block_resources=True,
+                 window_days=0, log_message=None, tracer=None):
+        self.download_folder = download_folder
+        self.max_workers = max(1, max_workers)
+        self.per_site_workers = max(1, per_site_workers)
+        self.headless = headless
+        self.block_resources = block_resources
+        self.window_days = window_days
+        self.log_message = log_message or self.print_message
+        self.tracer = tracer
+        self.job_reader = JobFileReader()
+
+    def print_message(self, message):
+        """Default log output: timestamped lines on stdout"""
+        print(f"{datetime.now().strftime('%H:%M:%S')} - {message}", flush=True)
+
+    def find_job_files(self, job_folder):
+        """List the job files in a folder, skipping Excel lock files"""
+        return sorted(
+            os.path.join(job_folder, name) for name in os.listdir(job_folder)
+            if name.lower().endswith(self.JOB_EXTENSIONS) and not name.startswith('~$')
+        )
+
+    def load_jobs(self, job_folder):
+        """Read every job file in a folder.
+
+        Returns (jobs, errors): jobs is a list of (path, data), errors maps
+        the path of each unreadable or incomplete job file to its error.
+        """
+        jobs = []
+        errors = {}
+        for path in self.find_job_files(job_folder):
+            try:
+                data = self.job_reader.load(path)
+            except Exception as e:
+                errors[path] = str(e)
+                continue
+
+            error = self.job_reader.validate(data)
+            if error:
+                errors[path] = error
+            else:
+                jobs.append((path, data))
+        return jobs, errors
+
+    def group_by_account(self, jobs):
+        """Group (path, data) jobs by (website, username), keeping file order within each account"""
+        accounts = {}
+        for path, data in jobs:
+            accounts.setdefault((data['website'], data['username']), []).append((path, data))
+        return accounts
+
+    def make_account_logger(self, username, site):
+        """Prefix log lines with the account they belong to"""
+        def log_message(message):
+            self.log_message(f"[{username}@{site}] {message.lstrip()}")
+        return log_message
+
+    async def run(self, jobs):
+        """Run the jobs and return {path: summary}"""
+        accounts = self.group_by_account(jobs)
+        budget = ConcurrencyBudget(self.max_workers, self.per_site_workers)
+        ledger = JobLedger(self.download_folder)
+
+        self.log_message(
+            f"🗂️  Running {len(jobs)} job(s) for {len(accounts)} account(s) with up to {self.max_workers} "
+            f"download(s) at once, {self.per_site_workers} per site"
+        )
+
+        try:
+            async with async_playwright() as p:
+                account_runs = []
+                for (website, username), account_jobs in accounts.items():
+                    site = urlparse(website).netloc or website
+                    downloader = PlaywrightDownloader(
+                        self.download_folder,
+                        worker_count=min(self.per_site_workers, self.max_workers),
+                        headless=self.headless,
+                        block_resources=self.block_resources,
+                        window_days=self.window_days,
+                        log_message=self.make_account_logger(username, site),
+                        ledger=ledger,
+                        slots=budget.for_site(site),
+                        tracer=self.tracer
+                    )
+                    account_runs.append(downloader.run_jobs(p, [data for _, data in account_jobs]))
+
+                account_summaries = await asyncio.gather(*account_runs)
+        finally:
+            ledger.close()
+
+        summaries = {}
+        for account_jobs, job_summaries in zip(accounts.values(), account_summaries):
+            for (path, _), summary in zip(account_jobs, job_summaries):
+                summaries[path] = summary
+        return summaries
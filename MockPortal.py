@@ -0,0 +1,497 @@
+import argparse
+import io
+import json
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from xml.sax.saxutils import escape
+
+EXPORT_PATH = '/syntheticSystem/dataAnalysis/export'
+HOME_PATH = '/syntheticSystem/dataAnalysis/index'
+SESSION_COOKIE = 'JSESSIONID'
+
+PAGE_STYLE = """
+body { font-family: sans-serif; margin: 0; }
+.el-input__inner { height: 32px; padding: 0 8px; margin: 4px; border: 1px solid #dcdfe6; border-radius: 4px; }
+.el-button { height: 32px; padding: 0 16px; margin: 4px; border: 1px solid #dcdfe6; border-radius: 4px; }
+.el-button--primary { background: #409eff; color: #fff; }
+.el-button--warning { background: #e6a23c; color: #fff; }
+.el-radio-button { display: inline-block; padding: 6px 12px; border: 1px solid #dcdfe6; cursor: pointer; }
+.el-radio-button.is-active { background: #409eff; color: #fff; }
+.el-radio-button__orig-radio { display: none; }
+.el-loading-mask { position: fixed; inset: 0; background: rgba(255, 255, 255, .8); }
+.el-message { margin: 8px; color: #f56c6c; }
+.flex-wrap { display: flex; flex-wrap: wrap; align-items: center; padding: 16px; }
+"""
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html lang="zh-HK">
+<head><meta charset="utf-8"><title>環境數據平台 - 登錄</title><style>%(style)s</style></head>
+<body>
+<div class="login-box flex-wrap">
+  <div class="el-input"><input class="el-input__inner" id="username" type="text" placeholder="請輸入賬號"></div>
+  <div class="el-input"><input class="el-input__inner" id="password" type="password" placeholder="請輸入密碼"></div>
+  <button class="el-button el-button--primary" id="login" type="button">登錄</button>
+  <div class="el-message" id="message"></div>
+</div>
+<script>
+function login() {
+    fetch('/api/login', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({
+            username: document.getElementById('username').value,
+            password: document.getElementById('password').value
+        })
+    }).then(function (r) { return r.json(); }).then(function (res) {
+        if (res.code === 0) { location.href = '%(home)s'; }
+        else { document.getElementById('message').textContent = res.msg; }
+    });
+}
+document.getElementById('password').addEventListener('keydown', function (e) { if (e.key === 'Enter') { login(); } });
+document.getElementById('login').addEventListener('click', login);
+</script>
+</body>
+</html>
+""" % {'style': PAGE_STYLE, 'home': HOME_PATH}
+
+HOME_PAGE = """<!DOCTYPE html>
+<html lang="zh-HK">
+<head><meta charset="utf-8"><title>環境數據平台</title><style>%(style)s</style></head>
+<body><div class="flex-wrap"><a href="%(export)s">數據分析 / 數據導出</a></div></body>
+</html>
+""" % {'style': PAGE_STYLE, 'export': EXPORT_PATH}
+
+EXPORT_PAGE = """<!DOCTYPE html>
+<html lang="zh-HK">
+<head><meta charset="utf-8"><title>環境數據平台 - 數據導出</title><style>%(style)s</style></head>
+<body>
+<div class="el-loading-mask" id="mask" style="display: none">加載中...</div>
+<div class="flex-wrap">
+  <div class="el-radio-group" id="data-type">
+    <label class="el-radio-button"><input class="el-radio-button__orig-radio" type="radio" value="實時值">實時值</label>
+    <label class="el-radio-button is-active"><input class="el-radio-button__orig-radio" type="radio"
+        value="小時值">小時值</label>
+    <label class="el-radio-button"><input class="el-radio-button__orig-radio" type="radio" value="日均值">日均值</label>
+  </div>
+  <div class="el-date-editor">
+    <input class="el-input__inner" id="start" type="text" placeholder="開始時間" autocomplete="off">
+    <span>至</span>
+    <input class="el-input__inner" id="end" type="text" placeholder="結束時間" autocomplete="off">
+  </div>
+  <div class="el-input"><input class="el-input__inner" id="sn" type="text" placeholder="請輸入設備號"></div>
+  <button class="el-button el-button--warning" id="query" type="button">查詢</button>
+  <button class="el-button el-button--primary" id="export" type="button">導出文件</button>
+</div>
+<div class="el-message" id="message"></div>
+<div class="el-table" id="table"></div>
+<script>
+var labels = document.querySelectorAll('.el-radio-button');
+for (var i = 0; i < labels.length; i++) {
+    labels[i].addEventListener('click', function () {
+        for (var j = 0; j < labels.length; j++) { labels[j].classList.remove('is-active'); }
+        this.classList.add('is-active');
+    });
+}
+function formData() {
+    return JSON.stringify({
+        sn: document.getElementById('sn').value.trim(),
+        startTime: document.getElementById('start').value.trim(),
+        endTime: document.getElementById('end').value.trim(),
+        dataType: document.querySelector('.el-radio-button.is-active').textContent.trim()
+    });
+}
+function post(url) {
+    document.getElementById('message').textContent = '';
+    document.getElementById('mask').style.display = 'block';
+    return fetch(url, {method: 'POST', headers: {'Content-Type': 'application/json'}, body: formData()})
+        .finally(function () { document.getElementById('mask').style.display = 'none'; });
+}
+function showError(r) {
+    document.getElementById('message').textContent = '服務器錯誤 (' + r.status + ')';
+}
+document.getElementById('query').addEventListener('click', function () {
+    post('/api/query').then(function (r) {
+        if (!r.ok) { showError(r); return; }
+        return r.json().then(function (res) {
+            document.getElementById('table').textContent = res.total ? '共 ' + res.total + ' 條記錄' : '暫無數據';
+        });
+    });
+});
+document.getElementById('export').addEventListener('click', function () {
+    post('/api/export').then(function (r) {
+        if (!r.ok) { showError(r); return; }
+        if ((r.headers.get('Content-Type') || '').indexOf('json') >= 0) {
+            return r.json().then(function (res) { document.getElementById('message').textContent = res.msg; });
+        }
+        var match = /filename="([^"]+)"/.exec(r.headers.get('Content-Disposition') || '');
+        return r.blob().then(function (blob) {
+            var a = document.createElement('a');
+            a.href = URL.createObjectURL(blob);
+            a.download = match ? match[1] : 'export.xlsx';
+            document.body.appendChild(a);
+            a.click();
+            a.remove();
+        });
+    });
+});
+</script>
+</body>
+</html>
+""" % {'style': PAGE_STYLE}
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+    '</Relationships>'
+)
+
+
+def build_xlsx(rows):
+    """Build a minimal single-sheet .xlsx file from rows of strings and numbers"""
+    sheet = io.StringIO()
+    sheet.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+    for row_index, row in enumerate(rows, 1):
+        sheet.write(f'<row r="{row_index}">')
+        for column_index, value in enumerate(row):
+            ref = f"{chr(ord('A') + column_index)}{row_index}"
+            if isinstance(value, (int, float)):
+                sheet.write(f'<c r="{ref}"><v>{value}</v></c>')
+            else:
+                sheet.write(f'<c r="{ref}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>')
+        sheet.write('</row>')
+    sheet.write('</sheetData></worksheet>')
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', XLSX_ROOT_RELS)
+        archive.writestr('xl/workbook.xml', XLSX_WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+        archive.writestr('xl/worksheets/sheet1.xml', sheet.getvalue())
+    return buffer.getvalue()
+
+
+class MockPortalHandler(BaseHTTPRequestHandler):
+    """Serve the mock portal's pages and API; self.portal is set by MockPortal.start"""
+
+    portal = None
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def get_session(self):
+        """Get the request's session token if it belongs to a logged-in user"""
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        token = cookie[SESSION_COOKIE].value if SESSION_COOKIE in cookie else None
+        return token if self.portal.is_logged_in(token) else None
+
+    def read_json(self):
+        """Read the request body as JSON"""
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return {}
+
+    def send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_page(self, page):
+        self.send_body(200, 'text/html; charset=utf-8', page.encode('utf-8'))
+
+    def send_json(self, data, status=200, headers=None):
+        self.send_body(status, 'application/json;charset=UTF-8',
+                       json.dumps(data, ensure_ascii=False).encode('utf-8'), headers)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        self.portal.count_request(path)
+        if path in (EXPORT_PATH, HOME_PATH):
+            # Like the portal's SPA, a page opened without a session shows the login form
+            self.send_page((EXPORT_PAGE if path == EXPORT_PATH else HOME_PAGE) if self.get_session() else LOGIN_PAGE)
+        elif path in ('/', '/login'):
+            self.send_page(LOGIN_PAGE)
+        else:
+            self.send_json({'code': 404, 'msg': 'Not Found'}, status=404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        self.portal.count_request(path)
+        body = self.read_json()
+        self.portal.delay()
+
+        if path == '/api/login':
+            token = self.portal.login(body.get('username'), body.get('password'))
+            if token is None:
+                self.send_json({'code': 401, 'msg': '賬號或密碼錯誤'})
+            else:
+                self.send_json({'code': 0, 'msg': '登錄成功'},
+                               headers={'Set-Cookie': f"{SESSION_COOKIE}={token}; Path=/; HttpOnly"})
+            return
+
+        if path not in ('/api/query', '/api/export'):
+            self.send_json({'code': 404, 'msg': 'Not Found'}, status=404)
+            return
+        if not self.get_session():
+            self.send_json({'code': 401, 'msg': '登錄已過期'}, status=401)
+            return
+
+        sn = str(body.get('sn') or '')
+        start_time = str(body.get('startTime') or '')
+        end_time = str(body.get('endTime') or '')
+        if path == '/api/query':
+            self.portal.record_query(sn, start_time, end_time)
+        if self.portal.inject_error():
+            self.send_json({'code': 500, 'msg': '服務器內部錯誤'}, status=500)
+            return
+
+        rows = self.portal.build_rows(sn, start_time, end_time)
+        if path == '/api/query':
+            self.send_json({'code': 0, 'total': max(0, len(rows) - 1)})
+        elif len(rows) <= 1:
+            self.portal.record_no_data(sn, start_time, end_time)
+            self.send_json({'code': 404, 'msg': '暫無數據'})
+        else:
+            filename = re.sub(r'[^\w.-]', '_', f"{sn}_{start_time}_{end_time}") + '.xlsx'
+            content = build_xlsx(rows)
+            self.portal.record_export(sn, start_time, end_time)
+            self.send_body(200, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', content,
+                           {'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+class MockPortal:
+    """Local stand-in for the NEM environmental data portal.
+
+    Serves a login page, the /syntheticSystem/dataAnalysis/export page with
+    the portal's Chinese labels and Element UI class names, and query and
+    export APIs. Every API call waits latency seconds (plus up to jitter
+    seconds more); query and export calls fail with HTTP 500 at error_rate;
+    SNs in no_data_sns have nothing to export. Per-task timings are kept for
+    benchmarks (see get_stats).
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, username='demo', password='demo', latency=0.2, jitter=0.1,
+                 error_rate=0.0, no_data_sns=(), rows_per_day=1440, seed=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.no_data_sns = set(no_data_sns)
+        self.rows_per_day = max(1, rows_per_day)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.server = None
+        self.thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Forget request counts and task timings"""
+        with self.lock:
+            self.requests = {}
+            self.tasks = {}
+            self.server_errors = 0
+
+    def get_url(self, path='/login'):
+        return f"http://{self.host}:{self.port}{path}"
+
+    def start(self):
+        """Start serving in a background thread and return the login URL"""
+        handler = type('Handler', (MockPortalHandler,), {'portal': self})
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.get_url()
+
+    def stop(self):
+        """Stop serving"""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    def count_request(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def delay(self):
+        """Wait like the portal's backend would"""
+        with self.lock:
+            seconds = self.latency + self.random.uniform(0, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def inject_error(self):
+        """Decide whether this call fails with a server error"""
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.server_errors += 1
+        return failed
+
+    def login(self, username, password):
+        """Check the credentials and return a new session token, or None"""
+        if username != self.username or password != self.password:
+            return None
+        token = secrets.token_hex(16)
+        with self.lock:
+            self.sessions.add(token)
+        return token
+
+    def is_logged_in(self, token):
+        with self.lock:
+            return token in self.sessions
+
+    def get_task(self, sn, start_time, end_time):
+        """Timing record of one SN/date-range task; the caller holds the lock"""
+        return self.tasks.setdefault((sn, start_time, end_time), {
+            'first_query': None, 'queries': 0, 'exported': None, 'no_data': False
+        })
+
+    def record_query(self, sn, start_time, end_time):
+        with self.lock:
+            task = self.get_task(sn, start_time, end_time)
+            task['queries'] += 1
+            if task['first_query'] is None:
+                task['first_query'] = time.time()
+
+    def record_export(self, sn, start_time, end_time):
+        with self.lock:
+            self.get_task(sn, start_time, end_time)['exported'] = time.time()
+
+    def record_no_data(self, sn, start_time, end_time):
+        with self.lock:
+            self.get_task(sn, start_time, end_time)['no_data'] = True
+
+    def build_rows(self, sn, start_time, end_time):
+        """Build an export's rows: a header, then one reading per interval between the dates"""
+        rows = [('時間', '噪音 LAeq dB(A)')]
+        if not sn or sn in self.no_data_sns:
+            return rows
+
+        try:
+            start = datetime.strptime(start_time[:10], '%Y-%m-%d')
+            end = datetime.strptime(end_time[:10], '%Y-%m-%d')
+        except ValueError:
+            return rows
+
+        # Readings are repeatable per SN so exports can be compared between runs
+        readings = random.Random(sn)
+        step = timedelta(days=1) / self.rows_per_day
+        moment = start
+        while moment < end + timedelta(days=1):
+            rows.append((moment.strftime('%Y-%m-%d %H:%M:%S'), round(readings.uniform(45, 75), 1)))
+            moment += step
+        return rows
+
+    def get_stats(self):
+        """Request counts, injected server errors, and the query-to-export time of every exported task"""
+        with self.lock:
+            latencies = {
+                f"{sn} {start_time}~{end_time}": task['exported'] - task['first_query']
+                for (sn, start_time, end_time), task in self.tasks.items()
+                if task['exported'] and task['first_query']
+            }
+            return {
+                'requests': dict(self.requests),
+                'server_errors': self.server_errors,
+                'queries': sum(task['queries'] for task in self.tasks.values()),
+                'no_data': sum(1 for task in self.tasks.values() if task['no_data']),
+                'task_latencies': latencies
+            }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the NEM data portal.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8766, help="port to listen on (default: 8766)")
+    parser.add_argument("--username", default="demo", help="accepted username (default: demo)")
+    parser.add_argument("--password", default="demo", help="accepted password (default: demo)")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per API call (default: 0.2)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="extra random seconds per API call (default: 0.1)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of query/export calls answered with HTTP 500 (default: 0)")
+    parser.add_argument("--no-data-sn", action="append", default=[], help="SN with nothing to export (repeatable)")
+    parser.add_argument("--rows-per-day", type=int, default=1440, help="readings per day in exports (default: 1440)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for latency and errors")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    portal = MockPortal(
+        host=args.host,
+        port=args.port,
+        username=args.username,
+        password=args.password,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        no_data_sns=args.no_data_sn,
+        rows_per_day=args.rows_per_day,
+        seed=args.seed
+    )
+    print(f"🧪 Mock portal at {portal.start()} (user {args.username}), Ctrl+C to stop", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        portal.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
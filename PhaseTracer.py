@@ -0,0 +1,123 @@
+import asyncio
+import contextlib
+import json
+import math
+import threading
+import time
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(fraction * len(ordered))
+    return ordered[min(len(ordered), max(1, rank)) - 1]
+
+
+class PhaseTracer:
+    """Time the phases of a run (launch, login, form fields, query, export, save...) as spans.
+
+    Every span is kept in memory for summarize() and, with a trace_path,
+    appended to a JSON-lines trace as soon as it ends. When the first
+    candidate selector of a field is abandoned, mark_fallback starts counting
+    the rest of the span as fallback time. Sleeps taken through
+    sleep()/async_sleep() are recorded with their kind ('fixed', 'backoff' or
+    'circuit_breaker').
+    """
+
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self.lock = threading.Lock()
+        self.spans = []
+        self.file = open(trace_path, 'a', encoding='utf-8') if trace_path else None
+
+    def write(self, record):
+        """Append one record to the trace file, if there is one; the caller holds the lock"""
+        if self.file:
+            self.file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            self.file.flush()
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+            self.write({'type': 'span', **span})
+
+    @contextlib.contextmanager
+    def span(self, phase, sn=None, **fields):
+        """Time the body of a with block; yields the span dict so fields can be added to it"""
+        span = {'phase': phase, 'sn': sn, 'start': time.time(), **fields}
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            ended = time.perf_counter()
+            span['duration'] = ended - started
+            fallback_started = span.pop('fallback_started', None)
+            if fallback_started is not None:
+                span['fallback_seconds'] = ended - fallback_started
+            self.add(span)
+
+    def mark_fallback(self, span):
+        """Count the rest of an open span, from the first call on, as spent on selector fallbacks"""
+        span.setdefault('fallback_started', time.perf_counter())
+
+    def sleep(self, seconds, sn=None, kind='fixed'):
+        """time.sleep, recorded as a 'sleep' span"""
+        with self.span('sleep', sn, kind=kind):
+            time.sleep(seconds)
+
+    async def async_sleep(self, seconds, sn=None, kind='fixed'):
+        """asyncio.sleep, recorded as a 'sleep' span"""
+        with self.span('sleep', sn, kind=kind):
+            await asyncio.sleep(seconds)
+
+    def summarize(self):
+        """Per-phase count, total, p50, p95 and max seconds, plus fallback and sleep totals"""
+        with self.lock:
+            spans = list(self.spans)
+
+        durations = {}
+        for span in spans:
+            durations.setdefault(span['phase'], []).append(span['duration'])
+
+        sleep_seconds = {}
+        for span in spans:
+            if span['phase'] == 'sleep':
+                sleep_seconds[span['kind']] = sleep_seconds.get(span['kind'], 0) + span['duration']
+
+        return {
+            'phases': {
+                phase: {
+                    'count': len(values),
+                    'total': sum(values),
+                    'p50': percentile(values, 0.5),
+                    'p95': percentile(values, 0.95),
+                    'max': max(values)
+                }
+                for phase, values in durations.items()
+            },
+            'selector_fallback_seconds': sum(span.get('fallback_seconds', 0) for span in spans),
+            'sleep_seconds': sleep_seconds
+        }
+
+    def log_summary(self, log_message):
+        """Log the timing summary and write it at the end of the trace"""
+        summary = self.summarize()
+        with self.lock:
+            self.write({'type': 'summary', **summary})
+
+        log_message("⏱️  Time by phase (count, total, p50, p95):")
+        for phase, stats in sorted(summary['phases'].items(), key=lambda item: -item[1]['total']):
+            log_message(f"   {phase:<12} {stats['count']:>5} {stats['total']:>8.1f}s "
+                        f"{stats['p50']:>7.2f}s {stats['p95']:>7.2f}s")
+        log_message(f"   Selector fallbacks: {summary['selector_fallback_seconds']:.1f}s, sleeps: "
+                    + (', '.join(f"{kind} {seconds:.1f}s" for kind, seconds in summary['sleep_seconds'].items())
+                       or "none"))
+        return summary
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
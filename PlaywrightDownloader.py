@@ -0,0 +1,1132 @@
+import asyncio
+import contextlib
+import os
+import re
+from datetime import datetime, timedelta
+
+import openpyxl
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+
+from HttpExporter import HttpExporter, classify_export_response, is_file_response
+from JobLedger import JobLedger
+from PhaseTracer import PhaseTracer
+from RetryPolicy import (CircuitBreaker, RetryPolicy, DOWNLOAD_OK, ERROR, NO_DATA, SELECTOR_MISS, SERVER_ERROR,
+                         TIMEOUT)
+from SelectorCache import SelectorCache
+from SessionCache import SessionCache
+
+# Resource types never needed to fill the forms and export files
+BLOCKED_RESOURCE_TYPES = {'image', 'font', 'media'}
+
+# The portal SPA may load its scripts and styles from a CDN and serve exports from another host,
+# everything else third-party (analytics, beacons, websockets, ...) is blocked
+THIRD_PARTY_ALLOWED_TYPES = {'script', 'stylesheet', 'document'}
+
+# Inputs that only exist once the export form has rendered
+EXPORT_FORM_SELECTOR = (
+    'input[placeholder*="設備號"], input[placeholder*="设备号"], '
+    'input[placeholder*="開始時間"], input[placeholder*="开始时间"]'
+)
+
+
+class PlaywrightDownloader:
+    """Playwright download automation, independent of any user interface.
+
+    Progress is reported through the log_message and set_progress callbacks,
+    which default to printing on stdout and to doing nothing. A job ledger
+    shared with other downloaders can be passed in, as can slots: an async
+    context manager held around every download, used to share a concurrency
+    budget between downloaders. on_result(sn, start_date, end_date, status)
+    is called as each task finishes. Phase timings go to tracer, a
+    PhaseTracer (an in-memory one by default).
+    """
+
+    # Words in the path of an export request, which tell its answer from the query's
+    EXPORT_URL_HINTS = ('export', 'download', 'excel', 'xls')
+
+    def __init__(self, download_folder, worker_count=4, http_export=False, headless=False, block_resources=True,
+                 window_days=0, log_message=None, set_progress=None, ledger=None, slots=None, on_result=None,
+                 tracer=None):
+        self.download_folder = download_folder
+        self.worker_count = max(1, int(worker_count))
+        self.http_export = http_export
+        self.headless = headless
+        self.block_resources = block_resources
+        self.window_days = max(0, int(window_days))
+        self.log_message = log_message or self.print_message
+        self.set_progress = set_progress or (lambda progress: None)
+        self.session_cache = SessionCache()
+        self.selector_cache = SelectorCache()
+        self.retry_policy = RetryPolicy()
+        self.circuit_breaker = CircuitBreaker()
+        self.ledger = ledger
+        self.slots = slots
+        self.on_result = on_result
+        self.tracer = tracer or PhaseTracer()
+        self.failed_saves = 0
+
+    def print_message(self, message):
+        """Default log output: timestamped lines on stdout"""
+        print(f"{datetime.now().strftime('%H:%M:%S')} - {message}", flush=True)
+
+    def get_export_url(self, base_url):
+        """Generate the export URL from base URL"""
+        # Extract the base domain from the login URL
+        if 'env.nem.com.hk:10027' in base_url:
+            return 'https://env.nem.com.hk:10027/syntheticSystem/dataAnalysis/export'
+        else:
+            # For other domains, try to construct the URL
+            from urllib.parse import urlparse
+            parsed = urlparse(base_url)
+            return f"{parsed.scheme}://{parsed.netloc}/syntheticSystem/dataAnalysis/export"
+
+    def get_host(self, url):
+        """Get the host:port of a URL, used to key learned selectors per portal"""
+        from urllib.parse import urlparse
+        return urlparse(url).netloc
+
+    def is_first_party(self, url, website):
+        """Check whether a URL belongs to the portal's own domain (any port or sibling subdomain)"""
+        from urllib.parse import urlparse
+        hostname = urlparse(url).hostname or ''
+        portal_hostname = urlparse(website).hostname or ''
+        if hostname == portal_hostname:
+            return True
+
+        labels = portal_hostname.split('.')
+        if len(labels) > 2 and not portal_hostname.replace('.', '').isdigit():
+            return hostname.endswith('.' + '.'.join(labels[1:]))
+        return False
+
+    async def setup_resource_blocking(self, context, website):
+        """Abort requests the automation never needs, if resource blocking is enabled"""
+        if not self.block_resources:
+            return
+
+        async def handle_route(route):
+            request = route.request
+            if request.resource_type in BLOCKED_RESOURCE_TYPES:
+                await route.abort()
+            elif (not self.is_first_party(request.url, website)
+                  and request.resource_type not in THIRD_PARTY_ALLOWED_TYPES):
+                await route.abort()
+            else:
+                await route.continue_()
+
+        await context.route("**/*", handle_route)
+
+    def is_api_response(self, response):
+        """Check whether a response belongs to an XHR/fetch API call"""
+        return response.request.resource_type in ('xhr', 'fetch')
+
+    def is_export_response(self, response, sn):
+        """Check whether a response answers the export request for sn.
+
+        The query request carries the SN too, so only a file, or an answer
+        to a URL that names an export, counts.
+        """
+        request = response.request
+        if not self.is_api_response(response) or (sn not in request.url and sn not in (request.post_data or '')):
+            return False
+        if is_file_response(response.headers.get('content-type'), response.headers.get('content-disposition')):
+            return True
+        from urllib.parse import urlparse
+        path = urlparse(request.url).path.lower()
+        return any(hint in path for hint in self.EXPORT_URL_HINTS)
+
+    async def wait_for_download(self, download_started, export_response, sn):
+        """Wait for the export's download, answering as soon as the export response turns out not to be a file.
+
+        Returns (status, download), where download is None unless the status is DOWNLOAD_OK.
+        """
+        try:
+            await asyncio.wait({download_started, export_response}, return_when=asyncio.FIRST_COMPLETED)
+            if not download_started.done() and export_response.done() and not export_response.exception():
+                response = export_response.result()
+                try:
+                    body = await response.body()
+                except Exception:
+                    body = b''
+                status = classify_export_response(
+                    response.status,
+                    response.headers.get('content-type'),
+                    response.headers.get('content-disposition'),
+                    body
+                )
+                if status == NO_DATA:
+                    self.log_message(f"  ⚠️  No data available for SN: {sn}")
+                    return NO_DATA, None
+                if status != DOWNLOAD_OK:
+                    message = body[:200].decode('utf-8', 'replace')
+                    self.log_message(f"  ❌ Export failed for SN {sn}: HTTP {response.status} {message}")
+                    return status, None
+
+            try:
+                return DOWNLOAD_OK, await download_started
+            except Exception:
+                self.log_message(f"  ⚠️  Export did not start a download for SN: {sn}")
+                return TIMEOUT, None
+        finally:
+            for future in (download_started, export_response):
+                if not future.done():
+                    future.cancel()
+                elif not future.cancelled():
+                    future.exception()
+
+    async def wait_for_login(self, page, timeout=15000):
+        """Wait until the login form has been replaced by the logged-in page"""
+        try:
+            await page.wait_for_selector('input[type="password"]', state='hidden', timeout=timeout)
+        except Exception:
+            self.log_message("⚠️  Login form still visible, continuing anyway...")
+
+    async def open_export_page(self, page, export_url):
+        """Navigate to the export page and wait until the form is ready"""
+        with self.tracer.span('export_page'):
+            await page.goto(export_url)
+            await self.wait_for_export_form(page)
+
+    async def wait_for_export_form(self, page, timeout=15000):
+        """Wait until the export form inputs are rendered and no loading mask is shown"""
+        try:
+            await page.wait_for_selector(EXPORT_FORM_SELECTOR, state='visible', timeout=timeout)
+            await page.wait_for_selector('.el-loading-mask', state='hidden', timeout=timeout)
+            return True
+        except Exception:
+            self.log_message("  ⚠️  Export form not ready, continuing anyway...")
+            return False
+
+    async def wait_for_query_result(self, page, query_response, timeout=15000):
+        """Wait for the query response to arrive and the result table to finish rendering.
+
+        Returns the query response, or None if none was received.
+        """
+        response = None
+        try:
+            response = await query_response
+        except Exception:
+            self.log_message("  ⚠️  No query response received, checking page state...")
+
+        try:
+            await page.wait_for_selector('.el-loading-mask', state='hidden', timeout=timeout)
+        except Exception:
+            pass
+
+        return response
+
+    async def resolve_selectors(self, page, selectors, timeout=5000):
+        """Wait once for any candidate selector to become visible and return the visible ones in order.
+
+        All candidates are raced in one combined locator, so a miss costs a single
+        timeout instead of one timeout per selector.
+        """
+        combined = page.locator(selectors[0])
+        for selector in selectors[1:]:
+            combined = combined.or_(page.locator(selector))
+
+        try:
+            await combined.first.wait_for(state='visible', timeout=timeout)
+        except Exception:
+            return []
+
+        visible = []
+        for selector in selectors:
+            try:
+                if await page.locator(selector).first.is_visible():
+                    visible.append(selector)
+            except Exception:
+                continue
+        return visible
+
+    async def has_value(self, page, selector, expected, timeout=2000):
+        """Check that the input a selector points at holds the expected text, so only a real fill counts as a hit"""
+        try:
+            element = await page.locator(selector).first.element_handle(timeout=timeout)
+            await page.wait_for_function(
+                '([element, expected]) => (element.value || "").includes(expected)',
+                arg=[element, expected],
+                timeout=timeout
+            )
+            return True
+        except Exception:
+            return False
+
+    async def download_data_for_sn(self, page, sn, start_date, end_date):
+        """Download data for a specific equipment SN, returning the outcome as a RetryPolicy status"""
+        try:
+            self.log_message(f"Processing SN: {sn}")
+
+            # Set date range
+            start_date_str = start_date.strftime('%Y-%m-%d')
+            end_date_str = end_date.strftime('%Y-%m-%d')
+
+            self.log_message(f"  Date range: {start_date_str} to {end_date_str}")
+
+            host = self.get_host(page.url)
+
+            # Wait for the export form to be ready
+            with self.tracer.span('form_ready', sn):
+                await self.wait_for_export_form(page)
+
+            # Select real-time values (實時值) radio button
+            with self.tracer.span('radio', sn) as span:
+                try:
+                    # Try multiple selectors for the radio button
+                    radio_selectors = [
+                        'label:has-text("實時值")',
+                        'input[value="實時值"]',
+                        'label.is-active > span:has-text("實時值")',
+                        'text=實時值'
+                    ]
+
+                    radio_selected = False
+                    radio_selectors = self.selector_cache.order(host, 'radio', radio_selectors)
+                    for selector in await self.resolve_selectors(page, radio_selectors):
+                        if selector != radio_selectors[0]:
+                            self.tracer.mark_fallback(span)
+                        try:
+                            await page.click(selector, timeout=3000)
+                            radio_selected = True
+                            self.log_message("  ✓ Selected 實時值 option")
+                            break
+                        except:
+                            continue
+
+                    self.selector_cache.record(host, 'radio', radio_selectors, selector if radio_selected else None)
+
+                    if not radio_selected:
+                        self.log_message("  ⚠️  Could not select 實時值 option, continuing anyway...")
+                except Exception as e:
+                    self.log_message(f"  ⚠️  Error selecting real-time values: {str(e)}")
+
+            # Fill start date
+            with self.tracer.span('start_date', sn) as span:
+                try:
+                    start_date_selectors = [
+                        'input[placeholder*="開始時間"]',
+                        'input[placeholder*="开始时间"]',
+                        'input[aria-label*="開始時間"]',
+                        'input[aria-label*="开始时间"]',
+                        'div.flex-wrap > div:nth-of-type(2) input:nth-of-type(1)',
+                        'input[type="text"]'
+                    ]
+
+                    start_filled = False
+                    start_date_selectors = self.selector_cache.order(host, 'start_date', start_date_selectors)
+                    for selector in await self.resolve_selectors(page, start_date_selectors):
+                        if selector != start_date_selectors[0]:
+                            self.tracer.mark_fallback(span)
+                        try:
+                            await page.fill(selector, start_date_str, timeout=3000)
+                            await page.keyboard.press('Enter')
+                            if not await self.has_value(page, selector, start_date_str):
+                                continue
+                            start_filled = True
+                            self.log_message(f"  ✓ Filled start date: {start_date_str}")
+                            break
+                        except:
+                            continue
+
+                    self.selector_cache.record(
+                        host, 'start_date', start_date_selectors, selector if start_filled else None
+                    )
+
+                    if not start_filled:
+                        self.log_message(f"  ❌ Could not fill start date: {start_date_str}")
+                except Exception as e:
+                    self.log_message(f"  ❌ Error filling start date: {str(e)}")
+
+            # Fill end date
+            with self.tracer.span('end_date', sn) as span:
+                try:
+                    end_date_selectors = [
+                        'input[placeholder*="結束時間"]',
+                        'input[placeholder*="结束时间"]',
+                        'input[aria-label*="結束時間"]',
+                        'input[aria-label*="结束时间"]',
+                        'div.flex-wrap > div:nth-of-type(2) input:nth-of-type(2)',
+                        'input[type="text"]:nth-of-type(2)'
+                    ]
+
+                    end_filled = False
+                    end_date_selectors = self.selector_cache.order(host, 'end_date', end_date_selectors)
+                    for selector in await self.resolve_selectors(page, end_date_selectors):
+                        if selector != end_date_selectors[0]:
+                            self.tracer.mark_fallback(span)
+                        try:
+                            await page.fill(selector, end_date_str, timeout=3000)
+                            await page.keyboard.press('Enter')
+                            if not await self.has_value(page, selector, end_date_str):
+                                continue
+                            end_filled = True
+                            self.log_message(f"  ✓ Filled end date: {end_date_str}")
+                            break
+                        except:
+                            continue
+
+                    self.selector_cache.record(host, 'end_date', end_date_selectors, selector if end_filled else None)
+
+                    if not end_filled:
+                        self.log_message(f"  ❌ Could not fill end date: {end_date_str}")
+                except Exception as e:
+                    self.log_message(f"  ❌ Error filling end date: {str(e)}")
+
+            # Enter equipment SN
+            with self.tracer.span('sn', sn) as span:
+                try:
+                    sn_selectors = [
+                        'input[placeholder*="設備號"]',
+                        'input[placeholder*="设备号"]',
+                        'input[placeholder*="請輸入設備號"]',
+                        'input[placeholder*="请输入设备号"]',
+                        'input[aria-label*="設備號"]',
+                        'input[aria-label*="设备号"]',
+                        '#el-id-215-53'
+                    ]
+
+                    sn_filled = False
+                    sn_selectors = self.selector_cache.order(host, 'sn', sn_selectors)
+                    for selector in await self.resolve_selectors(page, sn_selectors):
+                        if selector != sn_selectors[0]:
+                            self.tracer.mark_fallback(span)
+                        try:
+                            # Clear the field first
+                            await page.fill(selector, '', timeout=3000)
+                            # Fill with the SN
+                            await page.fill(selector, sn, timeout=3000)
+                            await page.keyboard.press('Enter')
+                            if not await self.has_value(page, selector, sn):
+                                continue
+                            sn_filled = True
+                            self.log_message(f"  ✓ Filled equipment SN: {sn}")
+                            break
+                        except:
+                            continue
+
+                    self.selector_cache.record(host, 'sn', sn_selectors, selector if sn_filled else None)
+
+                    if not sn_filled:
+                        self.log_message(f"  ❌ Could not fill equipment SN: {sn}")
+                        return SELECTOR_MISS
+                except Exception as e:
+                    self.log_message(f"  ❌ Error filling equipment SN {sn}: {str(e)}")
+                    return self.classify_exception(e)
+
+            # Click query button
+            with self.tracer.span('query', sn) as span:
+                try:
+                    query_selectors = [
+                        'button:has-text("查詢")',
+                        'button:has-text("查询")',
+                        'text=查詢',
+                        'text=查询',
+                        'button.el-button--warning',
+                        '[role="button"]:has-text("查詢")',
+                        '[role="button"]:has-text("查询")'
+                    ]
+
+                    # Start listening before the click so a fast response is not missed
+                    query_response = asyncio.ensure_future(
+                        page.wait_for_event('response', predicate=self.is_api_response, timeout=15000)
+                    )
+
+                    query_clicked = False
+                    query_selectors = self.selector_cache.order(host, 'query', query_selectors)
+                    for selector in await self.resolve_selectors(page, query_selectors):
+                        if selector != query_selectors[0]:
+                            self.tracer.mark_fallback(span)
+                        try:
+                            await page.click(selector, timeout=3000)
+                            query_clicked = True
+                            self.log_message("  ✓ Clicked query button")
+                            break
+                        except:
+                            continue
+
+                    self.selector_cache.record(host, 'query', query_selectors, selector if query_clicked else None)
+
+                    if not query_clicked:
+                        query_response.cancel()
+                        self.log_message("  ❌ Could not click query button")
+                        return SELECTOR_MISS
+
+                    # Wait for data to load
+                    self.log_message("  ⏳ Waiting for data to load...")
+                    response = await self.wait_for_query_result(page, query_response)
+                    if response is not None and response.status >= 500:
+                        self.log_message(f"  ❌ Portal returned HTTP {response.status} for SN: {sn}")
+                        return SERVER_ERROR
+
+                except Exception as e:
+                    self.log_message(f"  ❌ Error clicking query button: {str(e)}")
+                    return self.classify_exception(e)
+
+            # Check if data exists and click download
+            with self.tracer.span('export', sn) as span:
+                try:
+                    download_selectors = [
+                        'button:has-text("導出文件")',
+                        'button:has-text("导出文件")',
+                        'text=導出文件',
+                        'text=导出文件',
+                        '[role="button"]:has-text("導出文件")',
+                        '[role="button"]:has-text("导出文件")',
+                        'div:has-text("導出文件")'
+                    ]
+
+                    download_started = asyncio.ensure_future(page.wait_for_event('download', timeout=30000))
+                    export_response = asyncio.ensure_future(page.wait_for_event(
+                        'response', predicate=lambda response: self.is_export_response(response, sn), timeout=30000
+                    ))
+
+                    download_clicked = False
+                    download_selectors = self.selector_cache.order(host, 'download', download_selectors)
+                    for selector in await self.resolve_selectors(page, download_selectors):
+                        if selector != download_selectors[0]:
+                            self.tracer.mark_fallback(span)
+                        try:
+                            await page.click(selector, timeout=5000)
+                            download_clicked = True
+                            self.log_message(f"  ✓ Download initiated for SN: {sn}")
+                            break
+                        except:
+                            continue
+
+                    self.selector_cache.record(
+                        host, 'download', download_selectors, selector if download_clicked else None
+                    )
+
+                    if download_clicked:
+                        # Wait for download to start, unless the portal answers that there is nothing to export
+                        status, download = await self.wait_for_download(download_started, export_response, sn)
+                        if status != DOWNLOAD_OK:
+                            return status
+
+                        # Save in the background so the next SN's query overlaps with writing this file
+                        self.save_download_in_background(download, sn, start_date, end_date)
+                        return DOWNLOAD_OK
+                    else:
+                        download_started.cancel()
+                        export_response.cancel()
+                        self.log_message(f"  ⚠️  No data available or could not find download button for SN: {sn}")
+                        return SELECTOR_MISS
+
+                except Exception as e:
+                    self.log_message(f"  ❌ Error during download for SN {sn}: {str(e)}")
+                    return self.classify_exception(e)
+
+        except Exception as e:
+            self.log_message(f"❌ Error processing SN {sn}: {str(e)}")
+            return self.classify_exception(e)
+
+    def classify_exception(self, error):
+        """Map an exception raised during a download attempt to a RetryPolicy status"""
+        if isinstance(error, (PlaywrightTimeoutError, asyncio.TimeoutError)):
+            return TIMEOUT
+        return ERROR
+
+    async def download_with_retry(self, page, sn, start_date, end_date, export_url):
+        """Download one task, retrying transient failures with backoff while the circuit breaker allows it"""
+        attempt = 0
+        while True:
+            # Hold off while the portal looks degraded
+            wait_time = self.circuit_breaker.get_wait_time()
+            while wait_time > 0:
+                await self.tracer.async_sleep(wait_time, sn, kind='circuit_breaker')
+                wait_time = self.circuit_breaker.get_wait_time()
+
+            with self.tracer.span('attempt', sn) as span:
+                status = await self.download_data_for_sn(page, sn, start_date, end_date)
+                span['status'] = status
+
+            if self.circuit_breaker.record(status):
+                self.log_message(
+                    f"⛔ Portal looks degraded, pausing all workers for {self.circuit_breaker.cooldown:.0f}s"
+                )
+
+            if not self.retry_policy.should_retry(status, attempt):
+                return status
+
+            delay = self.retry_policy.get_delay(attempt)
+            attempt += 1
+            self.log_message(f"  🔁 Retrying SN {sn} ({status}) in {delay:.1f}s, attempt {attempt + 1}")
+            await self.tracer.async_sleep(delay, sn, kind='backoff')
+
+            # Start the retry from a freshly loaded export form
+            try:
+                await self.open_export_page(page, export_url)
+            except Exception as e:
+                self.log_message(f"  ⚠️  Could not reload export page: {str(e)}")
+
+    def record_result(self, results, sn, start_date, end_date, status, total_tasks):
+        """Record a finished task in the run results, and a failed one in the job ledger"""
+        results['completed'] += 1
+        if status == DOWNLOAD_OK:
+            results['successful'] += 1
+        else:
+            self.ledger.mark_failed(self.job_website, sn, start_date, end_date, status)
+            results['failed'].append({
+                'sn': sn,
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+                'status': status
+            })
+
+        self.set_progress((results['completed'] / total_tasks) * 100 if total_tasks > 0 else 0)
+        if self.on_result:
+            self.on_result(sn, start_date, end_date, status)
+
+    def build_summary(self, data, total_tasks, results, failed_saves=0, error=None):
+        """Build the machine-readable result of a run"""
+        return {
+            'website': data['website'],
+            'start_date': data['start_date'].isoformat(),
+            'end_date': data['end_date'].isoformat(),
+            'download_folder': self.download_folder,
+            'total': total_tasks,
+            'successful': results['successful'],
+            'failed': results['failed'],
+            'failed_saves': failed_saves,
+            'error': error
+        }
+
+    def split_date_range(self, start_date, end_date, window_days):
+        """Split a date range into consecutive windows of window_days days (0 = no split)"""
+        if window_days <= 0 or start_date >= end_date:
+            return [(start_date, end_date)]
+
+        windows = []
+        window_start = start_date
+        while window_start <= end_date:
+            window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+            windows.append((window_start, window_end))
+            window_start = window_end + timedelta(days=1)
+        return windows
+
+    def build_tasks(self, data):
+        """Build one (index, SN, start_date, end_date) task per SN and date window"""
+        windows = self.split_date_range(data['start_date'], data['end_date'], self.window_days)
+        return [
+            (i, sn, start_date, end_date)
+            for i, sn in enumerate(data['equipment_sns'])
+            for start_date, end_date in windows
+        ]
+
+    def get_download_filename(self, sn, start_date, end_date, suggested_filename):
+        """Build a deterministic filename for an SN and date range"""
+        extension = os.path.splitext(suggested_filename)[1] or '.xlsx'
+        safe_sn = re.sub(r'[^\w.-]', '_', sn)
+        return f"{safe_sn}_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}{extension}"
+
+    def get_download_path(self, sn, start_date, end_date, suggested_filename):
+        """Get the save path for a download; date windows go to a 'parts' subfolder until merged"""
+        folder = self.download_folder
+        if (start_date, end_date) != self.job_range:
+            folder = os.path.join(folder, 'parts')
+            os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, self.get_download_filename(sn, start_date, end_date, suggested_filename))
+
+    def save_download_in_background(self, download, sn, start_date, end_date):
+        """Start saving a download without blocking the worker that triggered it"""
+        task = asyncio.ensure_future(self.save_download(download, sn, start_date, end_date))
+        self.save_tasks.add(task)
+        task.add_done_callback(self.save_tasks.discard)
+
+    async def save_download(self, download, sn, start_date, end_date):
+        """Save a download under its deterministic name and remove Playwright's temporary copy"""
+        path = self.get_download_path(sn, start_date, end_date, download.suggested_filename)
+        try:
+            with self.tracer.span('save', sn):
+                await download.save_as(path)
+                await download.delete()
+        except Exception as e:
+            self.failed_saves += 1
+            self.log_message(f"❌ Error saving download for SN {sn}: {str(e)}")
+            self.ledger.mark_failed(self.job_website, sn, start_date, end_date, f"save failed: {str(e)}")
+            return None
+
+        self.on_download_saved(sn, start_date, end_date, path)
+        return path
+
+    def on_download_saved(self, sn, start_date, end_date, path):
+        """Called once a download has been completely written to the download folder"""
+        self.log_message(f"💾 Downloaded: {os.path.basename(path)}")
+        self.ledger.mark_done(self.job_website, sn, start_date, end_date, path)
+
+    def merge_window_files(self, part_paths, output_path):
+        """Merge the window exports of one SN into a single workbook, in date order"""
+        merged = openpyxl.Workbook(write_only=True)
+        merged_sheet = merged.create_sheet()
+        header = None
+
+        for part_path in part_paths:
+            part = openpyxl.load_workbook(part_path, read_only=True)
+            try:
+                for row_index, row in enumerate(part.worksheets[0].iter_rows(values_only=True)):
+                    # Every window export repeats the header row
+                    if row_index == 0 and header is not None and row == header:
+                        continue
+                    if header is None:
+                        header = row
+                    merged_sheet.append(row)
+            finally:
+                part.close()
+
+        merged.save(output_path)
+
+    def merge_windows(self, data, tasks):
+        """Merge each SN's window downloads into one file once all of its windows are done"""
+        windows_by_sn = {}
+        for _, sn, start_date, end_date in tasks:
+            windows_by_sn.setdefault(sn, []).append((start_date, end_date))
+
+        for sn, windows in windows_by_sn.items():
+            part_paths = []
+            for start_date, end_date in sorted(windows):
+                row = self.ledger.get_status(data['website'], sn, start_date, end_date)
+                if not row or row[0] != 'done' or not row[1]:
+                    part_paths = None
+                    break
+                part_paths.append(row[1])
+
+            if not part_paths:
+                self.log_message(f"⚠️  Not merging SN {sn}: some date windows failed, rerun to retry them")
+                continue
+
+            if not all(path.lower().endswith('.xlsx') for path in part_paths):
+                self.log_message(f"⚠️  Not merging SN {sn}: only .xlsx exports can be merged")
+                continue
+
+            output_path = os.path.join(
+                self.download_folder,
+                self.get_download_filename(sn, data['start_date'], data['end_date'], 'merged.xlsx')
+            )
+            try:
+                self.merge_window_files(part_paths, output_path)
+                self.ledger.mark_done(data['website'], sn, data['start_date'], data['end_date'], output_path)
+                self.log_message(f"🧩 Merged {len(part_paths)} window(s) into {os.path.basename(output_path)}")
+            except Exception as e:
+                self.log_message(f"❌ Error merging windows for SN {sn}: {str(e)}")
+
+    def merge_unmerged_windows(self, data, tasks):
+        """Merge the SNs whose windows were all downloaded by an earlier run that stopped before merging them"""
+        if len(tasks) <= len(data['equipment_sns']):
+            return
+
+        unmerged_tasks = []
+        for sn in data['equipment_sns']:
+            if self.ledger.is_done(data['website'], sn, data['start_date'], data['end_date']):
+                continue
+            sn_tasks = [task for task in tasks if task[1] == sn]
+            if all(self.ledger.is_done(data['website'], *task[1:]) for task in sn_tasks):
+                unmerged_tasks.extend(sn_tasks)
+
+        if unmerged_tasks:
+            self.merge_windows(data, unmerged_tasks)
+
+    async def download_worker(self, page, task_queue, results, total_tasks, export_url):
+        """Pull tasks from the shared queue and download them on one page"""
+        while True:
+            try:
+                i, sn, start_date, end_date = task_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            # Hold a slot of the shared concurrency budget, if any, for the whole attempt
+            async with self.slots or contextlib.nullcontext():
+                self.log_message(f"\n📍 Processing equipment {i + 1} ({results['completed'] + 1}/{total_tasks})")
+                status = await self.download_with_retry(page, sn, start_date, end_date, export_url)
+
+            self.record_result(results, sn, start_date, end_date, status, total_tasks)
+
+    def log_download_started(self, download):
+        """Log a download as soon as the page fires it"""
+        self.log_message(f"📥 Download started: {download.suggested_filename}")
+
+    async def run_browser_workers(self, browser, context, page, data, export_url, pending_tasks, results, total_tasks):
+        """Download the pending tasks on a pool of pages that share the logged-in session"""
+        worker_count = max(1, min(self.worker_count, len(pending_tasks)))
+
+        # Open worker pages that share the logged-in session
+        pages = [page]
+        if worker_count > 1:
+            storage_state = await context.storage_state()
+            for _ in range(worker_count - 1):
+                worker_context = await browser.new_context(
+                    accept_downloads=True,
+                    storage_state=storage_state
+                )
+                await self.setup_resource_blocking(worker_context, data['website'])
+                worker_page = await worker_context.new_page()
+                worker_page.on("download", self.log_download_started)
+                pages.append(worker_page)
+
+        # Navigate directly to export page
+        self.log_message(f"📊 Navigating to export page: {export_url}")
+        await asyncio.gather(*(self.open_export_page(worker_page, export_url) for worker_page in pages))
+
+        # Shared queue of tasks pulled by every worker
+        task_queue = asyncio.Queue()
+        for task in pending_tasks:
+            task_queue.put_nowait(task)
+
+        self.log_message(f"🚀 Starting to process {len(pending_tasks)} download(s) with {worker_count} worker(s)...")
+
+        try:
+            await asyncio.gather(*(
+                self.download_worker(worker_page, task_queue, results, total_tasks, export_url)
+                for worker_page in pages
+            ))
+        finally:
+            # The browser may go on to serve another job, so extra worker contexts are closed here
+            for worker_page in pages[1:]:
+                await worker_page.context.close()
+
+    async def capture_export_request(self, page, sn, start_date, end_date, export_url):
+        """Download one SN through the page and capture the request that produced the file"""
+        requests = []
+
+        def handle_request(request):
+            if sn in request.url or sn in (request.post_data or ''):
+                requests.append(request)
+
+        page.on("request", handle_request)
+        try:
+            status = await self.download_with_retry(page, sn, start_date, end_date, export_url)
+        finally:
+            page.remove_listener("request", handle_request)
+
+        if status != DOWNLOAD_OK or not requests:
+            return status, None
+
+        # The query request also carries the SN, the export request is the last one
+        request = requests[-1]
+        export_request = {
+            'sn': sn,
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'method': request.method,
+            'url': request.url,
+            'headers': await request.all_headers(),
+            'post_data': request.post_data
+        }
+        return status, export_request
+
+    async def run_http_export(self, context, page, data, export_url, pending_tasks, results, total_tasks):
+        """Export tasks in the browser until one yields a file, then replay its export request over HTTP for the rest.
+
+        Returns the tasks that still have to be processed in the browser.
+        """
+        self.log_message(f"📊 Navigating to export page: {export_url}")
+        await self.open_export_page(page, export_url)
+
+        # Tasks without data (or failing) give nothing to capture, so keep going until one downloads a file
+        export_request = None
+        status = None
+        remaining_tasks = list(pending_tasks)
+        while remaining_tasks and export_request is None and status != DOWNLOAD_OK:
+            i, sn, start_date, end_date = remaining_tasks.pop(0)
+            self.log_message(f"\n📍 Processing equipment {i + 1} ({results['completed'] + 1}/{total_tasks})")
+            status, export_request = await self.capture_export_request(page, sn, start_date, end_date, export_url)
+            self.record_result(results, sn, start_date, end_date, status, total_tasks)
+
+        if export_request is None:
+            if remaining_tasks:
+                self.log_message("⚠️  Could not capture the export request, falling back to browser export")
+            return remaining_tasks
+
+        self.log_message(f"🔗 Captured export request: {export_request['method']} {export_request['url']}")
+
+        def handle_result(sn, start_date, end_date, status, path):
+            if status == DOWNLOAD_OK:
+                self.ledger.mark_done(self.job_website, sn, start_date, end_date, path)
+            self.record_result(results, sn, start_date, end_date, status, total_tasks)
+
+        exporter = HttpExporter(
+            export_request,
+            await context.cookies(export_request['url']),
+            self.get_download_path,
+            self.log_message,
+            concurrency=self.worker_count,
+            retry_policy=self.retry_policy,
+            circuit_breaker=self.circuit_breaker
+        )
+
+        # Replaying a request whose SN or dates cannot be substituted would download the captured task again
+        captured_range = (start_date, end_date)
+        if any(task[1] != sn for task in remaining_tasks) and not exporter.has_sn():
+            self.log_message("⚠️  Export request does not carry the SN in a field, falling back to browser export")
+            return remaining_tasks
+        if any((task[2], task[3]) != captured_range for task in remaining_tasks) and not exporter.has_dates():
+            self.log_message("⚠️  Export request does not carry the dates, falling back to browser export")
+            return remaining_tasks
+
+        if remaining_tasks:
+            self.log_message(f"🚀 Exporting {len(remaining_tasks)} download(s) over HTTP...")
+            await exporter.export_all([task[1:] for task in remaining_tasks], on_result=handle_result)
+        return []
+
+    async def login(self, page, data):
+        """Log in through the login page form"""
+        # Navigate to login page
+        self.log_message(f"🌐 Navigating to {data['website']}")
+        await page.goto(data['website'])
+        await page.wait_for_load_state('networkidle')
+
+        # Login
+        self.log_message("🔐 Logging in...")
+        host = self.get_host(data['website'])
+
+        # Fill username
+        try:
+            username_selectors = [
+                'input[placeholder*="賬號"]',
+                'input[placeholder*="账号"]',
+                'input[placeholder*="用户名"]',
+                'input[aria-label*="賬號"]',
+                'input[aria-label*="账号"]',
+                'input[type="text"]',
+                '#el-id-215-31'
+            ]
+
+            username_filled = False
+            username_selectors = self.selector_cache.order(host, 'username', username_selectors)
+            for selector in await self.resolve_selectors(page, username_selectors):
+                try:
+                    await page.fill(selector, data['username'], timeout=3000)
+                    if not await self.has_value(page, selector, data['username']):
+                        continue
+                    username_filled = True
+                    self.log_message(f"✓ Filled username: {data['username']}")
+                    break
+                except:
+                    continue
+
+            self.selector_cache.record(host, 'username', username_selectors, selector if username_filled else None)
+
+            if not username_filled:
+                raise Exception("Could not fill username")
+
+            await page.keyboard.press('Tab')
+        except Exception as e:
+            self.log_message(f"❌ Error filling username: {str(e)}")
+            return False
+
+        # Fill password
+        try:
+            password_selectors = [
+                'input[placeholder*="密碼"]',
+                'input[placeholder*="密码"]',
+                'input[type="password"]',
+                'input[aria-label*="密碼"]',
+                'input[aria-label*="密码"]',
+                '#el-id-215-32'
+            ]
+
+            password_filled = False
+            password_selectors = self.selector_cache.order(host, 'password', password_selectors)
+            for selector in await self.resolve_selectors(page, password_selectors):
+                try:
+                    await page.fill(selector, data['password'], timeout=3000)
+                    if not await self.has_value(page, selector, data['password']):
+                        continue
+                    password_filled = True
+                    self.log_message("✓ Password filled successfully")
+                    break
+                except:
+                    continue
+
+            self.selector_cache.record(host, 'password', password_selectors, selector if password_filled else None)
+
+            if not password_filled:
+                raise Exception("Could not fill password")
+
+            await page.keyboard.press('Enter')
+            await self.wait_for_login(page)
+        except Exception as e:
+            self.log_message(f"❌ Error filling password: {str(e)}")
+            return False
+
+        self.log_message("✅ Login successful")
+        return True
+
+    async def check_session(self, page, export_url):
+        """Open the export page and check that it is not redirected to the login form"""
+        try:
+            await page.goto(export_url)
+            await page.wait_for_selector(f'{EXPORT_FORM_SELECTOR}, input[type="password"]', state='visible',
+                                         timeout=15000)
+            await page.wait_for_load_state('networkidle')
+            return not await page.is_visible('input[type="password"]')
+        except Exception:
+            return False
+
+    def plan_job(self, data):
+        """Build a job's tasks, the ones still pending and its results so far.
+
+        Tasks finished by an earlier run count as done.
+        """
+        tasks = self.build_tasks(data)
+        pending_tasks = [
+            task for task in tasks
+            if not self.ledger.is_done(data['website'], *task[1:])
+        ]
+        skipped = len(tasks) - len(pending_tasks)
+        if skipped:
+            self.log_message(f"⏭️  Skipping {skipped} download(s) already completed by a previous run")
+        results = {'completed': skipped, 'successful': skipped, 'failed': []}
+        return tasks, pending_tasks, results
+
+    async def open_session(self, p, data):
+        """Launch a browser and log in, reusing a saved session if the portal still accepts it.
+
+        Returns (browser, context, page); page is None if the login failed.
+        """
+        with self.tracer.span('launch'):
+            browser = await p.chromium.launch(
+                headless=self.headless,
+                args=['--disable-dev-shm-usage']
+            )
+
+        # Create context with download handling, restoring a saved session if there is one
+        storage_state = self.session_cache.load(data['website'], data['username'])
+        context = await browser.new_context(
+            accept_downloads=True,
+            storage_state=storage_state
+        )
+
+        await self.setup_resource_blocking(context, data['website'])
+
+        page = await context.new_page()
+        page.on("download", self.log_download_started)
+
+        export_url = self.get_export_url(data['website'])
+
+        # Reuse a saved session if it is still accepted by the portal
+        logged_in = False
+        if storage_state:
+            self.log_message("🔑 Checking saved session...")
+            with self.tracer.span('session_check'):
+                logged_in = await self.check_session(page, export_url)
+            if logged_in:
+                self.log_message("✅ Reused saved session, skipping login")
+            else:
+                self.log_message("⚠️  Saved session expired, logging in again")
+                self.session_cache.clear(data['website'], data['username'])
+
+        if not logged_in:
+            with self.tracer.span('login') as span:
+                span['ok'] = await self.login(page, data)
+            if not span['ok']:
+                return browser, context, None
+            self.session_cache.save(data['website'], data['username'], await context.storage_state())
+
+        return browser, context, page
+
+    async def run_job(self, browser, context, page, data, tasks, pending_tasks, results):
+        """Download a job's pending tasks on an open, logged-in browser and return its summary"""
+        self.job_website = data['website']
+        self.job_range = (data['start_date'], data['end_date'])
+        total_tasks = len(tasks)
+        export_url = self.get_export_url(data['website'])
+        error = None
+
+        # Downloads are saved by background tasks as soon as they fire
+        self.save_tasks = set()
+        self.failed_saves = 0
+
+        try:
+            if self.http_export:
+                pending_tasks = await self.run_http_export(
+                    context, page, data, export_url, pending_tasks, results, total_tasks
+                )
+
+            if pending_tasks:
+                await self.run_browser_workers(
+                    browser, context, page, data, export_url, pending_tasks, results, total_tasks
+                )
+
+            # Wait for all downloads to complete
+            self.log_message("⏳ Waiting for downloads to complete...")
+
+            await asyncio.gather(*list(self.save_tasks))
+
+            if len(tasks) > len(data['equipment_sns']):
+                self.merge_windows(data, tasks)
+
+            self.set_progress(100)
+            self.log_message(f"\n🎉 Process completed!")
+            self.log_message(f"📊 Success rate: {results['successful']}/{total_tasks} downloads successful")
+            if self.failed_saves:
+                self.log_message(f"⚠️  {self.failed_saves} download(s) could not be saved")
+            self.log_message(f"📁 Files saved to: {self.download_folder}")
+
+        except Exception as e:
+            error = str(e)
+            self.log_message(f"❌ Automation error: {error}")
+        finally:
+            # Never move on under a download that is still being saved
+            await asyncio.gather(*list(self.save_tasks), return_exceptions=True)
+
+        return self.build_summary(data, total_tasks, results, self.failed_saves, error)
+
+    async def run_jobs(self, p, jobs):
+        """Run several jobs of one account on one warm browser, logging in once.
+
+        Returns the summary of every job, in order.
+        """
+        own_ledger = self.ledger is None
+        if own_ledger:
+            self.ledger = JobLedger(self.download_folder)
+
+        # Skip SN/date pairs that an earlier, interrupted run already downloaded
+        plans = [self.plan_job(data) for data in jobs]
+
+        browser = None
+        try:
+            if not any(pending_tasks for _, pending_tasks, _ in plans):
+                self.log_message("✅ All equipment already downloaded for this date range")
+                for data, (tasks, _, _) in zip(jobs, plans):
+                    self.merge_unmerged_windows(data, tasks)
+                return [self.build_summary(data, len(tasks), results) for data, (tasks, _, results) in zip(jobs, plans)]
+
+            browser, context, page = await self.open_session(p, jobs[0])
+            if page is None:
+                return [
+                    self.build_summary(data, len(tasks), results, error="Login failed")
+                    for data, (tasks, _, results) in zip(jobs, plans)
+                ]
+
+            summaries = []
+            for data, (tasks, pending_tasks, results) in zip(jobs, plans):
+                if pending_tasks:
+                    summaries.append(await self.run_job(browser, context, page, data, tasks, pending_tasks, results))
+                else:
+                    self.merge_unmerged_windows(data, tasks)
+                    summaries.append(self.build_summary(data, len(tasks), results))
+
+            self.tracer.log_summary(self.log_message)
+            return summaries
+
+        except asyncio.CancelledError:
+            self.log_message("⏹️  Download cancelled, the rest will be downloaded by the next run")
+            raise
+        except Exception as e:
+            error = str(e)
+            self.log_message(f"❌ Automation error: {error}")
+            return [
+                self.build_summary(data, len(tasks), results, error=error)
+                for data, (tasks, _, results) in zip(jobs, plans)
+            ]
+        finally:
+            self.selector_cache.save()
+            if own_ledger:
+                self.ledger.close()
+                self.ledger = None
+            if browser:
+                await browser.close()
+
+    async def run_automation(self, data):
+        """Run the web automation process and return its summary (see build_summary)"""
+        async with async_playwright() as p:
+            return (await self.run_jobs(p, [data]))[0]
@@ -1,143 +1,92 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import openpyxl
+from openpyxl.cell import Cell
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import copy
+import multiprocessing
 import os
 from pathlib import Path
+import pickle
 import threading
 
+from TemplatePackage import PackageError, TemplatePackage
+from UiEventQueue import UiEventQueue
 
-class ExcelProcessor:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("Excel Data Processor")
-        self.root.geometry("600x400")
-
-        # Variables
-        self.folder_path = tk.StringVar()
-
-        self.create_widgets()
-
-    def create_widgets(self):
-        # Main frame
-        main_frame = ttk.Frame(self.root, padding="10")
-        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-
-        # Folder selection
-        ttk.Label(main_frame, text="Select Folder:").grid(row=0, column=0, sticky=tk.W, pady=5)
-
-        folder_frame = ttk.Frame(main_frame)
-        folder_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
-
-        ttk.Entry(folder_frame, textvariable=self.folder_path, width=50).grid(row=0, column=0, sticky=(tk.W, tk.E))
-        ttk.Button(folder_frame, text="Browse", command=self.browse_folder).grid(row=0, column=1, padx=(5, 0))
 
-        folder_frame.columnconfigure(0, weight=1)
-
-        # Process button
-        ttk.Button(main_frame, text="Process Files", command=self.start_processing).grid(row=2, column=0, pady=20)
-
-        # Progress bar
-        self.progress = ttk.Progressbar(main_frame, length=400, mode='determinate')
-        self.progress.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
-
-        # Status label
-        self.status_label = ttk.Label(main_frame, text="Ready to process files")
-        self.status_label.grid(row=4, column=0, columnspan=2, pady=5)
-
-        # Log text area
-        ttk.Label(main_frame, text="Processing Log:").grid(row=5, column=0, sticky=tk.W, pady=(10, 0))
-
-        log_frame = ttk.Frame(main_frame)
-        log_frame.grid(row=6, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
-
-        self.log_text = tk.Text(log_frame, height=15, width=70)
-        scrollbar = ttk.Scrollbar(log_frame, orient="vertical", command=self.log_text.yview)
-        self.log_text.configure(yscrollcommand=scrollbar.set)
-
-        self.log_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
-
-        log_frame.columnconfigure(0, weight=1)
-        log_frame.rowconfigure(0, weight=1)
-
-        # Configure grid weights
-        main_frame.columnconfigure(0, weight=1)
-        main_frame.rowconfigure(6, weight=1)
-        self.root.columnconfigure(0, weight=1)
-        self.root.rowconfigure(0, weight=1)
-
-    def browse_folder(self):
-        folder_selected = filedialog.askdirectory()
-        if folder_selected:
-            self.folder_path.set(folder_selected)
+def find_data_sheet_name(sheet_names):
+    """Find the name of the data sheet among a workbook's sheet names"""
+    # First, try to find a sheet named "data" (case-insensitive)
+    for name in sheet_names:
+        if name.lower() == 'data':
+            return name
 
-    def log_message(self, message):
-        self.log_text.insert(tk.END, message + "\n")
-        self.log_text.see(tk.END)
-        self.root.update_idletasks()
+    # If no "data" sheet found, try other common names
+    data_keywords = ['data', 'monitoring', 'readings', 'measurements', 'values']
+    for name in sheet_names:
+        for keyword in data_keywords:
+            if keyword in name.lower():
+                return name
 
-    def start_processing(self):
-        if not self.folder_path.get():
-            messagebox.showerror("Error", "Please select a folder first!")
-            return
+    # If still not found, use the first sheet
+    if sheet_names:
+        return sheet_names[0]
 
-        # Run processing in a separate thread to prevent UI freezing
-        thread = threading.Thread(target=self.process_files)
-        thread.daemon = True
-        thread.start()
+    return None
 
-    def process_files(self):
-        try:
-            folder = Path(self.folder_path.get())
 
-            # Clear log
-            self.log_text.delete(1.0, tk.END)
+def iter_data_rows(source_rows, start_row=2):
+    """Number (time, reading) value pairs read from start_row down and yield the ones with data.
 
-            # Find template file
-            template_file = self.find_template_file(folder)
-            if not template_file:
-                self.log_message("ERROR: No template file found (should start with 'template')")
-                return
+    Leading empty rows are skipped and reading stops at the first empty row after the data.
+    """
+    has_data = False
+    for row, values in enumerate(source_rows, start=start_row):
+        # Only copy if there's actual data (at least one value is not None)
+        if values[0] is None and values[1] is None:
+            if has_data:
+                # If we've already copied some data and hit empty rows, stop
+                break
+            continue
 
-            self.log_message(f"Found template file: {template_file.name}")
+        has_data = True
+        yield row, values
 
-            # Check template file structure
-            if not self.validate_template_file(template_file):
-                return
 
-            # Find raw data files (Excel files that don't start with 'template')
-            raw_files = self.find_raw_files(folder)
-            if not raw_files:
-                self.log_message("ERROR: No raw data files found")
-                return
+class TemplateSnapshot:
+    """A template workbook parsed once per batch and handed out as independent copies.
 
-            self.log_message(f"Found {len(raw_files)} raw data files to process")
+    The parsed workbook is pickled once; unpickling a copy for each raw file
+    skips the zip and XML parsing that openpyxl.load_workbook would repeat.
+    With use_package, the template is also prepared for TemplatePackage, which
+    patches the .xlsx package directly; package is None if it cannot.
+    """
 
-            # Setup progress bar
-            self.progress['maximum'] = len(raw_files)
-            self.progress['value'] = 0
+    def __init__(self, template_file, use_package=False):
+        self.template_file = template_file
+        workbook = openpyxl.load_workbook(template_file)
+        self.sheet_names = workbook.sheetnames
+        self.data = pickle.dumps(workbook, pickle.HIGHEST_PROTOCOL)
+        workbook.close()
 
-            # Process each raw file
-            for i, raw_file in enumerate(raw_files):
-                self.status_label.config(text=f"Processing {raw_file.name}...")
-                self.log_message(f"\nProcessing: {raw_file.name}")
+        self.package = None
+        self.package_error = None
+        if use_package:
+            try:
+                self.package = TemplatePackage(template_file, find_data_sheet_name(self.sheet_names))
+            except PackageError as e:
+                self.package_error = str(e)
 
-                try:
-                    self.process_single_file(template_file, raw_file)
-                    self.log_message(f"✓ Successfully processed: {raw_file.name}")
-                except Exception as e:
-                    self.log_message(f"✗ Error processing {raw_file.name}: {str(e)}")
+    def new_workbook(self):
+        """A fresh copy of the template workbook, safe to change and save"""
+        return pickle.loads(self.data)
 
-                self.progress['value'] = i + 1
-                self.root.update_idletasks()
 
-            self.status_label.config(text="Processing completed!")
-            self.log_message(f"\n=== Processing completed! ===")
-            messagebox.showinfo("Success", "All files have been processed!")
+class NoiseFileProcessor:
+    """Fill a copy of the template with each raw noise file; the processing behind ExcelProcessor, without UI"""
 
-        except Exception as e:
-            self.log_message(f"ERROR: {str(e)}")
-            messagebox.showerror("Error", f"An error occurred: {str(e)}")
+    def __init__(self, log_message=print):
+        self.log_message = log_message
 
     def find_template_file(self, folder):
         """Find the first Excel file that starts with 'template'"""
@@ -159,118 +108,121 @@ class ExcelProcessor:
                     raw_files.append(file)
         return raw_files
 
-    def validate_template_file(self, template_file):
-        """Validate template file and show available sheets"""
+    def validate_template_file(self, template_file, use_package=False):
+        """Validate template file and show available sheets; returns its TemplateSnapshot, or None"""
         try:
-            wb = openpyxl.load_workbook(template_file)
-            sheet_names = wb.sheetnames
+            template = TemplateSnapshot(template_file, use_package)
+            wb = template.new_workbook()
 
-            self.log_message(f"Template worksheets: {sheet_names}")
+            self.log_message(f"Template worksheets: {template.sheet_names}")
+            if template.package_error:
+                self.log_message(f"Template cannot be patched directly ({template.package_error}), using openpyxl")
 
             # Try to find the data sheet
             data_sheet = self.find_data_sheet(wb)
             if data_sheet:
                 self.log_message(f"Using template sheet: '{data_sheet.title}' for data")
                 wb.close()
-                return True
+                return template
             else:
                 self.log_message("ERROR: Could not find a suitable data sheet in template")
                 wb.close()
-                return False
+                return None
 
         except Exception as e:
             self.log_message(f"ERROR: Could not validate template file: {str(e)}")
-            return False
+            return None
 
     def find_data_sheet(self, workbook):
         """Find the data sheet in the workbook"""
-        sheet_names = workbook.sheetnames
+        name = find_data_sheet_name(workbook.sheetnames)
+        return workbook[name] if name else None
 
-        # First, try to find a sheet named "data" (case-insensitive)
-        for name in sheet_names:
-            if name.lower() == 'data':
-                return workbook[name]
+    def process_single_file(self, template, raw_file):
+        """Process a single raw data file using the template"""
+        output_filename = raw_file.stem + "_processed.xlsx"
+        output_path = raw_file.parent / output_filename
 
-        # If no "data" sheet found, try other common names
-        data_keywords = ['data', 'monitoring', 'readings', 'measurements', 'values']
-        for name in sheet_names:
-            for keyword in data_keywords:
-                if keyword in name.lower():
-                    return workbook[name]
+        # Open the raw data workbook read-only, so its rows are parsed as they are read
+        raw_wb = openpyxl.load_workbook(raw_file, read_only=True)
+        try:
+            raw_sheet = raw_wb.worksheets[0]  # Get the first (and only) sheet
+            self.log_message(f"  → Using raw data sheet: '{raw_sheet.title}'")
 
-        # If still not found, use the first sheet
-        if sheet_names:
-            return workbook[sheet_names[0]]
+            saved = False
+            if template.package:
+                try:
+                    self.save_with_package(template.package, raw_sheet, raw_file.stem, output_path)
+                    saved = True
+                except PackageError as e:
+                    self.log_message(f"  → Cannot patch the template directly ({e}), using openpyxl")
 
-        return None
+            if not saved:
+                self.save_with_openpyxl(template, raw_sheet, raw_file.stem, output_path)
+        finally:
+            raw_wb.close()
 
-    def process_single_file(self, template_file, raw_file):
-        """Process a single raw data file using the template"""
+        self.log_message(f"  → Saved as: {output_filename}")
 
-        # Load the template workbook
-        template_wb = openpyxl.load_workbook(template_file)
+    def save_with_package(self, package, raw_sheet, title, output_path):
+        """Write the output by patching the template package: new data rows and chart titles, all else as is"""
+        self.log_message(f"  → Using template sheet: '{package.data_sheet_name}'")
+
+        raw_rows = raw_sheet.iter_rows(min_row=2, max_col=2, values_only=True)
+        rows_copied, charts_updated = package.save(iter_data_rows(raw_rows, package.start_row), title, output_path)
+        self.log_message(f"  → Copied {rows_copied} rows of data")
+        self.log_message(f"  → Updated {charts_updated} chart title(s) to: '{title}'")
+
+    def save_with_openpyxl(self, template, raw_sheet, title, output_path):
+        """Write the output from a copy of the template workbook"""
+
+        # Copy the template workbook parsed at the start of the batch
+        template_wb = template.new_workbook()
 
         # Find the data sheet in template
         data_sheet = self.find_data_sheet(template_wb)
         if not data_sheet:
             raise Exception("Could not find data sheet in template")
 
-        # Load the raw data workbook - just get the first/only sheet
-        raw_wb = openpyxl.load_workbook(raw_file)
-        raw_sheet = raw_wb.worksheets[0]  # Get the first (and only) sheet
-
         self.log_message(f"  → Using template sheet: '{data_sheet.title}'")
-        self.log_message(f"  → Using raw data sheet: '{raw_sheet.title}'")
 
-        # Clear existing data in template (columns A and B from row 2 onwards)
-        self.clear_columns(data_sheet, ['A', 'B'], start_row=2)
-
-        # Copy data from raw file to template
-        rows_copied = self.copy_data(raw_sheet, data_sheet)
+        # Replace the template's columns A and B from row 2 onwards with the streamed raw rows
+        raw_rows = raw_sheet.iter_rows(min_row=2, max_col=2, values_only=True)
+        rows_copied = self.replace_data(raw_rows, data_sheet, start_row=2)
         self.log_message(f"  → Copied {rows_copied} rows of data")
 
         # Update chart title if chart exists
-        self.update_chart_title(template_wb, raw_file.stem)
+        self.update_chart_title(template_wb, title)
 
         # Save the processed file
-        output_filename = raw_file.stem + "_processed.xlsx"
-        output_path = raw_file.parent / output_filename
         template_wb.save(output_path)
 
-        # Close workbooks
+        # Close the template copy
         template_wb.close()
-        raw_wb.close()
 
-        self.log_message(f"  → Saved as: {output_filename}")
+    def replace_data(self, source_rows, target_sheet, start_row=2):
+        """Replace columns A and B of target sheet from start_row down with (time, reading) value pairs.
 
-    def clear_columns(self, sheet, columns, start_row=2):
-        """Clear specified columns from start_row to the end"""
-        max_row = sheet.max_row
+        The old cells are dropped and the new ones are created in one pass, with
+        no coordinate strings to parse, so the sheet holds one cell per value.
+        New cells keep the style of the template's first data row. Leading empty
+        rows are skipped and copying stops at the first empty row after the data.
+        """
+        cells = target_sheet._cells
+        styles = [cells[(start_row, column)]._style if (start_row, column) in cells else None for column in (1, 2)]
 
-        for col in columns:
-            for row in range(start_row, max_row + 100):  # Clear extra rows to be safe
-                sheet[f"{col}{row}"] = None
+        # Drop the old data, leaving every other column alone
+        for key in [key for key in cells if key[0] >= start_row and key[1] <= 2]:
+            del cells[key]
 
-    def copy_data(self, source_sheet, target_sheet):
-        """Copy data from source sheet columns A and B to target sheet"""
-
-        # Find the last row with data in source sheet
-        max_row = source_sheet.max_row
         rows_copied = 0
-
-        # Copy column A (time) and B (reading) from row 2 onwards
-        for row in range(2, max_row + 1):
-            time_value = source_sheet[f"A{row}"].value
-            reading_value = source_sheet[f"B{row}"].value
-
-            # Only copy if there's actual data (at least one value is not None)
-            if time_value is not None or reading_value is not None:
-                target_sheet[f"A{row}"] = time_value
-                target_sheet[f"B{row}"] = reading_value
-                rows_copied += 1
-            elif rows_copied > 0:
-                # If we've already copied some data and hit empty rows, stop
-                break
+        for row, values in iter_data_rows(source_rows, start_row):
+            for column, value in enumerate(values, start=1):
+                if value is not None:
+                    style = styles[column - 1]
+                    cells[(row, column)] = Cell(target_sheet, row=row, column=column, value=value,
+                                                style_array=copy(style) if style is not None else None)
+            rows_copied += 1
 
         return rows_copied
 
@@ -385,7 +337,217 @@ class ExcelProcessor:
             return f"Error reading title: {str(e)}"
 
 
+def process_raw_file(template, raw_file):
+    """Process one raw file and return the lines it logged and its error, or None if it succeeded"""
+    lines = []
+    try:
+        NoiseFileProcessor(lines.append).process_single_file(template, raw_file)
+        return lines, None
+    except Exception as e:
+        return lines, str(e)
+
+
+# The template a pool worker process was started with
+worker_template = None
+
+
+def init_worker(template):
+    """Give a pool worker process its own copy of the template snapshot"""
+    global worker_template
+    worker_template = template
+
+
+def process_raw_file_in_worker(raw_file):
+    return process_raw_file(worker_template, raw_file)
+
+
+class ExcelProcessor(NoiseFileProcessor):
+    def __init__(self, root):
+        self.root = root
+        self.root.title("Excel Data Processor")
+        self.root.geometry("600x400")
+
+        # Variables
+        self.folder_path = tk.StringVar()
+        self.worker_count = tk.IntVar(value=os.cpu_count() or 1)
+        self.use_package = tk.BooleanVar(value=True)
+
+        self.create_widgets()
+
+        # Log lines and progress from the processing thread are applied here in batches
+        self.ui_events = UiEventQueue(self.root, self.log_text, self.progress_var)
+        self.ui_events.start()
+        super().__init__(self.ui_events.log_message)
+
+    def create_widgets(self):
+        # Main frame
+        main_frame = ttk.Frame(self.root, padding="10")
+        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+
+        # Folder selection
+        ttk.Label(main_frame, text="Select Folder:").grid(row=0, column=0, sticky=tk.W, pady=5)
+
+        folder_frame = ttk.Frame(main_frame)
+        folder_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+
+        ttk.Entry(folder_frame, textvariable=self.folder_path, width=50).grid(row=0, column=0, sticky=(tk.W, tk.E))
+        ttk.Button(folder_frame, text="Browse", command=self.browse_folder).grid(row=0, column=1, padx=(5, 0))
+
+        folder_frame.columnconfigure(0, weight=1)
+
+        # Process button and worker processes
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=2, column=0, pady=20)
+
+        self.process_button = ttk.Button(button_frame, text="Process Files", command=self.start_processing)
+        self.process_button.pack(side=tk.LEFT)
+        ttk.Label(button_frame, text="Workers:").pack(side=tk.LEFT, padx=(20, 5))
+        ttk.Spinbox(button_frame, from_=1, to=64, textvariable=self.worker_count, width=4).pack(side=tk.LEFT)
+        ttk.Checkbutton(button_frame, text="Patch template directly (faster)",
+                        variable=self.use_package).pack(side=tk.LEFT, padx=(20, 0))
+
+        # Progress bar
+        self.progress_var = tk.DoubleVar()
+        self.progress = ttk.Progressbar(main_frame, variable=self.progress_var, length=400, mode='determinate')
+        self.progress.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        # Status label
+        self.status_label = ttk.Label(main_frame, text="Ready to process files")
+        self.status_label.grid(row=4, column=0, columnspan=2, pady=5)
+
+        # Log text area
+        ttk.Label(main_frame, text="Processing Log:").grid(row=5, column=0, sticky=tk.W, pady=(10, 0))
+
+        log_frame = ttk.Frame(main_frame)
+        log_frame.grid(row=6, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
+
+        self.log_text = tk.Text(log_frame, height=15, width=70)
+        scrollbar = ttk.Scrollbar(log_frame, orient="vertical", command=self.log_text.yview)
+        self.log_text.configure(yscrollcommand=scrollbar.set)
+
+        self.log_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+
+        log_frame.columnconfigure(0, weight=1)
+        log_frame.rowconfigure(0, weight=1)
+
+        # Configure grid weights
+        main_frame.columnconfigure(0, weight=1)
+        main_frame.rowconfigure(6, weight=1)
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(0, weight=1)
+
+    def browse_folder(self):
+        folder_selected = filedialog.askdirectory()
+        if folder_selected:
+            self.folder_path.set(folder_selected)
+
+    def get_worker_count(self):
+        """Get the number of processes working on raw files in parallel"""
+        try:
+            return max(1, int(self.worker_count.get()))
+        except (tk.TclError, ValueError):
+            return 1
+
+    def update_status(self, status):
+        """Update status label; safe to call from any thread"""
+        self.ui_events.call(self.status_label.config, text=status)
+
+    def start_processing(self):
+        if not self.folder_path.get():
+            messagebox.showerror("Error", "Please select a folder first!")
+            return
+
+        # Run processing in a separate thread to prevent UI freezing
+        self.process_button.config(state=tk.DISABLED)
+        thread = threading.Thread(target=self.process_files, args=(self.get_worker_count(), self.use_package.get()))
+        thread.daemon = True
+        thread.start()
+
+    def process_files(self, worker_count=1, use_package=True):
+        try:
+            folder = Path(self.folder_path.get())
+
+            # Clear log
+            self.ui_events.clear()
+
+            # Find template file
+            template_file = self.find_template_file(folder)
+            if not template_file:
+                self.log_message("ERROR: No template file found (should start with 'template')")
+                return
+
+            self.log_message(f"Found template file: {template_file.name}")
+
+            # Check template file structure and parse it once for the whole batch
+            template = self.validate_template_file(template_file, use_package)
+            if not template:
+                return
+
+            # Find raw data files (Excel files that don't start with 'template')
+            raw_files = self.find_raw_files(folder)
+            if not raw_files:
+                self.log_message("ERROR: No raw data files found")
+                return
+
+            worker_count = min(worker_count, len(raw_files))
+            self.log_message(f"Found {len(raw_files)} raw data files to process with {worker_count} worker(s)")
+
+            # Setup progress bar
+            self.ui_events.call(self.progress.config, maximum=len(raw_files))
+            self.ui_events.set_progress(0)
+            self.update_status(f"Processing {len(raw_files)} files...")
+
+            # Log each file as soon as it is done, in completion order
+            for done, (raw_file, lines, error) in enumerate(self.run_raw_files(template, raw_files, worker_count),
+                                                            start=1):
+                self.log_message(f"\nProcessing: {raw_file.name}")
+                for line in lines:
+                    self.log_message(line)
+                if error:
+                    self.log_message(f"✗ Error processing {raw_file.name}: {error}")
+                else:
+                    self.log_message(f"✓ Successfully processed: {raw_file.name}")
+
+                self.ui_events.set_progress(done)
+                self.update_status(f"Processed {done} of {len(raw_files)} files")
+
+            self.update_status("Processing completed!")
+            self.log_message(f"\n=== Processing completed! ===")
+            self.ui_events.call(messagebox.showinfo, "Success", "All files have been processed!")
+
+        except Exception as e:
+            self.log_message(f"ERROR: {str(e)}")
+            self.ui_events.call(messagebox.showerror, "Error", f"An error occurred: {str(e)}")
+
+        finally:
+            self.ui_events.call(self.process_button.config, state=tk.NORMAL)
+
+    def run_raw_files(self, template, raw_files, worker_count):
+        """Process raw files, in this thread or spread over worker processes.
+
+        Yields (raw_file, logged lines, error or None) for every file as it finishes.
+        """
+        if worker_count <= 1:
+            for raw_file in raw_files:
+                yield (raw_file, *process_raw_file(template, raw_file))
+            return
+
+        # Each worker process gets its own copy of the template when it starts
+        with ProcessPoolExecutor(max_workers=worker_count, initializer=init_worker,
+                                 initargs=(template,)) as pool:
+            futures = {pool.submit(process_raw_file_in_worker, raw_file): raw_file for raw_file in raw_files}
+            for future in as_completed(futures):
+                try:
+                    lines, error = future.result()
+                except Exception as e:
+                    # The worker process itself failed, e.g. it was killed
+                    lines, error = [], str(e)
+                yield futures[future], lines, error
+
+
 def main():
+    # Worker processes of a frozen executable start through main
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = ExcelProcessor(root)
     root.mainloop()
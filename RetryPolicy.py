@@ -0,0 +1,91 @@
+import random
+import threading
+import time
+
+# Outcomes of a single download attempt
+DOWNLOAD_OK = 'ok'
+SELECTOR_MISS = 'selector_miss'
+NO_DATA = 'no_data'
+TIMEOUT = 'timeout'
+SERVER_ERROR = 'server_error'
+ERROR = 'error'
+
+
+class RetryPolicy:
+    """Decide which failed downloads are retried and how long to back off before each retry"""
+
+    # Failures that may go away on their own; "no data" will not change by asking again
+    RETRYABLE = {SELECTOR_MISS, TIMEOUT, SERVER_ERROR, ERROR}
+
+    def __init__(self, max_retries=2, base_delay=2.0, max_delay=30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, status, attempt):
+        """Check whether a failure on the given (0-based) attempt should be retried"""
+        return status in self.RETRYABLE and attempt < self.max_retries
+
+    def get_delay(self, attempt):
+        """Exponential backoff with full jitter, so workers do not retry in lockstep"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Pause the whole job when the portal looks degraded.
+
+    After failure_threshold consecutive timeouts or server errors the circuit
+    opens and every worker waits for the cooldown. Then a single probe attempt
+    is let through: if it succeeds the circuit closes, otherwise it opens again.
+    """
+
+    # Failures that point at the portal rather than at one SN
+    PORTAL_FAILURES = {TIMEOUT, SERVER_ERROR}
+
+    # Outcomes that prove the portal answered normally
+    PORTAL_HEALTHY = {DOWNLOAD_OK, NO_DATA}
+
+    def __init__(self, failure_threshold=5, cooldown=60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def get_wait_time(self):
+        """Seconds the caller should wait before its next attempt (0 = go ahead)"""
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+
+            remaining = self.opened_at + self.cooldown - time.time()
+            if remaining > 0:
+                return remaining
+
+            # Cooldown over: let exactly one probe through, the others poll
+            if not self.probing:
+                self.probing = True
+                return 0
+            return 1.0
+
+    def record(self, status):
+        """Record the outcome of an attempt; returns True if this outcome opened the circuit"""
+        with self.lock:
+            if status in self.PORTAL_HEALTHY:
+                self.failures = 0
+                self.opened_at = None
+                self.probing = False
+                return False
+
+            if status not in self.PORTAL_FAILURES:
+                if self.probing:
+                    self.probing = False
+                return False
+
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.time()
+                self.probing = False
+                return True
+            return False
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+
+# Failures older than this no longer count against a selector, so a demoted selector is tried again
+FAILURE_EXPIRY_SECONDS = 15 * 60
+
+# A selector containing one of these names its field (by placeholder, label, text or value)
+SPECIFIC_SELECTOR_HINTS = ('placeholder', 'aria-label', 'has-text', 'text=', 'value=')
+
+
+def is_specific(selector):
+    """Check whether a selector names its field, rather than matching it by type or position"""
+    return any(hint in selector for hint in SPECIFIC_SELECTOR_HINTS)
+
+
+class SelectorCache:
+    """Remember which fallback selector worked for each form field on each portal host.
+
+    Selectors that worked are tried first on later SNs and runs; selectors that
+    start failing are demoted behind the ones that still work, until their
+    failures expire. Generic catch-alls such as input[type="text"] always come
+    after the selectors that name the field, however often they hit.
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file or os.path.join(os.path.expanduser("~"), ".envdatadl", "selectors.json")
+        self.lock = threading.Lock()
+        self.stats = self.load()
+
+    def load(self):
+        """Load selector statistics from disk"""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """Save selector statistics to disk"""
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+                with open(self.cache_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.stats, f, ensure_ascii=False, indent=2)
+            except OSError:
+                pass
+
+    def order(self, host, field, selectors):
+        """Order selectors so the ones that worked most recently are tried first.
+
+        Selectors that name the field come before generic ones. Within each
+        group, selectors with recent consecutive failures sort after the
+        others, then by number of hits; ties keep the original order.
+        """
+        now = time.time()
+
+        def get_recent_failures(entry):
+            if now - entry.get('last_failure', 0) > FAILURE_EXPIRY_SECONDS:
+                return 0
+            return entry.get('failures', 0)
+
+        with self.lock:
+            field_stats = self.stats.get(host, {}).get(field, {})
+            ranked = sorted(
+                enumerate(selectors),
+                key=lambda item: (
+                    not is_specific(item[1]),
+                    get_recent_failures(field_stats.get(item[1], {})),
+                    -field_stats.get(item[1], {}).get('hits', 0),
+                    item[0]
+                )
+            )
+        return [selector for _, selector in ranked]
+
+    def record(self, host, field, selectors, winner):
+        """Record the outcome of trying selectors in order.
+
+        Every selector tried before the winner counts as a miss. If winner is
+        None, every selector missed. Callers only pass a winner once its fill
+        or click has been checked.
+        """
+        with self.lock:
+            field_stats = self.stats.setdefault(host, {}).setdefault(field, {})
+            for selector in selectors:
+                entry = field_stats.setdefault(selector, {'hits': 0, 'failures': 0})
+                if selector == winner:
+                    entry['hits'] += 1
+                    entry['failures'] = 0
+                    entry['last_hit'] = time.time()
+                    break
+                entry['failures'] += 1
+                entry['last_failure'] = time.time()
@@ -0,0 +1,1215 @@
+import os
+import queue
+import re
+import threading
+from datetime import datetime
+
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from DownloadTracker import DownloadTracker
+from HttpExporter import classify_export_response
+from JobLedger import JobLedger
+from PhaseTracer import PhaseTracer
+from RetryPolicy import (CircuitBreaker, RetryPolicy, DOWNLOAD_OK, ERROR, NO_DATA, SELECTOR_MISS, SERVER_ERROR,
+                         TIMEOUT)
+from SelectorCache import SelectorCache
+from SessionCache import SessionCache
+
+# Images, fonts and media are never needed to fill the forms and export files
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.ico", "*.webp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3"
+]
+
+# Subfolder of the download folder for downloads that could not be matched to an SN
+QUARANTINE_FOLDER = "unmatched_downloads"
+
+# Inputs that only exist once the export form has rendered
+EXPORT_FORM_SELECTOR = (
+    'input[placeholder*="設備號"], input[placeholder*="设备号"], '
+    'input[placeholder*="開始時間"], input[placeholder*="开始时间"]'
+)
+
+# Returns [index, element] for every candidate that has a visible match, in candidate order
+RESOLVE_SELECTORS_JS = """
+var candidates = arguments[0], matches = [];
+for (var i = 0; i < candidates.length; i++) {
+    var nodes = [];
+    try {
+        if (candidates[i][0] === 'xpath') {
+            var result = document.evaluate(candidates[i][1], document, null,
+                XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            for (var j = 0; j < result.snapshotLength; j++) { nodes.push(result.snapshotItem(j)); }
+        } else {
+            nodes = document.querySelectorAll(candidates[i][1]);
+        }
+    } catch (e) {
+        continue;
+    }
+    for (var k = 0; k < nodes.length; k++) {
+        var el = nodes[k];
+        if (el.offsetWidth || el.offsetHeight || el.getClientRects().length) {
+            matches.push([i, el]);
+            break;
+        }
+    }
+}
+return matches;
+"""
+
+# Fills every export form field in one round-trip. Each field is clicked (value null) or has its value set
+# through the native setter, so the framework's v-model sees it, followed by the events a user would fire.
+# Returns the index of the candidate used per field (-1 if none was visible).
+FILL_FORM_JS = """
+var fields = arguments[0], used = {};
+var setValue = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+window.__envdlForm = {};
+function findVisible(candidate) {
+    var nodes = [];
+    try {
+        if (candidate[0] === 'xpath') {
+            var result = document.evaluate(candidate[1], document, null,
+                XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            for (var j = 0; j < result.snapshotLength; j++) { nodes.push(result.snapshotItem(j)); }
+        } else {
+            nodes = document.querySelectorAll(candidate[1]);
+        }
+    } catch (e) {
+        return null;
+    }
+    for (var k = 0; k < nodes.length; k++) {
+        if (nodes[k].offsetWidth || nodes[k].offsetHeight || nodes[k].getClientRects().length) { return nodes[k]; }
+    }
+    return null;
+}
+for (var f = 0; f < fields.length; f++) {
+    var field = fields[f];
+    used[field.name] = -1;
+    for (var i = 0; i < field.candidates.length; i++) {
+        var el = findVisible(field.candidates[i]);
+        if (!el) { continue; }
+        if (field.value === null) {
+            el.click();
+        } else {
+            el.focus();
+            setValue.call(el, field.value);
+            el.dispatchEvent(new Event('input', {bubbles: true}));
+            el.dispatchEvent(new Event('change', {bubbles: true}));
+            el.dispatchEvent(new KeyboardEvent('keydown', {key: 'Enter', keyCode: 13, bubbles: true}));
+            el.blur();
+        }
+        window.__envdlForm[field.name] = el;
+        used[field.name] = i;
+        break;
+    }
+}
+return used;
+"""
+
+# Reads back the values of the fields filled by FILL_FORM_JS
+VERIFY_FORM_JS = """
+var form = window.__envdlForm || {}, values = {};
+for (var name in form) { values[name] = form[name].value === undefined ? null : form[name].value; }
+return values;
+"""
+
+# Counts XHR/fetch requests (and 5xx responses) so waits can follow the portal's real network activity,
+# and keeps the status, file headers and start of a text body of the last response
+NETWORK_TRACKER_JS = """
+(function () {
+    if (window.__envdlNet) { return; }
+    var net = window.__envdlNet = {seq: 0, pending: 0, errors: 0, last: null};
+    var isText = function (type) { return /json|text|html/i.test(type || ''); };
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        var seq = ++net.seq;
+        net.pending++;
+        this.addEventListener('loadend', function () {
+            if (this.status >= 500) { net.errors++; }
+            var type = this.getResponseHeader('Content-Type');
+            var readable = this.responseType === '' || this.responseType === 'text';
+            net.last = {seq: seq, status: this.status, contentType: type,
+                        disposition: this.getResponseHeader('Content-Disposition'),
+                        body: readable && isText(type) ? this.responseText.slice(0, 1000) : ''};
+            net.pending--;
+        });
+        return send.apply(this, arguments);
+    };
+    if (window.fetch) {
+        var fetch = window.fetch;
+        window.fetch = function () {
+            var seq = ++net.seq;
+            net.pending++;
+            return fetch.apply(this, arguments).then(function (response) {
+                if (response.status >= 500) { net.errors++; }
+                var last = {seq: seq, status: response.status, contentType: response.headers.get('Content-Type'),
+                            disposition: response.headers.get('Content-Disposition'), body: ''};
+                var read = isText(last.contentType) ? response.clone().text().then(function (text) {
+                    last.body = text.slice(0, 1000);
+                }, function () {}) : Promise.resolve();
+                return read.then(function () { net.last = last; return response; });
+            }).finally(function () { net.pending--; });
+        };
+    }
+})();
+"""
+
+
+class SeleniumDownloader:
+    """Selenium download automation, independent of any user interface.
+
+    Progress is reported through the log_message and set_progress callbacks,
+    which default to printing on stdout and to doing nothing. They are always
+    called on the thread that called run_automation. Phase timings go to
+    tracer, a PhaseTracer (an in-memory one by default). cancel() may be
+    called from any thread.
+    """
+
+    def __init__(self, download_folder, worker_count=1, headless=False, block_resources=True, log_message=None,
+                 set_progress=None, tracer=None):
+        self.download_folder = download_folder
+        self.worker_count = max(1, int(worker_count))
+        self.headless = headless
+        self.block_resources = block_resources
+        self.log_message = log_message or self.print_message
+        self.set_progress = set_progress or (lambda progress: None)
+        self.session_cache = SessionCache()
+        self.selector_cache = SelectorCache()
+        self.retry_policy = RetryPolicy()
+        self.circuit_breaker = CircuitBreaker()
+        self.tracer = tracer or PhaseTracer()
+        self.cancelled = threading.Event()
+        self.ledger = None
+
+    def cancel(self):
+        """Stop the run once the SNs being downloaded right now are done"""
+        self.cancelled.set()
+
+    def print_message(self, message):
+        """Default log output: timestamped lines on stdout"""
+        print(f"{datetime.now().strftime('%H:%M:%S')} - {message}", flush=True)
+
+    def get_export_url(self, base_url):
+        """Generate the export URL from base URL"""
+        # Extract the base domain from the login URL
+        if 'env.nem.com.hk:10027' in base_url:
+            return 'https://env.nem.com.hk:10027/syntheticSystem/dataAnalysis/export'
+        else:
+            # For other domains, try to construct the URL
+            from urllib.parse import urlparse
+            parsed = urlparse(base_url)
+            return f"{parsed.scheme}://{parsed.netloc}/syntheticSystem/dataAnalysis/export"
+
+    def get_host(self, url):
+        """Get the host:port of a URL, used to key learned selectors per portal"""
+        from urllib.parse import urlparse
+        return urlparse(url).netloc
+
+    def fill_input_by_selectors(self, driver, selectors, field, value, timeout=5):
+        """Fill an input found with multiple selectors, starting with the ones that worked before.
+
+        A selector only counts as a hit once its input holds the value. Returns the filled element, or None.
+        """
+        host = self.get_host(driver.current_url)
+        selectors = self.selector_cache.order(host, field, selectors)
+
+        for selector, element in self.resolve_selectors(driver, selectors, timeout):
+            try:
+                element.clear()
+                element.send_keys(value)
+            except WebDriverException:
+                continue
+            if self.wait_for_value(driver, element, value):
+                self.selector_cache.record(host, field, selectors, selector)
+                return element
+
+        self.selector_cache.record(host, field, selectors, None)
+        return None
+
+    def to_locator(self, selector):
+        """Translate a Playwright-style selector into a Selenium (By, expression) pair"""
+        if selector.startswith('text='):
+            text = selector.replace('text=', '')
+            return By.XPATH, f"//*[contains(text(), '{text}')]"
+
+        match = re.match(r'^(.*):has-text\("(.+)"\)$', selector)
+        if match:
+            target, text = match.groups()
+            if target == 'label.is-active > span':
+                return By.XPATH, f"//label[@class='is-active']//span[contains(text(), '{text}')]"
+            elif target == '[role="button"]':
+                return By.XPATH, f"//*[@role='button'][contains(text(), '{text}')]"
+            else:
+                return By.XPATH, f"//{target}[contains(text(), '{text}')]"
+
+        return By.CSS_SELECTOR, selector
+
+    def to_candidates(self, selectors):
+        """Translate selectors into ['css'|'xpath', expression] pairs for the in-page scripts"""
+        return [
+            ['xpath' if by == By.XPATH else 'css', expression]
+            for by, expression in (self.to_locator(selector) for selector in selectors)
+        ]
+
+    def resolve_selectors(self, driver, selectors, timeout=5):
+        """Evaluate every candidate selector in one in-page script and return the visible matches in order.
+
+        Returns (selector, element) pairs. A miss costs a single timeout instead of
+        one timeout per selector.
+        """
+        candidates = self.to_candidates(selectors)
+
+        def find_visible(d):
+            matches = d.execute_script(RESOLVE_SELECTORS_JS, candidates)
+            return [(selectors[index], element) for index, element in matches] or False
+
+        try:
+            return WebDriverWait(driver, timeout, poll_frequency=0.1).until(find_visible)
+        except (TimeoutException, WebDriverException):
+            return []
+
+    def fill_form(self, driver, host, fields, timeout=2):
+        """Fill several form fields with one script, then verify them all with one script per poll.
+
+        fields is a list of (field, selectors, value), where a value of None
+        means the element is clicked. Returns the set of fields that could not
+        be filled, so only those need the slow field-by-field path.
+        """
+        ordered = {field: self.selector_cache.order(host, field, selectors) for field, selectors, _ in fields}
+        payload = [
+            {'name': field, 'candidates': self.to_candidates(ordered[field]), 'value': value}
+            for field, _, value in fields
+        ]
+
+        try:
+            used = driver.execute_script(FILL_FORM_JS, payload)
+        except WebDriverException:
+            return {field for field, _, _ in fields}
+
+        expected = {field: value for field, _, value in fields if value is not None and used.get(field, -1) >= 0}
+        values = {}
+
+        def all_filled(d):
+            values.update(d.execute_script(VERIFY_FORM_JS) or {})
+            return all(value in (values.get(field) or '') for field, value in expected.items())
+
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=0.1).until(all_filled)
+        except (TimeoutException, WebDriverException):
+            pass
+
+        missed = set()
+        for field, _, value in fields:
+            index = used.get(field, -1)
+            filled = index >= 0 and (value is None or value in (values.get(field) or ''))
+            self.selector_cache.record(host, field, ordered[field], ordered[field][index] if filled else None)
+            if not filled:
+                missed.add(field)
+        return missed
+
+    def wait_for_login(self, driver, password_element, timeout=15):
+        """Wait until the login form has been replaced by the logged-in page"""
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=0.1).until(EC.invisibility_of_element(password_element))
+        except TimeoutException:
+            self.log_message("⚠️  Login form still visible, continuing anyway...")
+
+    def wait_for_loading_mask(self, driver, timeout=15):
+        """Wait until no Element UI loading mask is visible"""
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+                EC.invisibility_of_element_located((By.CSS_SELECTOR, '.el-loading-mask')))
+        except TimeoutException:
+            pass
+
+    def wait_for_export_form(self, driver, timeout=15):
+        """Wait until the export form inputs are rendered and no loading mask is shown"""
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+                EC.visibility_of_any_elements_located((By.CSS_SELECTOR, EXPORT_FORM_SELECTOR)))
+            self.wait_for_loading_mask(driver, timeout)
+            return True
+        except TimeoutException:
+            self.log_message("  ⚠️  Export form not ready, continuing anyway...")
+            return False
+
+    def wait_for_value(self, driver, element, expected, timeout=2):
+        """Wait until an input's value contains the expected text"""
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+                lambda d: expected in (element.get_attribute('value') or ''))
+            return True
+        except TimeoutException:
+            return False
+
+    def get_request_seq(self, driver):
+        """Get the number of XHR/fetch requests the page has issued so far"""
+        try:
+            driver.execute_script(NETWORK_TRACKER_JS)
+            return driver.execute_script("return window.__envdlNet.seq;")
+        except WebDriverException:
+            return 0
+
+    def get_server_errors(self, driver):
+        """Get the number of XHR/fetch responses with a 5xx status the page has received so far"""
+        try:
+            return driver.execute_script("return window.__envdlNet ? window.__envdlNet.errors : 0;")
+        except WebDriverException:
+            return 0
+
+    def wait_for_network_response(self, driver, since_seq, timeout=15):
+        """Wait until a request issued after since_seq has received its response"""
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=0.1).until(lambda d: d.execute_script(
+                "var net = window.__envdlNet;"
+                "return !!net && net.seq > arguments[0] && net.pending === 0;",
+                since_seq
+            ))
+            return True
+        except TimeoutException:
+            return False
+
+    def get_last_response(self, driver, since_seq):
+        """Get {seq, status, contentType, disposition, body} of the last response to a request issued after since_seq"""
+        try:
+            response = driver.execute_script("return window.__envdlNet ? window.__envdlNet.last : null;")
+        except WebDriverException:
+            return None
+        return response if response and response['seq'] > since_seq else None
+
+    def download_data_for_sn(self, driver, sn, start_date, end_date, tracker=None):
+        """Download data for a specific equipment SN, returning the outcome as a RetryPolicy status.
+
+        With a DownloadTracker, the export only counts as done once the download has started.
+        """
+        try:
+            self.log_message(f"Processing SN: {sn}")
+
+            # Set date range
+            start_date_str = start_date.strftime('%Y-%m-%d')
+            end_date_str = end_date.strftime('%Y-%m-%d')
+
+            self.log_message(f"  Date range: {start_date_str} to {end_date_str}")
+
+            host = self.get_host(driver.current_url)
+
+            # Wait for the export form to be ready
+            with self.tracer.span('form_ready', sn):
+                self.wait_for_export_form(driver)
+
+            radio_selectors = [
+                'label:has-text("實時值")',
+                'input[value="實時值"]',
+                'label.is-active > span:has-text("實時值")',
+                'text=實時值'
+            ]
+
+            start_date_selectors = [
+                'input[placeholder*="開始時間"]',
+                'input[placeholder*="开始时间"]',
+                'input[aria-label*="開始時間"]',
+                'input[aria-label*="开始时间"]',
+                'div.flex-wrap > div:nth-of-type(2) input:nth-of-type(1)',
+                'input[type="text"]'
+            ]
+
+            end_date_selectors = [
+                'input[placeholder*="結束時間"]',
+                'input[placeholder*="结束时间"]',
+                'input[aria-label*="結束時間"]',
+                'input[aria-label*="结束时间"]',
+                'div.flex-wrap > div:nth-of-type(2) input:nth-of-type(2)',
+                'input[type="text"]:nth-of-type(2)'
+            ]
+
+            sn_selectors = [
+                'input[placeholder*="設備號"]',
+                'input[placeholder*="设备号"]',
+                'input[placeholder*="請輸入設備號"]',
+                'input[placeholder*="请输入设备号"]',
+                'input[aria-label*="設備號"]',
+                'input[aria-label*="设备号"]',
+                '#el-id-215-53'
+            ]
+
+            # Fill the radio, both dates and the SN in one in-page script
+            with self.tracer.span('fill_form', sn):
+                missed = self.fill_form(driver, host, [
+                    ('radio', radio_selectors, None),
+                    ('start_date', start_date_selectors, start_date_str),
+                    ('end_date', end_date_selectors, end_date_str),
+                    ('sn', sn_selectors, sn)
+                ])
+            if not missed:
+                self.log_message(f"  ✓ Filled form: 實時值, {start_date_str} to {end_date_str}, SN {sn}")
+            else:
+                missed_fields = ', '.join(sorted(missed))
+                self.log_message(f"  ⚠️  Fast form fill missed {missed_fields}, filling field by field...")
+
+            # Fallback: select real-time values (實時值) radio button
+            if 'radio' in missed:
+                with self.tracer.span('radio', sn) as span:
+                    try:
+                        # The fast form fill missed this field, so the whole span is fallback time
+                        self.tracer.mark_fallback(span)
+                        radio_selected = False
+                        radio_selectors = self.selector_cache.order(host, 'radio', radio_selectors)
+                        for selector, element in self.resolve_selectors(driver, radio_selectors):
+                            try:
+                                element.click()
+                                radio_selected = True
+                                self.log_message("  ✓ Selected 實時值 option")
+                                break
+                            except:
+                                continue
+
+                        self.selector_cache.record(host, 'radio', radio_selectors, selector if radio_selected else None)
+
+                        if not radio_selected:
+                            self.log_message("  ⚠️  Could not select 實時值 option, continuing anyway...")
+                    except Exception as e:
+                        self.log_message(f"  ⚠️  Error selecting real-time values: {str(e)}")
+
+            # Fallback: fill start date
+            if 'start_date' in missed:
+                with self.tracer.span('start_date', sn) as span:
+                    try:
+                        # The fast form fill missed this field, so the whole span is fallback time
+                        self.tracer.mark_fallback(span)
+                        start_filled = False
+                        start_date_selectors = self.selector_cache.order(host, 'start_date', start_date_selectors)
+                        for selector, element in self.resolve_selectors(driver, start_date_selectors):
+                            try:
+                                # Method 1: Click to focus, clear, type, and confirm
+                                element.click()  # Focus the element first
+                                self.tracer.sleep(0.3, sn)
+
+                                # Clear field using multiple methods
+                                element.clear()
+                                element.send_keys(Keys.CONTROL + "a")  # Select all
+                                element.send_keys(Keys.DELETE)  # Delete selected
+                                self.tracer.sleep(0.2, sn)
+
+                                # Type date slowly
+                                for char in start_date_str:
+                                    element.send_keys(char)
+                                    self.tracer.sleep(0.05, sn)
+
+                                element.send_keys(Keys.ENTER)
+                                self.wait_for_value(driver, element, start_date_str)
+
+                                # Verify the value was set
+                                current_value = element.get_attribute('value')
+                                if start_date_str in current_value:
+                                    start_filled = True
+                                    self.log_message(f"  ✓ Filled start date: {start_date_str}")
+                                    break
+                                else:
+                                    self.log_message(
+                                        f"  ⚠️  Start date verification failed. "
+                                        f"Expected: {start_date_str}, Got: {current_value}")
+
+                                    # Method 2: Try JavaScript if normal method failed
+                                    try:
+                                        driver.execute_script(f"arguments[0].value = '{start_date_str}';", element)
+                                        driver.execute_script(
+                                            "arguments[0].dispatchEvent(new Event('input', { bubbles: true }));",
+                                            element)
+                                        driver.execute_script(
+                                            "arguments[0].dispatchEvent(new Event('change', { bubbles: true }));",
+                                            element)
+                                        self.wait_for_value(driver, element, start_date_str)
+
+                                        current_value = element.get_attribute('value')
+                                        if start_date_str in current_value:
+                                            start_filled = True
+                                            self.log_message(f"  ✓ Filled start date via JavaScript: {start_date_str}")
+                                            break
+                                    except:
+                                        continue
+
+                            except:
+                                continue
+
+                        self.selector_cache.record(host, 'start_date', start_date_selectors,
+                                                   selector if start_filled else None)
+
+                        if not start_filled:
+                            self.log_message(f"  ❌ Could not fill start date: {start_date_str}")
+                    except Exception as e:
+                        self.log_message(f"  ❌ Error filling start date: {str(e)}")
+
+            # Fallback: fill end date
+            if 'end_date' in missed:
+                with self.tracer.span('end_date', sn) as span:
+                    try:
+                        # The fast form fill missed this field, so the whole span is fallback time
+                        self.tracer.mark_fallback(span)
+                        end_filled = False
+                        end_date_selectors = self.selector_cache.order(host, 'end_date', end_date_selectors)
+                        for selector, element in self.resolve_selectors(driver, end_date_selectors):
+                            try:
+                                # Method 1: Click to focus, clear, type, and confirm
+                                element.click()  # Focus the element first
+                                self.tracer.sleep(0.3, sn)
+
+                                # Clear field using multiple methods
+                                element.clear()
+                                element.send_keys(Keys.CONTROL + "a")  # Select all
+                                element.send_keys(Keys.DELETE)  # Delete selected
+                                self.tracer.sleep(0.2, sn)
+
+                                # Type date slowly
+                                for char in end_date_str:
+                                    element.send_keys(char)
+                                    self.tracer.sleep(0.05, sn)
+
+                                element.send_keys(Keys.ENTER)
+                                self.wait_for_value(driver, element, end_date_str)
+
+                                # Verify the value was set
+                                current_value = element.get_attribute('value')
+                                if end_date_str in current_value:
+                                    end_filled = True
+                                    self.log_message(f"  ✓ Filled end date: {end_date_str}")
+                                    break
+                                else:
+                                    self.log_message(
+                                        f"  ⚠️  End date verification failed. "
+                                        f"Expected: {end_date_str}, Got: {current_value}")
+
+                                    # Method 2: Try JavaScript if normal method failed
+                                    try:
+                                        driver.execute_script(f"arguments[0].value = '{end_date_str}';", element)
+                                        driver.execute_script(
+                                            "arguments[0].dispatchEvent(new Event('input', { bubbles: true }));",
+                                            element)
+                                        driver.execute_script(
+                                            "arguments[0].dispatchEvent(new Event('change', { bubbles: true }));",
+                                            element)
+                                        self.wait_for_value(driver, element, end_date_str)
+
+                                        current_value = element.get_attribute('value')
+                                        if end_date_str in current_value:
+                                            end_filled = True
+                                            self.log_message(f"  ✓ Filled end date via JavaScript: {end_date_str}")
+                                            break
+                                    except:
+                                        continue
+
+                            except:
+                                continue
+
+                        self.selector_cache.record(host, 'end_date', end_date_selectors,
+                                                   selector if end_filled else None)
+
+                        if not end_filled:
+                            self.log_message(f"  ❌ Could not fill end date: {end_date_str}")
+                    except Exception as e:
+                        self.log_message(f"  ❌ Error filling end date: {str(e)}")
+
+            # Fallback: enter equipment SN
+            if 'sn' in missed:
+                with self.tracer.span('sn', sn) as span:
+                    try:
+                        # The fast form fill missed this field, so the whole span is fallback time
+                        self.tracer.mark_fallback(span)
+                        sn_filled = False
+                        sn_selectors = self.selector_cache.order(host, 'sn', sn_selectors)
+                        for selector, element in self.resolve_selectors(driver, sn_selectors):
+                            try:
+                                element.clear()
+                                element.send_keys(sn)
+                                element.send_keys(Keys.ENTER)
+                                sn_filled = True
+                                self.log_message(f"  ✓ Filled equipment SN: {sn}")
+                                break
+                            except:
+                                continue
+
+                        self.selector_cache.record(host, 'sn', sn_selectors, selector if sn_filled else None)
+
+                        if not sn_filled:
+                            self.log_message(f"  ❌ Could not fill equipment SN: {sn}")
+                            return SELECTOR_MISS
+                    except Exception as e:
+                        self.log_message(f"  ❌ Error filling equipment SN {sn}: {str(e)}")
+                        return self.classify_exception(e)
+
+            # Click query button
+            with self.tracer.span('query', sn) as span:
+                try:
+                    query_selectors = [
+                        'button:has-text("查詢")',
+                        'button:has-text("查询")',
+                        'text=查詢',
+                        'text=查询',
+                        'button.el-button--warning',
+                        '[role="button"]:has-text("查詢")',
+                        '[role="button"]:has-text("查询")'
+                    ]
+
+                    request_seq = self.get_request_seq(driver)
+                    server_errors = self.get_server_errors(driver)
+
+                    query_clicked = False
+                    query_selectors = self.selector_cache.order(host, 'query', query_selectors)
+                    for selector, element in self.resolve_selectors(driver, query_selectors):
+                        if selector != query_selectors[0]:
+                            self.tracer.mark_fallback(span)
+                        try:
+                            element.click()
+                            query_clicked = True
+                            self.log_message("  ✓ Clicked query button")
+                            break
+                        except:
+                            continue
+
+                    self.selector_cache.record(host, 'query', query_selectors, selector if query_clicked else None)
+
+                    if not query_clicked:
+                        self.log_message("  ❌ Could not click query button")
+                        return SELECTOR_MISS
+
+                    # Wait for data to load
+                    self.log_message("  ⏳ Waiting for data to load...")
+                    if not self.wait_for_network_response(driver, request_seq):
+                        self.log_message("  ⚠️  No query response received, checking page state...")
+                    self.wait_for_loading_mask(driver)
+
+                    if self.get_server_errors(driver) > server_errors:
+                        self.log_message(f"  ❌ Portal returned a server error for SN: {sn}")
+                        return SERVER_ERROR
+
+                except Exception as e:
+                    self.log_message(f"  ❌ Error clicking query button: {str(e)}")
+                    return self.classify_exception(e)
+
+            # Check if data exists and click download
+            with self.tracer.span('export', sn) as span:
+                try:
+                    download_selectors = [
+                        'button:has-text("導出文件")',
+                        'button:has-text("导出文件")',
+                        'text=導出文件',
+                        'text=导出文件',
+                        '[role="button"]:has-text("導出文件")',
+                        '[role="button"]:has-text("导出文件")',
+                        'div:has-text("導出文件")'
+                    ]
+
+                    if tracker:
+                        # Point Chrome at a fresh folder for this export only
+                        self.set_download_folder(driver, tracker.prepare((sn, start_date, end_date)))
+
+                    request_seq = self.get_request_seq(driver)
+
+                    download_clicked = False
+                    download_selectors = self.selector_cache.order(host, 'download', download_selectors)
+                    for selector, element in self.resolve_selectors(driver, download_selectors):
+                        if selector != download_selectors[0]:
+                            self.tracer.mark_fallback(span)
+                        try:
+                            element.click()
+                            download_clicked = True
+                            self.log_message(f"  ✓ Download initiated for SN: {sn}")
+                            break
+                        except:
+                            continue
+
+                    self.selector_cache.record(
+                        host, 'download', download_selectors, selector if download_clicked else None
+                    )
+
+                    if download_clicked:
+                        # Wait for the export response to arrive
+                        self.wait_for_network_response(driver, request_seq)
+
+                        # Anything but a file means no file will follow: no data, or a failure to retry
+                        response = self.get_last_response(driver, request_seq)
+                        if response:
+                            body = response['body'] or ''
+                            status = classify_export_response(
+                                response['status'], response['contentType'], response['disposition'], body
+                            )
+                            if status == NO_DATA:
+                                self.log_message(f"  ⚠️  No data available for SN: {sn}")
+                                return NO_DATA
+                            if status != DOWNLOAD_OK:
+                                self.log_message(
+                                    f"  ❌ Export failed for SN {sn}: HTTP {response['status']} {body[:200]}"
+                                )
+                                return status
+
+                        if tracker and not tracker.wait_for_start((sn, start_date, end_date)):
+                            self.log_message(f"  ⚠️  Export did not start a download for SN: {sn}")
+                            return TIMEOUT
+                        return DOWNLOAD_OK
+                    else:
+                        self.log_message(f"  ⚠️  No data available or could not find download button for SN: {sn}")
+                        return SELECTOR_MISS
+
+                except Exception as e:
+                    self.log_message(f"  ❌ Error during download for SN {sn}: {str(e)}")
+                    return self.classify_exception(e)
+
+        except Exception as e:
+            self.log_message(f"❌ Error processing SN {sn}: {str(e)}")
+            return self.classify_exception(e)
+
+    def classify_exception(self, error):
+        """Map an exception raised during a download attempt to a RetryPolicy status"""
+        if isinstance(error, TimeoutException):
+            return TIMEOUT
+        return ERROR
+
+    def download_with_retry(self, driver, sn, start_date, end_date, export_url, tracker=None):
+        """Download one SN, retrying transient failures with backoff while the circuit breaker allows it"""
+        attempt = 0
+        while True:
+            # Hold off while the portal looks degraded
+            wait_time = self.circuit_breaker.get_wait_time()
+            while wait_time > 0:
+                self.tracer.sleep(wait_time, sn, kind='circuit_breaker')
+                wait_time = self.circuit_breaker.get_wait_time()
+
+            with self.tracer.span('attempt', sn) as span:
+                status = self.download_data_for_sn(driver, sn, start_date, end_date, tracker)
+                span['status'] = status
+
+            if self.circuit_breaker.record(status):
+                self.log_message(
+                    f"⛔ Portal looks degraded, pausing for {self.circuit_breaker.cooldown:.0f}s"
+                )
+
+            if not self.retry_policy.should_retry(status, attempt):
+                return status
+
+            delay = self.retry_policy.get_delay(attempt)
+            attempt += 1
+            self.log_message(f"  🔁 Retrying SN {sn} ({status}) in {delay:.1f}s, attempt {attempt + 1}")
+            self.tracer.sleep(delay, sn, kind='backoff')
+
+            # Start the retry from a freshly loaded export form
+            try:
+                with self.tracer.span('export_page', sn):
+                    driver.get(export_url)
+                    self.wait_for_export_form(driver)
+            except WebDriverException as e:
+                self.log_message(f"  ⚠️  Could not reload export page: {str(e)}")
+
+    def login(self, driver, data):
+        """Log in through the login page form"""
+        # Navigate to login page
+        self.log_message(f"🌐 Navigating to {data['website']}")
+        driver.get(data['website'])
+
+        # Login
+        self.log_message("🔐 Logging in...")
+
+        # Fill username
+        try:
+            username_selectors = [
+                'input[placeholder*="賬號"]',
+                'input[placeholder*="账号"]',
+                'input[placeholder*="用户名"]',
+                'input[aria-label*="賬號"]',
+                'input[aria-label*="账号"]',
+                'input[type="text"]',
+                '#el-id-215-31'
+            ]
+
+            username_element = self.fill_input_by_selectors(driver, username_selectors, 'username', data['username'])
+            if username_element:
+                username_element.send_keys(Keys.TAB)
+                self.log_message(f"✓ Filled username: {data['username']}")
+            else:
+                raise Exception("Could not fill username")
+
+        except Exception as e:
+            self.log_message(f"❌ Error filling username: {str(e)}")
+            return False
+
+        # Fill password
+        try:
+            password_selectors = [
+                'input[placeholder*="密碼"]',
+                'input[placeholder*="密码"]',
+                'input[type="password"]',
+                'input[aria-label*="密碼"]',
+                'input[aria-label*="密码"]',
+                '#el-id-215-32'
+            ]
+
+            password_element = self.fill_input_by_selectors(driver, password_selectors, 'password', data['password'])
+            if password_element:
+                password_element.send_keys(Keys.ENTER)
+                self.log_message("✓ Password filled successfully")
+                self.wait_for_login(driver, password_element)
+            else:
+                raise Exception("Could not fill password")
+
+        except Exception as e:
+            self.log_message(f"❌ Error filling password: {str(e)}")
+            return False
+
+        self.log_message("✅ Login successful")
+        return True
+
+    def check_session(self, driver, timeout=15):
+        """Check that the current page shows the export form rather than the login form"""
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=0.1).until(EC.visibility_of_any_elements_located(
+                (By.CSS_SELECTOR, f'{EXPORT_FORM_SELECTOR}, input[type="password"]')))
+            password_inputs = driver.find_elements(By.CSS_SELECTOR, 'input[type="password"]')
+            return not any(element.is_displayed() for element in password_inputs)
+        except (TimeoutException, WebDriverException):
+            return False
+
+    def restore_session(self, driver, data, state, export_url):
+        """Load saved cookies and localStorage into the browser and check they are still accepted"""
+        try:
+            # Cookies and localStorage can only be set for the page's own origin
+            driver.get(data['website'])
+            driver.delete_all_cookies()
+            for cookie in self.session_cache.to_selenium_cookies(state):
+                try:
+                    driver.add_cookie(cookie)
+                except WebDriverException:
+                    continue
+
+            for origin in state.get('origins', []):
+                for item in origin.get('localStorage', []):
+                    driver.execute_script("localStorage.setItem(arguments[0], arguments[1]);",
+                                          item['name'], item['value'])
+
+            driver.get(export_url)
+            return self.check_session(driver)
+        except WebDriverException:
+            return False
+
+    def save_session(self, driver, data):
+        """Save the browser's cookies and localStorage for the next run"""
+        try:
+            local_storage = driver.execute_script(
+                "return Object.keys(localStorage).map(function (k) { return [k, localStorage.getItem(k)]; });")
+            origin = driver.execute_script("return location.origin;")
+            state = self.session_cache.from_selenium(driver.get_cookies(), origin, local_storage)
+            self.session_cache.save(data['website'], data['username'], state)
+        except WebDriverException as e:
+            self.log_message(f"⚠️  Could not save session: {str(e)}")
+
+    def build_summary(self, data, total_sns, successful, failed, failed_saves=0, error=None):
+        """Build the machine-readable result of a run"""
+        return {
+            'website': data['website'],
+            'start_date': data['start_date'].isoformat(),
+            'end_date': data['end_date'].isoformat(),
+            'download_folder': self.download_folder,
+            'total': total_sns,
+            'successful': successful,
+            'failed': failed,
+            'failed_saves': failed_saves,
+            'error': error
+        }
+
+    def create_driver(self, download_folder):
+        """Launch a Chrome instance that saves its downloads into download_folder"""
+        chrome_options = Options()
+
+        # Set download directory
+        prefs = {
+            "download.default_directory": download_folder,
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "safebrowsing.enabled": True
+        }
+        if self.block_resources:
+            prefs["profile.managed_default_content_settings.images"] = 2
+        chrome_options.add_experimental_option("prefs", prefs)
+
+        if self.headless:
+            chrome_options.add_argument("--headless=new")
+            chrome_options.add_argument("--window-size=1920,1080")
+            chrome_options.add_argument("--disable-gpu")
+            chrome_options.add_argument("--disable-dev-shm-usage")
+
+        driver = webdriver.Chrome(options=chrome_options)
+        try:
+            if not self.headless:
+                driver.maximize_window()
+            driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": NETWORK_TRACKER_JS})
+            if self.block_resources:
+                driver.execute_cdp_cmd("Network.enable", {})
+                driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+        except WebDriverException:
+            driver.quit()
+            raise
+        return driver
+
+    def set_download_folder(self, driver, folder):
+        """Make Chrome save the downloads started from now on into folder"""
+        driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": folder})
+
+    def start_session(self, driver, data, export_url, state, owns_cache=True):
+        """Log a driver in, reusing a saved session state if the portal still accepts it.
+
+        Only the driver that owns the session cache (the first worker's) clears
+        or replaces the saved session; the others log in on their own driver
+        and leave the cache alone. Returns True once the export form is shown.
+        """
+        logged_in = False
+        if state:
+            self.log_message("🔑 Checking saved session...")
+            with self.tracer.span('session_check'):
+                logged_in = self.restore_session(driver, data, state, export_url)
+            if logged_in:
+                self.log_message("✅ Reused saved session, skipping login")
+            else:
+                self.log_message("⚠️  Saved session expired, logging in again")
+                if owns_cache:
+                    self.session_cache.clear(data['website'], data['username'])
+
+        if not logged_in:
+            with self.tracer.span('login') as span:
+                span['ok'] = self.login(driver, data)
+            if not span['ok']:
+                return False
+            if owns_cache:
+                self.save_session(driver, data)
+
+            # Navigate directly to export page
+            self.log_message(f"📊 Navigating to export page: {export_url}")
+            with self.tracer.span('export_page'):
+                driver.get(export_url)
+                self.wait_for_export_form(driver)
+        else:
+            self.wait_for_export_form(driver)
+        return True
+
+    def get_worker_folder(self, n):
+        """Private download folder of the n-th Chrome instance; other downloads never land in it"""
+        return os.path.join(self.download_folder, f".envdatadl_worker_{n + 1}")
+
+    def get_download_filename(self, sn, start_date, end_date, chrome_filename):
+        """Build a deterministic filename for an SN and date range"""
+        extension = os.path.splitext(chrome_filename)[1] or '.xlsx'
+        safe_sn = re.sub(r'[^\w.-]', '_', sn)
+        return f"{safe_sn}_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}{extension}"
+
+    def store_download(self, path, sn, start_date, end_date):
+        """Move a finished download into the download folder under its SN and date range"""
+        target = os.path.join(
+            self.download_folder, self.get_download_filename(sn, start_date, end_date, os.path.basename(path))
+        )
+        os.replace(path, target)
+        return target
+
+    def quarantine_downloads(self, tracker):
+        """Move the files no SN could be credited with out of a worker folder, so they are never taken for data"""
+        for name in tracker.quarantine(os.path.join(self.download_folder, QUARANTINE_FOLDER)):
+            self.log_message(f"⚠️  Unmatched download moved to {QUARANTINE_FOLDER}: {name}")
+
+    def record_result(self, data, sn, status, results):
+        """Record one SN's outcome in the run results and, for failures, in the job ledger"""
+        with results['lock']:
+            results['completed'] += 1
+            if status == DOWNLOAD_OK:
+                results['successful'] += 1
+            else:
+                self.ledger.mark_failed(data['website'], sn, data['start_date'], data['end_date'], status)
+                results['failed'].append({
+                    'sn': sn,
+                    'start_date': data['start_date'].isoformat(),
+                    'end_date': data['end_date'].isoformat(),
+                    'status': status
+                })
+            self.set_progress((results['completed'] / results['total']) * 100)
+
+    def download_worker(self, n, data, export_url, task_queue, results, session):
+        """Run one Chrome instance: log in, then download SNs from the shared queue until it is empty.
+
+        The first worker logs in (or restores the saved session); the others
+        wait for it and reuse its session instead of logging in again.
+        """
+        worker_folder = self.get_worker_folder(n)
+        # Files left behind by an interrupted run belong to no SN of this one
+        self.quarantine_downloads(DownloadTracker(worker_folder))
+        os.makedirs(worker_folder, exist_ok=True)
+        tracker = DownloadTracker(worker_folder)
+        if not tracker.start() and n == 0:
+            self.log_message("⚠️  watchdog is not installed, polling the download folders instead "
+                             "(pip install -r requirements.txt)")
+        driver = None
+        downloaded_sns = []
+        try:
+            # Chrome starts in every worker at once, then the others wait for the first worker's session
+            with self.tracer.span('launch'):
+                driver = self.create_driver(worker_folder)
+            if n > 0:
+                session['ready'].wait()
+                if not session['logged_in']:
+                    return
+                state = session['state']
+            else:
+                state = self.session_cache.load(data['website'], data['username'])
+
+            logged_in = self.start_session(driver, data, export_url, state, owns_cache=n == 0)
+            if n == 0:
+                session['logged_in'] = logged_in
+                session['state'] = self.session_cache.load(data['website'], data['username']) if logged_in else None
+                session['ready'].set()
+            if not logged_in:
+                return
+
+            while not self.cancelled.is_set():
+                try:
+                    i, sn = task_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                self.log_message(f"\n📍 Processing {i + 1}/{results['total']}")
+                status = self.download_with_retry(
+                    driver, sn, data['start_date'], data['end_date'], export_url, tracker
+                )
+                if status == DOWNLOAD_OK:
+                    downloaded_sns.append(sn)
+                self.record_result(data, sn, status, results)
+
+            # Returns as soon as every download of this instance is complete
+            with self.tracer.span('save', files=len(downloaded_sns)):
+                paths = tracker.wait_for_completion()
+            for sn in downloaded_sns:
+                path = paths.get((sn, data['start_date'], data['end_date']))
+                if path:
+                    path = self.store_download(path, sn, data['start_date'], data['end_date'])
+                    self.log_message(f"💾 Downloaded: {os.path.basename(path)}")
+                    self.ledger.mark_done(data['website'], sn, data['start_date'], data['end_date'], path)
+                else:
+                    self.log_message(f"⚠️  Download for SN {sn} did not finish in time")
+                    self.ledger.mark_failed(data['website'], sn, data['start_date'], data['end_date'],
+                                            "download incomplete")
+                    with results['lock']:
+                        results['failed_saves'] += 1
+
+        except Exception as e:
+            self.log_message(f"❌ Worker {n + 1} error: {str(e)}")
+        finally:
+            # Never leave the other workers waiting for a session
+            if n == 0:
+                session['ready'].set()
+            tracker.stop()
+            if driver:
+                driver.quit()
+            # Once Chrome is gone, whatever is left in the worker folder was not credited to an SN
+            self.quarantine_downloads(tracker)
+
+    def run_workers(self, data, export_url, pending_sns, results, session):
+        """Run the Chrome pool on worker threads, relaying their log and progress callbacks to this thread"""
+        worker_count = min(self.worker_count, len(pending_sns))
+
+        task_queue = queue.Queue()
+        for task in pending_sns:
+            task_queue.put_nowait(task)
+
+        # Worker threads queue their callbacks; they run here, on the caller's (e.g. the UI) thread
+        events = queue.Queue()
+        log_message, set_progress = self.log_message, self.set_progress
+        self.log_message = lambda message: events.put((log_message, message))
+        self.set_progress = lambda progress: events.put((set_progress, progress))
+        try:
+            threads = [
+                threading.Thread(
+                    target=self.download_worker,
+                    args=(n, data, export_url, task_queue, results, session),
+                    daemon=True
+                )
+                for n in range(worker_count)
+            ]
+            log_message(f"🚀 Starting to process {len(pending_sns)} equipment(s) with {worker_count} browser(s)...")
+            for thread in threads:
+                thread.start()
+
+            while any(thread.is_alive() for thread in threads):
+                try:
+                    callback, value = events.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                callback(value)
+        finally:
+            self.log_message, self.set_progress = log_message, set_progress
+
+        while not events.empty():
+            callback, value = events.get_nowait()
+            callback(value)
+
+        # SNs left in the queue when every worker stopped early after logging in; a cancelled run leaves them pending
+        while session['logged_in'] and not self.cancelled.is_set() and not task_queue.empty():
+            i, sn = task_queue.get_nowait()
+            self.record_result(data, sn, ERROR, results)
+
+    def run_automation(self, data):
+        """Run the web automation process and return its summary (see build_summary)"""
+        # Skip SN/date pairs that an earlier, interrupted run already downloaded
+        self.ledger = JobLedger(self.download_folder)
+        total_sns = len(data['equipment_sns'])
+        pending_sns = [
+            (i, sn) for i, sn in enumerate(data['equipment_sns'])
+            if not self.ledger.is_done(data['website'], sn, data['start_date'], data['end_date'])
+        ]
+        skipped = total_sns - len(pending_sns)
+
+        # SNs finished by an earlier run count as done
+        results = {
+            'lock': threading.Lock(),
+            'total': total_sns,
+            'completed': skipped,
+            'successful': skipped,
+            'failed': [],
+            'failed_saves': 0
+        }
+        session = {'ready': threading.Event(), 'logged_in': False, 'state': None}
+        error = None
+
+        if skipped:
+            self.log_message(f"⏭️  Skipping {skipped} equipment(s) already downloaded by a previous run")
+        if not pending_sns:
+            self.log_message("✅ All equipment already downloaded for this date range")
+            self.ledger.close()
+            return self.build_summary(data, total_sns, results['successful'], results['failed'])
+
+        try:
+            export_url = self.get_export_url(data['website'])
+            self.run_workers(data, export_url, pending_sns, results, session)
+
+            if not session['logged_in']:
+                error = "Login failed"
+            elif self.cancelled.is_set():
+                error = "Cancelled"
+                self.log_message(f"⏹️  Download cancelled: {results['completed']}/{total_sns} done, "
+                                 f"the rest will be downloaded by the next run")
+            else:
+                self.set_progress(100)
+                self.log_message(f"\n🎉 Process completed!")
+                self.log_message(f"📊 Success rate: {results['successful']}/{total_sns} downloads successful")
+                if results['failed_saves']:
+                    self.log_message(f"⚠️  {results['failed_saves']} download(s) did not finish in time")
+                self.log_message(f"📁 Files saved to: {self.download_folder}")
+                self.tracer.log_summary(self.log_message)
+
+        except Exception as e:
+            error = str(e)
+            self.log_message(f"❌ Automation error: {error}")
+        finally:
+            self.selector_cache.save()
+            self.ledger.close()
+
+        return self.build_summary(
+            data, total_sns, results['successful'], results['failed'], results['failed_saves'], error
+        )
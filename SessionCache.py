@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import time
+
+
+class SessionCache:
+    """Store authenticated browser sessions on disk, one file per website + username.
+
+    Sessions are kept in Playwright's storage state format (cookies plus
+    localStorage per origin) so both the Playwright and Selenium backends can
+    share them.
+    """
+
+    def __init__(self, cache_dir=None, max_age_hours=12):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".envdatadl", "sessions")
+        self.max_age_hours = max_age_hours
+
+    def get_path(self, website, username):
+        """Get the session file path for a website and username"""
+        key = hashlib.sha256(f"{website}|{username}".encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, website, username):
+        """Load a saved session, or None if there is none or it has expired"""
+        path = self.get_path(website, username)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age_hours * 3600:
+                return None
+
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Session cookies have expires == -1, persistent ones must still be valid
+        now = time.time()
+        cookies = state.get('cookies', [])
+        if cookies and all(0 < cookie.get('expires', -1) < now for cookie in cookies):
+            return None
+
+        return state
+
+    def save(self, website, username, state):
+        """Save a session, readable only by the current user"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.get_path(website, username)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        try:
+            os.chmod(path, 0o600)
+        except OSError:
+            pass
+
+    def clear(self, website, username):
+        """Remove a saved session, e.g. after it was rejected by the portal"""
+        try:
+            os.remove(self.get_path(website, username))
+        except OSError:
+            pass
+
+    def from_selenium(self, cookies, origin, local_storage):
+        """Build a storage state from Selenium cookies and localStorage items"""
+        return {
+            'cookies': [
+                {
+                    'name': cookie['name'],
+                    'value': cookie['value'],
+                    'domain': cookie.get('domain', ''),
+                    'path': cookie.get('path', '/'),
+                    'expires': cookie.get('expiry', -1),
+                    'httpOnly': cookie.get('httpOnly', False),
+                    'secure': cookie.get('secure', False),
+                    'sameSite': cookie.get('sameSite', 'Lax')
+                }
+                for cookie in cookies
+            ],
+            'origins': [
+                {
+                    'origin': origin,
+                    'localStorage': [{'name': name, 'value': value} for name, value in local_storage]
+                }
+            ]
+        }
+
+    def to_selenium_cookies(self, state):
+        """Convert storage state cookies to Selenium add_cookie() dictionaries"""
+        selenium_cookies = []
+        for cookie in state.get('cookies', []):
+            selenium_cookie = {
+                'name': cookie['name'],
+                'value': cookie['value'],
+                'path': cookie.get('path', '/'),
+                'secure': cookie.get('secure', False),
+                'httpOnly': cookie.get('httpOnly', False)
+            }
+            if cookie.get('expires', -1) > 0:
+                selenium_cookie['expiry'] = int(cookie['expires'])
+            selenium_cookies.append(selenium_cookie)
+        return selenium_cookies
@@ -0,0 +1,386 @@
+import copy
+import io
+import os
+import posixpath
+import re
+import struct
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ElementTree
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, to_excel
+
+SPREADSHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIP_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_RELATIONSHIP_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+CONTENT_TYPES_NS = 'http://schemas.openxmlformats.org/package/2006/content-types'
+CHART_NS = 'http://schemas.openxmlformats.org/drawingml/2006/chart'
+DRAWING_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+CHART_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.drawingml.chart+xml'
+WORKBOOK_PART = 'xl/workbook.xml'
+
+# Workbook elements that come after calcPr, so a new calcPr goes before the first of them
+AFTER_CALC_PROPERTIES = ('oleSize', 'customWorkbookViews', 'pivotCaches', 'smartTagPr', 'smartTagTypes',
+                         'webPublishing', 'fileRecoveryPr', 'webPublishObjects', 'extLst')
+
+# Row attributes that make an empty row worth keeping
+ROW_FORMAT_ATTRIBUTES = ('customHeight', 'hidden', 'customFormat', 'outlineLevel', 'collapsed')
+
+# Data rows written to the sheet part at a time, and bytes of rows kept in memory before spilling to disk
+ROWS_PER_WRITE = 1000
+SPOOL_SIZE = 8 * 1024 * 1024
+
+# Zip local file header: signature, fixed size before the name, and the general purpose flag for a data descriptor
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+LOCAL_HEADER_SIZE = 30
+DATA_DESCRIPTOR_FLAG = 0x08
+
+
+class PackageError(Exception):
+    """The template or a value cannot be patched safely at the package level; openpyxl has to do it"""
+
+
+def get_prefix(xml, namespace):
+    """The 'prefix:' a part's root element binds to namespace, '' for the default namespace, or None"""
+    root = re.search(r'<[^?!][^>]*>', xml)
+    match = re.search(r'xmlns(?::([\w.-]+))?="' + re.escape(namespace) + '"', root.group(0)) if root else None
+    if not match:
+        return None
+    return match.group(1) + ':' if match.group(1) else ''
+
+
+class TemplatePackage:
+    """An .xlsx template patched as a zip package instead of round-tripped through openpyxl.
+
+    The template is read once: the data sheet's XML is split into the part
+    before its rows, the template rows to keep and the part after them. Each
+    output streams new rows for columns A and B into that sheet part, rewrites
+    only the title text of the chart parts, has Excel recalculate formulas on
+    load, since their cached results are the template's, and copies every
+    other part as is.
+    Raises PackageError for templates that cannot be patched this way.
+    """
+
+    def __init__(self, template_file, data_sheet_name, start_row=2):
+        self.data_sheet_name = data_sheet_name
+        self.start_row = start_row
+        with open(template_file, 'rb') as f:
+            self.data = f.read()
+
+        try:
+            with zipfile.ZipFile(io.BytesIO(self.data)) as package:
+                self.sheet_part = self.find_sheet_part(package, data_sheet_name)
+                self.chart_parts = self.find_chart_parts(package)
+                workbook_xml = package.read(WORKBOOK_PART).decode('utf-8')
+                workbook = ElementTree.fromstring(workbook_xml)
+                styles = package.read('xl/styles.xml') if 'xl/styles.xml' in package.namelist() else None
+                self.parse_sheet(package.read(self.sheet_part).decode('utf-8'))
+        except (KeyError, zipfile.BadZipFile, ElementTree.ParseError, UnicodeDecodeError) as e:
+            raise PackageError(f"unreadable template package: {e}")
+
+        properties = workbook.find(f'{{{SPREADSHEET_NS}}}workbookPr')
+        date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+        self.epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+        date_styles = self.find_date_styles(styles)
+        self.date_columns = [style is not None and int(style) in date_styles for style in self.styles]
+        self.workbook_xml = self.force_full_calculation(workbook_xml).encode('utf-8')
+
+    def force_full_calculation(self, xml):
+        """Workbook part XML with fullCalcOnLoad set, so formulas are recalculated against the new data"""
+        p = get_prefix(xml, SPREADSHEET_NS)
+        if p is None:
+            raise PackageError("workbook part does not use the spreadsheet namespace at its root")
+
+        calc_properties = re.search(rf'<{p}calcPr\b([^>]*?)(/?)>', xml)
+        if calc_properties:
+            attributes = re.sub(r'\sfullCalcOnLoad="[^"]*"', '', calc_properties.group(1)).rstrip()
+            return (xml[:calc_properties.start()] + f'<{p}calcPr{attributes} fullCalcOnLoad="1"'
+                    + calc_properties.group(2) + '>' + xml[calc_properties.end():])
+
+        following = re.search(rf'<{p}(?:{"|".join(AFTER_CALC_PROPERTIES)})\b|</{p}workbook>', xml)
+        if not following:
+            raise PackageError("workbook part has no end tag")
+        return xml[:following.start()] + f'<{p}calcPr fullCalcOnLoad="1"/>' + xml[following.start():]
+
+    def find_sheet_part(self, package, sheet_name):
+        """Path of the named worksheet's part in the package"""
+        workbook = ElementTree.fromstring(package.read(WORKBOOK_PART))
+        relations = ElementTree.fromstring(package.read('xl/_rels/workbook.xml.rels'))
+        targets = {relation.get('Id'): relation.get('Target')
+                   for relation in relations.iter(f'{{{PACKAGE_RELATIONSHIP_NS}}}Relationship')}
+
+        for sheet in workbook.iter(f'{{{SPREADSHEET_NS}}}sheet'):
+            if sheet.get('name') == sheet_name:
+                target = targets.get(sheet.get(f'{{{RELATIONSHIP_NS}}}id'))
+                if not target:
+                    break
+                return target.lstrip('/') if target.startswith('/') else posixpath.normpath(
+                    posixpath.join('xl', target))
+        raise PackageError(f"sheet '{sheet_name}' not found in the package")
+
+    def find_chart_parts(self, package):
+        """Paths of all chart parts in the package"""
+        content_types = ElementTree.fromstring(package.read('[Content_Types].xml'))
+        return {override.get('PartName').lstrip('/')
+                for override in content_types.iter(f'{{{CONTENT_TYPES_NS}}}Override')
+                if override.get('ContentType') == CHART_CONTENT_TYPE}
+
+    def find_date_styles(self, styles):
+        """Indexes of the cell formats (the s attribute of cells) that show numbers as dates or times"""
+        if styles is None:
+            return set()
+        root = ElementTree.fromstring(styles)
+        formats = dict(BUILTIN_FORMATS)
+        for number_format in root.iter(f'{{{SPREADSHEET_NS}}}numFmt'):
+            formats[int(number_format.get('numFmtId'))] = number_format.get('formatCode')
+
+        cell_formats = root.find(f'{{{SPREADSHEET_NS}}}cellXfs')
+        if cell_formats is None:
+            return set()
+        return {index for index, cell_format in enumerate(cell_formats.findall(f'{{{SPREADSHEET_NS}}}xf'))
+                if is_date_format(formats.get(int(cell_format.get('numFmtId', 0)), 'General'))}
+
+    def parse_sheet(self, xml):
+        """Split the data sheet part around its rows and keep the template rows that are not replaced.
+
+        Rows above start_row are kept whole; from start_row down, cells in
+        columns A and B are dropped and the other columns are kept. The styles
+        of the first data row's A and B cells are used for the new cells.
+        """
+        p = get_prefix(xml, SPREADSHEET_NS)
+        if p is None:
+            raise PackageError("data sheet does not use the spreadsheet namespace at its root")
+        self.prefix = p
+
+        empty = re.search(rf'<{p}sheetData\s*/>', xml)
+        if empty:
+            self.sheet_head = xml[:empty.start()] + f'<{p}sheetData>'
+            self.sheet_tail = f'</{p}sheetData>' + xml[empty.end():]
+            rows_xml = ''
+        else:
+            start = re.search(rf'<{p}sheetData(\s[^>]*)?>', xml)
+            end = xml.rindex(f'</{p}sheetData>')
+            self.sheet_head = xml[:start.end()]
+            self.sheet_tail = xml[end:]
+            rows_xml = xml[start.end():end]
+
+        self.rows = []
+        self.styles = [None, None]
+        self.max_column = 2
+        row_pattern = re.compile(rf'<{p}row\b([^>]*?)(?:/>|>(.*?)</{p}row>)', re.S)
+        cell_pattern = re.compile(rf'<{p}c\b([^>]*?)(?:/>|>(.*?)</{p}c>)', re.S)
+        for row_match in row_pattern.finditer(rows_xml):
+            attributes, content = row_match.group(1), row_match.group(2) or ''
+            number = re.search(r'\sr="(\d+)"', attributes)
+            if not number:
+                raise PackageError("data sheet has rows without a row number")
+            row = int(number.group(1))
+            # Row spans are only a hint and go stale once cells change
+            attributes = re.sub(r'\sspans="[^"]*"', '', attributes)
+
+            kept_cells = []
+            for cell_match in cell_pattern.finditer(content):
+                reference = re.search(r'\sr="([A-Z]+)\d+"', cell_match.group(1))
+                if not reference:
+                    raise PackageError("data sheet has cells without a reference")
+                column = column_index_from_string(reference.group(1))
+                self.max_column = max(self.max_column, column)
+
+                if row < self.start_row or column > 2:
+                    kept_cells.append(cell_match.group(0))
+                    continue
+                if re.search(rf'<{p}f[\s>/]', cell_match.group(2) or ''):
+                    raise PackageError(f"data sheet has a formula in {reference.group(1)}{row}")
+                if row == self.start_row:
+                    style = re.search(r'\ss="(\d+)"', cell_match.group(1))
+                    self.styles[column - 1] = style.group(1) if style else None
+
+            if kept_cells or any(name in attributes for name in ROW_FORMAT_ATTRIBUTES):
+                self.rows.append((row, attributes, ''.join(kept_cells)))
+
+        self.rows.sort(key=lambda template_row: template_row[0])
+
+    def cell_xml(self, row, column, value):
+        """XML of a new A or B cell holding value"""
+        p = self.prefix
+        style = self.styles[column - 1]
+        attributes = f' r="{"AB"[column - 1]}{row}"' + (f' s="{style}"' if style else '')
+
+        if isinstance(value, bool):
+            return f'<{p}c{attributes} t="b"><{p}v>{int(value)}</{p}v></{p}c>'
+        if isinstance(value, (int, float, Decimal)):
+            return f'<{p}c{attributes}><{p}v>{value}</{p}v></{p}c>'
+        if isinstance(value, (datetime, date, time, timedelta)):
+            if not self.date_columns[column - 1]:
+                raise PackageError(f"date in column {'AB'[column - 1]} of the template without a date format")
+            return f'<{p}c{attributes}><{p}v>{to_excel(value, self.epoch)}</{p}v></{p}c>'
+        if isinstance(value, str):
+            if ILLEGAL_CHARACTERS_RE.search(value):
+                raise PackageError(f"illegal character in row {row}")
+            if value.startswith('=') and len(value) > 1:
+                return f'<{p}c{attributes}><{p}f>{escape(value[1:])}</{p}f></{p}c>'
+            space = ' xml:space="preserve"' if value != value.strip() else ''
+            return f'<{p}c{attributes} t="inlineStr"><{p}is><{p}t{space}>{escape(value)}</{p}t></{p}is></{p}c>'
+        raise PackageError(f"unsupported value type {type(value).__name__} in row {row}")
+
+    def row_xml(self, row, template_row, values=()):
+        """XML of a row: the new A and B cells followed by the cells kept from the template row"""
+        p = self.prefix
+        attributes, kept_cells = (template_row[1], template_row[2]) if template_row else (f' r="{row}"', '')
+        cells = ''.join(self.cell_xml(row, column, value) for column, value in enumerate(values, start=1)
+                        if value is not None)
+        return f'<{p}row{attributes}>{cells}{kept_cells}</{p}row>'
+
+    def write_sheet(self, output, info, data_rows):
+        """Stream the data sheet part with data_rows merged into the template rows; returns the rows written"""
+        rows_copied = 0
+        last_row = 0
+        template_rows = iter(self.rows)
+        template_row = next(template_rows, None)
+
+        # Rows go to a spool first, so the dimension at the top of the part can cover them
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+            chunk = []
+            for row, values in data_rows:
+                while template_row and template_row[0] < row:
+                    chunk.append(self.row_xml(template_row[0], template_row))
+                    last_row = template_row[0]
+                    template_row = next(template_rows, None)
+
+                same_row = template_row if template_row and template_row[0] == row else None
+                if same_row:
+                    template_row = next(template_rows, None)
+                chunk.append(self.row_xml(row, same_row, values))
+                last_row = row
+                rows_copied += 1
+
+                if len(chunk) >= ROWS_PER_WRITE:
+                    spool.write(''.join(chunk).encode('utf-8'))
+                    chunk = []
+
+            while template_row:
+                chunk.append(self.row_xml(template_row[0], template_row))
+                last_row = template_row[0]
+                template_row = next(template_rows, None)
+            spool.write(''.join(chunk).encode('utf-8'))
+
+            dimension = f'A1:{get_column_letter(self.max_column)}{last_row}' if last_row else 'A1'
+            head = re.sub(rf'(<{self.prefix}dimension\s+ref=")[^"]*"', rf'\g<1>{dimension}"', self.sheet_head,
+                          count=1)
+
+            part_info = zipfile.ZipInfo(info.filename, info.date_time)
+            part_info.compress_type = info.compress_type
+            with output.open(part_info, 'w') as stream:
+                stream.write(head.encode('utf-8'))
+                spool.seek(0)
+                while True:
+                    block = spool.read(1024 * 1024)
+                    if not block:
+                        break
+                    stream.write(block)
+                stream.write(self.sheet_tail.encode('utf-8'))
+
+        return rows_copied
+
+    def copy_part(self, output, info):
+        """Copy an untouched part into output as it is stored in the template, without recompressing it"""
+        header = self.data[info.header_offset:info.header_offset + LOCAL_HEADER_SIZE]
+        if header[:4] != LOCAL_HEADER_SIGNATURE:
+            raise PackageError(f"part {info.filename} has no local file header")
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        start = info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length
+        compressed = self.data[start:start + info.compress_size]
+
+        # zipfile has no raw copy, so the part is appended the way ZipFile.writestr does it; CRC and sizes go in the
+        # local header instead of a trailing data descriptor
+        part_info = copy.copy(info)
+        part_info.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+        output.fp.seek(output.start_dir)
+        part_info.header_offset = output.fp.tell()
+        output.fp.write(part_info.FileHeader())
+        output.fp.write(compressed)
+        output.start_dir = output.fp.tell()
+        output.filelist.append(part_info)
+        output.NameToInfo[part_info.filename] = part_info
+
+    def retitle_chart(self, xml, title):
+        """Chart part XML with the chart's title text set to title, leaving the title's formatting alone"""
+        c = get_prefix(xml, CHART_NS)
+        if c is None:
+            raise PackageError("chart part does not use the chart namespace at its root")
+        a = get_prefix(xml, DRAWING_NS)
+        declaration = '' if a is not None else f' xmlns:a="{DRAWING_NS}"'
+        a = 'a:' if a is None else a
+        rich = (f'<{c}tx><{c}rich{declaration}><{a}bodyPr/><{a}p><{a}r><{a}t>{escape(title)}</{a}t></{a}r></{a}p>'
+                f'</{c}rich></{c}tx>')
+
+        chart = re.search(rf'<{c}chart(\s[^>]*)?>', xml)
+        if not chart:
+            raise PackageError("chart part has no chart element")
+        position = chart.end()
+
+        # The chart's own title is the first child of the chart element; axes have titles too
+        empty_title = re.compile(rf'\s*<{c}title(\s[^>]*)?/>').match(xml, position)
+        if empty_title:
+            return xml[:position] + f'<{c}title>{rich}<{c}overlay val="0"/></{c}title>' + xml[empty_title.end():]
+
+        existing_title = re.compile(rf'\s*<{c}title(\s[^>]*)?>(.*?)</{c}title>', re.S).match(xml, position)
+        if not existing_title:
+            xml = re.sub(rf'<{c}autoTitleDeleted val="(1|true)"\s*/>', f'<{c}autoTitleDeleted val="0"/>', xml,
+                         count=1)
+            return xml[:position] + f'<{c}title>{rich}<{c}overlay val="0"/></{c}title>' + xml[position:]
+
+        content = existing_title.group(2)
+        text = re.search(rf'<{c}tx>(.*?)</{c}tx>', content, re.S)
+        runs = list(re.finditer(rf'<{a}t(\s[^>]*)?>(.*?)</{a}t>', text.group(1), re.S)) if text else []
+        if text and runs and not declaration:
+            # Put the title in the first text run and empty the others, keeping their formatting
+            rich_text = text.group(1)
+            for run in reversed(runs):
+                new_text = escape(title) if run is runs[0] else ''
+                rich_text = rich_text[:run.start(2)] + new_text + rich_text[run.end(2):]
+            content = content[:text.start(1)] + rich_text + content[text.end(1):]
+        elif text:
+            content = content[:text.start()] + rich + content[text.end():]
+        else:
+            content = rich + content
+
+        return xml[:existing_title.start(2)] + content + xml[existing_title.end(2):]
+
+    def save(self, data_rows, title, output_path):
+        """Write an output package with data_rows in the data sheet and title on every chart.
+
+        data_rows yields (row, (time, reading)) in row order. Returns the number
+        of rows written and of charts retitled. Nothing is left at output_path
+        if it fails.
+        """
+        charts_updated = 0
+        try:
+            with zipfile.ZipFile(io.BytesIO(self.data)) as template, \
+                    zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as output:
+                for info in template.infolist():
+                    if info.filename == self.sheet_part:
+                        rows_copied = self.write_sheet(output, info, data_rows)
+                    elif info.filename in self.chart_parts:
+                        try:
+                            xml = template.read(info).decode('utf-8')
+                        except UnicodeDecodeError as e:
+                            raise PackageError(f"chart part {info.filename} is not UTF-8: {e}")
+                        output.writestr(info, self.retitle_chart(xml, title).encode('utf-8'))
+                        charts_updated += 1
+                    elif info.filename == WORKBOOK_PART:
+                        output.writestr(info, self.workbook_xml)
+                    else:
+                        self.copy_part(output, info)
+        except BaseException:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+
+        return rows_copied, charts_updated
@@ -0,0 +1,82 @@
+import queue
+import tkinter as tk
+
+
+class UiEventQueue:
+    """Pass log lines, progress updates and callbacks from worker threads to the Tk thread.
+
+    Any thread may call log_message, set_progress, clear and call; they only
+    put an event on a queue. The Tk thread drains the queue every interval_ms,
+    inserting all pending log lines with a single Text insert, so a busy run
+    never blocks or re-enters the UI. The log keeps the last max_lines lines.
+    """
+
+    def __init__(self, root, log_text, progress_var=None, max_lines=5000, interval_ms=100, batch_size=2000):
+        self.root = root
+        self.log_text = log_text
+        self.progress_var = progress_var
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+
+    def start(self):
+        """Start draining the queue on the Tk thread"""
+        self.root.after(self.interval_ms, self.drain)
+
+    def log_message(self, message):
+        self.queue.put(('log', message))
+
+    def set_progress(self, progress):
+        self.queue.put(('progress', progress))
+
+    def clear(self):
+        """Clear the log, after the lines queued before"""
+        self.queue.put(('clear', None))
+
+    def call(self, callback, *args, **kwargs):
+        """Run callback on the Tk thread, after the events queued before it"""
+        self.queue.put(('call', (callback, args, kwargs)))
+
+    def write_lines(self, lines):
+        """Append lines to the log in one insert and drop the oldest lines beyond max_lines"""
+        self.log_text.insert(tk.END, '\n'.join(lines) + '\n')
+        line_count = int(self.log_text.index('end-1c').split('.')[0]) - 1
+        if line_count > self.max_lines:
+            self.log_text.delete('1.0', f"{line_count - self.max_lines + 1}.0")
+        self.log_text.see(tk.END)
+
+    def drain(self):
+        """Apply up to batch_size queued events, then schedule the next drain"""
+        lines = []
+        progress = None
+        try:
+            for _ in range(self.batch_size):
+                try:
+                    kind, value = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                if kind == 'log':
+                    lines.append(value)
+                    continue
+                if kind == 'progress':
+                    progress = value
+                    continue
+
+                # Clears and callbacks must see the log lines queued before them
+                if lines:
+                    self.write_lines(lines)
+                    lines = []
+                if kind == 'clear':
+                    self.log_text.delete('1.0', tk.END)
+                else:
+                    callback, args, kwargs = value
+                    callback(*args, **kwargs)
+
+            if lines:
+                self.write_lines(lines)
+            if progress is not None and self.progress_var is not None:
+                self.progress_var.set(progress)
+        finally:
+            self.root.after(self.interval_ms, self.drain)